@@ -10,6 +10,11 @@ DROP TABLE IF EXISTS insegnamenti_cds CASCADE;
 DROP TABLE IF EXISTS insegnamento_docente CASCADE;
 DROP TABLE IF EXISTS preferenze_utenti CASCADE;
 DROP TABLE IF EXISTS esami CASCADE;
+DROP TABLE IF EXISTS esami_slot_conflitti CASCADE;
+DROP TABLE IF EXISTS versioni_esami CASCADE;
+DROP TABLE IF EXISTS esami_eliminati CASCADE;
+DROP TABLE IF EXISTS riepilogo_esami CASCADE;
+DROP TABLE IF EXISTS jobs CASCADE;
 
 -- Tabella 'aule'
 CREATE TABLE aule (
@@ -169,6 +174,7 @@ CREATE TABLE esami (
     posti INTEGER,                        -- Numero di posti disponibili
     codice_turno TEXT,                    -- Codice identificativo del turno (Non serve al DMI)
     mostra_nel_calendario BOOLEAN DEFAULT TRUE, -- Flag per mostrare l'esame nel calendario
+    versione BIGINT NOT NULL DEFAULT 0,   -- Versione dei dati dell'anno in cui l'esame è stato modificato
     FOREIGN KEY (docente) REFERENCES utenti(username) ON DELETE CASCADE,
     FOREIGN KEY (insegnamento) REFERENCES insegnamenti(id) ON DELETE CASCADE,
     FOREIGN KEY (aula) REFERENCES aule(nome) ON DELETE SET NULL,
@@ -180,6 +186,65 @@ CREATE TABLE esami (
     CONSTRAINT check_posti CHECK (posti > 0)
 );
 
+-- Tabella 'esami_slot_conflitti' (slot data/periodo in cui un insegnamento ha almeno una sovrapposizione)
+-- Il contatore insegnamenti_cds.sovrapposizioni è il numero di righe per (insegnamento, cds, anno_accademico)
+CREATE TABLE esami_slot_conflitti (
+    insegnamento TEXT,          -- ID dell'insegnamento
+    cds TEXT,                   -- Codice del corso di studio
+    anno_accademico INT,        -- Anno accademico
+    data_appello DATE,          -- Data dello slot
+    periodo INT,                -- Periodo dello slot (0 mattina, 1 pomeriggio)
+    PRIMARY KEY (insegnamento, cds, anno_accademico, data_appello, periodo),
+    FOREIGN KEY (insegnamento) REFERENCES insegnamenti(id) ON DELETE CASCADE
+);
+
+-- Tabella 'versioni_esami' (versione dei dati degli esami per anno, per ETag e sincronizzazione incrementale)
+CREATE TABLE versioni_esami (
+    anno_accademico INT PRIMARY KEY,    -- Anno accademico
+    versione BIGINT NOT NULL DEFAULT 0  -- Incrementata a ogni inserimento, modifica o eliminazione di esami
+);
+
+-- Tabella 'esami_eliminati' (esami eliminati, per la sincronizzazione incrementale del calendario)
+CREATE TABLE esami_eliminati (
+    id INT PRIMARY KEY,                 -- ID dell'esame eliminato
+    anno_accademico INT NOT NULL,       -- Anno accademico dell'esame
+    versione BIGINT NOT NULL            -- Versione dei dati dell'anno in cui è stato eliminato
+);
+
+-- Tabella 'riepilogo_esami' (numero di esami ufficiali per insegnamento, cds, curriculum e sessione)
+-- Mantenuta dalle scritture sugli esami; tipo_sessione 'totale' conta tutti gli esami dell'anno.
+-- Un esame è contato nelle sessioni del proprio CdS (curriculum GEN) che contengono la sua data.
+CREATE TABLE riepilogo_esami (
+    insegnamento TEXT,                  -- ID dell'insegnamento
+    cds TEXT,                           -- Codice del corso di studio
+    curriculum_codice TEXT,             -- Codice del curriculum
+    anno_accademico INT,                -- Anno accademico
+    tipo_sessione TEXT,                 -- Tipo di sessione oppure 'totale'
+    numero_esami INT NOT NULL DEFAULT 0, -- Numero di esami ufficiali
+    PRIMARY KEY (insegnamento, cds, curriculum_codice, anno_accademico, tipo_sessione),
+    FOREIGN KEY (insegnamento) REFERENCES insegnamenti(id) ON DELETE CASCADE,
+    FOREIGN KEY (cds, anno_accademico, curriculum_codice) REFERENCES cds(codice, anno_accademico, curriculum_codice) ON DELETE CASCADE
+);
+
+-- Tabella 'jobs' (operazioni lunghe eseguite in background, vedi flask/utils/jobs.py)
+-- Stato e risultato sono nel database così ogni worker può rispondere al polling.
+CREATE TABLE jobs (
+    id TEXT PRIMARY KEY,                -- Identificativo casuale del job
+    tipo TEXT NOT NULL,                 -- Operazione eseguita (import_ugov, export_esse3, ...)
+    utente TEXT,                        -- Username di chi ha avviato il job
+    stato TEXT NOT NULL DEFAULT 'in_coda',
+    avanzamento INT NOT NULL DEFAULT 0, -- Percentuale di completamento
+    messaggio TEXT,                     -- Fase in corso o messaggio di errore
+    risultato JSONB,                    -- Risposta JSON dell'operazione
+    file BYTEA,                         -- File prodotto dall'operazione (export)
+    nome_file TEXT,                     -- Nome del file da scaricare
+    mimetype TEXT,                      -- Tipo del file da scaricare
+    creato_il TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    aggiornato_il TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT check_stato_job CHECK (stato IN ('in_coda', 'in_corso', 'completato', 'errore')),
+    CONSTRAINT check_avanzamento_job CHECK (avanzamento BETWEEN 0 AND 100)
+);
+
 -- Indici per velocizzare le query (forse sono troppi, levarne qualcuno se necessario)
 -- Indici per la tabella 'esami'
 CREATE INDEX idx_esami_data_appello ON esami(data_appello);
@@ -193,6 +258,17 @@ CREATE INDEX idx_esami_calendario ON esami(mostra_nel_calendario);
 CREATE INDEX idx_esami_data_range ON esami(data_appello, mostra_nel_calendario);
 CREATE INDEX idx_esami_docente_anno ON esami(docente, anno_accademico);
 CREATE INDEX idx_esami_insegnamento_data ON esami(insegnamento, data_appello);
+CREATE INDEX idx_esami_slot ON esami(cds, anno_accademico, data_appello, periodo);
+CREATE INDEX idx_esami_anno_versione ON esami(anno_accademico, versione);
+
+-- Indici per la tabella 'esami_eliminati'
+CREATE INDEX idx_esami_eliminati_anno_versione ON esami_eliminati(anno_accademico, versione);
+
+-- Indici per la tabella 'esami_slot_conflitti'
+CREATE INDEX idx_esami_slot_conflitti_slot ON esami_slot_conflitti(cds, anno_accademico, data_appello, periodo);
+
+-- Indici per la tabella 'riepilogo_esami'
+CREATE INDEX idx_riepilogo_esami_anno_cds ON riepilogo_esami(anno_accademico, cds);
 
 -- Indici per la tabella 'insegnamenti_cds'
 CREATE INDEX idx_insegnamenti_cds_anno_semestre ON insegnamenti_cds(anno_corso, semestre);
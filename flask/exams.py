@@ -2,8 +2,13 @@ from flask import Blueprint, request, jsonify, session
 from datetime import datetime, timedelta, date, time
 import traceback
 from db import get_db_connection, release_connection
+from psycopg2.extras import execute_values
 from auth import require_auth
-from utils.sessions import ottieni_intersezione_sessioni_docente, ottieni_vacanze, escludi_vacanze_da_sessioni
+from utils.sessions import ottieni_finestre_valide
+from utils.sovrapposizioni import aggiorna_conflitti_slot, semestri_compatibili, normalizza_slot
+from utils.validazione import ValidationContext
+from utils.versioni import incrementa_versione_esami, registra_esami_eliminati
+from utils.riepilogo import aggiungi_esami_riepilogo, rimuovi_esami_riepilogo
 
 exam_bp = Blueprint('exam_bp', __name__)
 
@@ -33,50 +38,11 @@ def get_user_admin_status(username):
     release_connection(conn)
     return bool(result and result[0])
 
-def get_titolare_per_insegnamento(insegnamento_id, anno_accademico, docente_fallback):
-    """Ottiene il docente titolare per un singolo insegnamento dato l'id."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Trova il docente titolare
-        cursor.execute("""
-            SELECT u.username 
-            FROM insegnamenti_cds ic
-            JOIN utenti u ON ic.titolare = u.matricola
-            WHERE ic.insegnamento = %s AND ic.anno_accademico = %s
-            LIMIT 1
-        """, (insegnamento_id, anno_accademico))
-        titolare_result = cursor.fetchone()
-        if titolare_result:
-            return titolare_result[0]
-        else:
-            return docente_fallback  # Se non c'è titolare, usa fallback
-    finally:
-        cursor.close()
-        release_connection(conn)
-
 def is_date_in_session(data_appello, docente, anno_accademico):
     """Verifica se la data dell'appello è all'interno di una sessione valida per il docente."""
     try:
-        # Ottieni le sessioni del docente (con intersezione tra CdS)
-        sessioni = ottieni_intersezione_sessioni_docente(docente, anno_accademico)
-        
-        if not sessioni:
-            return False
-        
-        # Ottieni le vacanze per l'anno accademico
-        vacanze = ottieni_vacanze(anno_accademico)
-        
-        # Escludi le vacanze dalle sessioni
-        sessioni_valide = escludi_vacanze_da_sessioni(sessioni, vacanze)
-        
-        # Controlla se la data è all'interno di almeno una sessione valida
-        for sessione in sessioni_valide:
-            if sessione['inizio'] <= data_appello <= sessione['fine']:
-                return True
-        
-        return False
-        
+        # Sessioni del docente (con intersezione tra CdS) senza le vacanze, dalla cache
+        return ottieni_finestre_valide(anno_accademico, docente).contiene(data_appello)
     except Exception as e:
         return False
 
@@ -187,55 +153,91 @@ def genera_dati_esame():
 
 def controlla_vincoli(dati_esame, aula_originale=None):
     """Controlla i vincoli per tutti gli esami."""
-    if "status" in dati_esame and dati_esame["status"] == "error":
-        return False, dati_esame["message"]
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Ottieni target esami per l'anno accademico
-    cursor.execute("""
-        SELECT target_esami_default 
-        FROM configurazioni_globali 
-        WHERE anno_accademico = %s
-    """, (dati_esame['anno_accademico'],))
-    
-    target_result = cursor.fetchone()
-    target_esami = target_result[0]
-    
-    # Carica aule valide per validazione
-    cursor.execute("SELECT nome FROM aule")
-    aule_valide = {row[0] for row in cursor.fetchall()}
-    
+    if aula_originale is not None:
+        dati_esame = {**dati_esame, 'aula_originale': aula_originale}
+    return controlla_vincoli_batch([dati_esame])[0]
+
+def controlla_vincoli_batch(esami, conn=None, contesti=None):
+    """
+    Controlla i vincoli di una lista di esami proposti, rispetto al database e tra loro.
+    I dati di tutti gli esami dello stesso anno accademico vengono letti con un solo
+    contesto; ogni sezione accettata viene aggiunta al contesto, così gli esami successivi
+    (e le sezioni successive dello stesso esame) vengono controllati anche rispetto ad essa.
+    Ogni esame può indicare 'exam_id' (modifica) e 'aula_originale'.
+    Per controllare gli esami a blocchi si passano una connessione e un dizionario
+    'contesti' (anno -> ValidationContext) da riusare tra le chiamate.
+    Ritorna una lista di esiti (valido, messaggio) nello stesso ordine degli esami.
+    """
+    esiti = [None] * len(esami)
+    per_anno = {}
+    for indice, dati_esame in enumerate(esami):
+        if "status" in dati_esame and dati_esame["status"] == "error":
+            esiti[indice] = (False, dati_esame["message"])
+        else:
+            per_anno.setdefault(dati_esame['anno_accademico'], []).append(indice)
+
+    if not per_anno:
+        return esiti
+
+    connessione_propria = conn is None
+    if connessione_propria:
+        conn = get_db_connection()
+    if contesti is None:
+        contesti = {}
+    try:
+        for anno_accademico, indici in per_anno.items():
+            # Tutti i dati necessari vengono letti una sola volta nel contesto
+            contesto = contesti.get(anno_accademico)
+            if contesto is None:
+                contesto = contesti[anno_accademico] = ValidationContext(conn, anno_accademico)
+            contesto.carica(
+                [ins for i in indici for ins in esami[i]['insegnamenti']],
+                [esami[i].get('docente') for i in indici],
+                [sezione for i in indici for sezione in esami[i]['sezioni_appelli']]
+            )
+            for indice in indici:
+                esiti[indice] = _controlla_e_registra(esami[indice], contesto)
+    finally:
+        if connessione_propria:
+            release_connection(conn)
+
+    return esiti
+
+def _controlla_e_registra(dati_esame, contesto):
+    """
+    Controlla le sezioni di un esame una alla volta, registrando nel contesto quelle
+    valide. Se una sezione non è valida le registrazioni dell'esame vengono annullate.
+    """
+    registrazioni = []
+    for sezione in dati_esame['sezioni_appelli']:
+        valido, messaggio = controlla_vincoli_con_contesto(
+            {**dati_esame, 'sezioni_appelli': [sezione]}, contesto, dati_esame.get('aula_originale')
+        )
+        if not valido:
+            contesto.annulla_registrazioni(registrazioni)
+            return False, messaggio
+        registrazioni.append(
+            contesto.registra_sezione(dati_esame['insegnamenti'], sezione, dati_esame.get('docente'))
+        )
+    return True, None
+
+def controlla_vincoli_con_contesto(dati_esame, contesto, aula_originale=None):
+    """Valuta in memoria i vincoli di un esame usando i dati già caricati nel contesto."""
     # Estrai parametri principali
     insegnamenti = dati_esame['insegnamenti']
     sezioni_appelli = dati_esame['sezioni_appelli']
     anno_accademico = dati_esame['anno_accademico']
     docente_form = dati_esame.get('docente')
-    exam_id_to_exclude = dati_esame.get('exam_id')
+    exam_id_to_exclude = int(dati_esame['exam_id']) if dati_esame.get('exam_id') else None
     
-    # CONTROLLO CDS BLOCCATO (Nuovo)
+    # CONTROLLO CDS BLOCCATO
     # Verifica se uno degli insegnamenti appartiene a un CdS bloccato
     for insegnamento_id in insegnamenti:
-        cursor.execute("""
-            SELECT DISTINCT c.codice, c.nome_corso 
-            FROM insegnamenti_cds ic
-            JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico AND ic.curriculum_codice = c.curriculum_codice
-            WHERE ic.insegnamento = %s AND ic.anno_accademico = %s
-        """, (insegnamento_id, anno_accademico))
-        
-        cds_found = cursor.fetchall()
-        for cds_codice, cds_nome in cds_found:
-            # Nota: usiamo una query separata o controlliamo il flag bloccato direttamente qui se fosse nella join
-            # Per coerenza usiamo la funzione helper o una query diretta
-            cursor.execute("SELECT 1 FROM cds WHERE codice = %s AND anno_accademico = %s AND bloccato = TRUE LIMIT 1", (cds_codice, anno_accademico))
-            if cursor.fetchone():
-                cursor.close()
-                release_connection(conn)
-                return False, f"Impossibile inserire esami: Il CdS '{cds_nome}' ({cds_codice}) è bloccato per l'anno {anno_accademico}."
+        for cds_codice, cds_nome in contesto.cds_bloccati(insegnamento_id):
+            return False, f"Impossibile inserire esami: Il CdS '{cds_nome}' ({cds_codice}) è bloccato per l'anno {anno_accademico}."
 
     # Determina se è admin
-    is_admin = get_user_admin_status(docente_form)
+    is_admin = contesto.is_admin(docente_form)
     
     for sezione in sezioni_appelli:
         data_appello = sezione['data_appello']
@@ -244,35 +246,26 @@ def controlla_vincoli(dati_esame, aula_originale=None):
         mostra_nel_calendario = sezione['mostra_nel_calendario']
         data_esame = datetime.fromisoformat(data_appello)
         
+        # Controlla se è una prova parziale non ufficiale (PP + mostra_nel_calendario = False)
+        is_prova_parziale_non_ufficiale = (
+            sezione.get('tipo_appello') == 'PP' and 
+            not sezione.get('mostra_nel_calendario', True)
+        )
+        
         # CONTROLLO SESSIONI: Verifica che la data sia all'interno di una sessione valida
         # ECCEZIONE: Permetti prove parziali non ufficiali fuori dalle sessioni
         for insegnamento_id in insegnamenti:
-            docente_esame = docente_form if not is_admin else get_titolare_per_insegnamento(
-                insegnamento_id, anno_accademico, docente_form
-            )
-            
-            # Controlla se è una prova parziale non ufficiale (PP + mostra_nel_calendario = False)
-            is_prova_parziale_non_ufficiale = (
-                sezione.get('tipo_appello') == 'PP' and 
-                not sezione.get('mostra_nel_calendario', True)
-            )
+            docente_esame = docente_form if not is_admin else contesto.titolare(insegnamento_id, docente_form)
             
-            # Permetti prove parziali non ufficiali fuori dalle sessioni
-            if not is_prova_parziale_non_ufficiale and not is_date_in_session(data_esame.date(), docente_esame, anno_accademico):
-                cursor.close()
-                release_connection(conn)
+            if not is_prova_parziale_non_ufficiale and not contesto.data_in_sessione(data_esame.date(), docente_esame):
                 return False, f'La data {data_appello} non è all\'interno di una sessione valida per l\'insegnamento {insegnamento_id}'
         
         # Controllo weekend
         if data_esame.weekday() >= 5:
-            cursor.close()
-            release_connection(conn)
             return False, f'Non è possibile inserire esami nel weekend: {data_appello}'
         
         # Controllo aula valida (solo se specificata)
-        if aula and aula not in aule_valide:
-            cursor.close()
-            release_connection(conn)
+        if aula and aula not in contesto.aule_valide:
             return False, f'Aula non valida: {aula}'
         
         # Controllo orario valido (8-18)
@@ -281,12 +274,8 @@ def controlla_vincoli(dati_esame, aula_originale=None):
             try:
                 ora_h = int(ora_appello.split(':')[0])
                 if ora_h < 8 or ora_h > 18:
-                    cursor.close()
-                    release_connection(conn)
                     return False, f'Orario non valido: {ora_appello}. Deve essere tra le 08:00 e le 18:00'
             except (ValueError, IndexError):
-                cursor.close()
-                release_connection(conn)
                 return False, f'Formato orario non valido: {ora_appello}'
         
         # Controllo durata valida (opzionale, se specificata deve essere valida)
@@ -295,177 +284,62 @@ def controlla_vincoli(dati_esame, aula_originale=None):
             try:
                 durata = int(durata_appello)
                 if durata < 30 or durata > 720:
-                    cursor.close()
-                    release_connection(conn)
                     return False, f'Durata non valida: {durata} minuti. Deve essere tra 30 e 720 minuti'
             except (ValueError, TypeError):
-                cursor.close()
-                release_connection(conn)
                 return False, f'Formato durata non valido: {durata_appello}'
         
         # Per ogni insegnamento, controlla se la data cade in sessione anticipata e se è secondo semestre
-        for insegnamento in insegnamenti:
-            # Ottieni ID insegnamento
-            cursor.execute("SELECT id, titolo FROM insegnamenti WHERE id = %s", (insegnamento,))
-            result = cursor.fetchone()
-            if not result:
-                cursor.close()
-                release_connection(conn)
+        for insegnamento_id in insegnamenti:
+            titolo_insegnamento = contesto.titoli.get(insegnamento_id)
+            if titolo_insegnamento is None:
                 return False, f'Insegnamento {insegnamento_id} non trovato'
-            insegnamento_id, titolo_insegnamento = result
-
-            # CONTROLLO SESSIONI AGGIUNTIVO: Verifica che la data sia nelle sessioni specifiche dell'insegnamento
-            # Solo se non è una prova parziale non ufficiale
-            is_prova_parziale_non_ufficiale = (
-                sezione.get('tipo_appello') == 'PP' and 
-                not sezione.get('mostra_nel_calendario', True)
-            )
-            
-            if not is_prova_parziale_non_ufficiale and not is_date_in_session(data_esame.date(), docente_esame, anno_accademico):
-                cursor.close()
-                release_connection(conn)
-                return False, f'La data {data_appello} non è all\'interno di una sessione valida per l\'insegnamento {titolo_insegnamento}'
 
             # Ottieni info insegnamento_cds (serve semestre)
-            cursor.execute("""
-                SELECT semestre FROM insegnamenti_cds 
-                WHERE insegnamento = %s AND anno_accademico = %s LIMIT 1
-            """, (insegnamento_id, anno_accademico))
-            cds_info = cursor.fetchone()
+            cds_info = contesto.info_cds(insegnamento_id)
             if not cds_info:
-                cursor.close()
-                release_connection(conn)
                 return False, f'Insegnamento {titolo_insegnamento} non trovato per l\'anno accademico {anno_accademico}'
-            semestre = cds_info[0]
-
-            # CONTROLLO SESSIONE INVERNALE: Verifica validità per anno successivo se necessario
-            # Controlla se la data cade in una sessione invernale
-            cursor.execute("""
-                SELECT tipo_sessione FROM sessioni 
-                WHERE cds IN (
-                    SELECT cds FROM insegnamenti_cds WHERE insegnamento = %s AND anno_accademico = %s
-                )
-                AND anno_accademico = %s
-                AND %s BETWEEN inizio AND fine
-                AND tipo_sessione = 'invernale'
-                LIMIT 1
-            """, (insegnamento_id, anno_accademico, anno_accademico, data_esame.date()))
-            
-            sessione_invernale = cursor.fetchone()
+            semestre = cds_info['semestre']
 
-            # Controlla se la data cade in una sessione anticipata
-            cursor.execute("""
-                SELECT inizio, fine FROM sessioni 
-                WHERE cds IN (
-                    SELECT cds FROM insegnamenti_cds WHERE insegnamento = %s AND anno_accademico = %s
-                )
-                AND anno_accademico = %s
-                AND tipo_sessione = 'anticipata'
-            """, (insegnamento_id, anno_accademico, anno_accademico))
-            sessioni_anticipate = cursor.fetchall()
-            for inizio, fine in sessioni_anticipate:
-                if inizio and fine and inizio <= data_esame.date() <= fine:
-                    # Blocca inseriemento appelli ufficiali se insegnamento è 2° sem o annuale
-                    if (semestre == 2 or semestre == 3) and mostra_nel_calendario:
-                        cursor.close()
-                        release_connection(conn)
-                        return False, f"Non è possibile inserire esami con 'Appello ufficiale' nella sessione anticipata per l'insegnamento '{titolo_insegnamento}' (secondo semestre/annuale)."
-
-        # Controllo weekend
-        if data_esame.weekday() >= 5:
-            cursor.close()
-            release_connection(conn)
-            return False, f'Non è possibile inserire esami nel weekend: {data_appello}'
-
-        # Controllo weekend
-        if data_esame.weekday() >= 5:
-            cursor.close()
-            release_connection(conn)
-            return False, f'Non è possibile inserire esami nel weekend: {data_appello}'
+            # Blocca inserimento appelli ufficiali in sessione anticipata se insegnamento è 2° sem o annuale
+            if (semestre == 2 or semestre == 3) and mostra_nel_calendario \
+                    and contesto.in_sessione_anticipata(insegnamento_id, data_esame.date()):
+                return False, f"Non è possibile inserire esami con 'Appello ufficiale' nella sessione anticipata per l'insegnamento '{titolo_insegnamento}' (secondo semestre/annuale)."
         
         # Controllo vincoli per insegnamento (solo se mostra nel calendario)
         if mostra_nel_calendario:
-            for insegnamento in insegnamenti:
-                # Ottieni ID insegnamento
-                cursor.execute("SELECT id, titolo FROM insegnamenti WHERE id = %s", (insegnamento,))
-                result = cursor.fetchone()
-                if not result:
-                    cursor.close()
-                    release_connection(conn)
-                    return False, f'Insegnamento {insegnamento} non trovato'
-                insegnamento_id, titolo_insegnamento = result
-                
-                # Verifica esistenza per l'anno accademico e ottieni info CdS
-                cursor.execute("""
-                    SELECT cds, curriculum_codice, semestre, sovrapposizioni 
-                    FROM insegnamenti_cds 
-                    WHERE insegnamento = %s AND anno_accademico = %s LIMIT 1
-                """, (insegnamento_id, anno_accademico))
-                
-                cds_info = cursor.fetchone()
-                if not cds_info:
-                    cursor.close()
-                    release_connection(conn)
-                    return False, f'Insegnamento {titolo_insegnamento} non trovato per l\'anno accademico {anno_accademico}'
-                
-                cds_codice, curriculum_codice, semestre_ins, current_sovrapposizioni = cds_info
+            for insegnamento_id in insegnamenti:
+                titolo_insegnamento = contesto.titoli[insegnamento_id]
+                cds_info = contesto.info_cds(insegnamento_id)
+                cds_codice = cds_info['cds']
+                semestre_ins = cds_info['semestre']
+                current_sovrapposizioni = contesto.sovrapposizioni(
+                    cds_codice, insegnamento_id, cds_info['sovrapposizioni']
+                )
                 
                 # Controllo esame stesso giorno
-                cursor.execute("""
-                    SELECT data_appello FROM esami 
-                    WHERE insegnamento = %s AND anno_accademico = %s 
-                    AND mostra_nel_calendario = true
-                    AND data_appello = %s::date
-                """ + (" AND id != %s" if exam_id_to_exclude else ""),
-                [insegnamento_id, anno_accademico, data_appello] + 
-                ([exam_id_to_exclude] if exam_id_to_exclude else []))
-                
-                same_day_exams = cursor.fetchall()
-                
-                if same_day_exams:
-                    cursor.close()
-                    release_connection(conn)
+                if contesto.esami_stesso_giorno(insegnamento_id, data_appello, exam_id_to_exclude):
                     return False, f'Esiste già un esame lo stesso giorno ({data_appello}) per l\'insegnamento {titolo_insegnamento}'
                 
                 # Controllo vincolo 14 giorni
-                cursor.execute("""
-                    SELECT data_appello FROM esami 
-                    WHERE insegnamento = %s AND anno_accademico = %s 
-                    AND mostra_nel_calendario = true
-                    AND data_appello != %s::date
-                    AND data_appello BETWEEN (%s::date - INTERVAL '13 days')
-                    AND (%s::date + INTERVAL '13 days')
-                """ + (" AND id != %s" if exam_id_to_exclude else ""),
-                [insegnamento_id, anno_accademico, data_appello, data_appello, data_appello] + 
-                ([exam_id_to_exclude] if exam_id_to_exclude else []))
-                
-                conflicting_dates = cursor.fetchall()
-                
+                conflicting_dates = contesto.esami_entro_14_giorni(insegnamento_id, data_appello, exam_id_to_exclude)
                 if conflicting_dates:
-                    conflicting_date = conflicting_dates[0][0]
-                    cursor.close()
-                    release_connection(conn)
+                    conflicting_date = conflicting_dates[0]
                     return False, f'Vincolo 14 giorni violato per {titolo_insegnamento}: esiste già un esame il {conflicting_date}'
 
                 # --- CONTROLLO SOVRAPPOSIZIONI ---
+                grafo = contesto.grafo(cds_codice, data_appello, periodo)
+
                 # Verifica se l'inserimento crea conflitti
-                conflitto_trovato = conta_sovrapposizioni_per_data(
-                    insegnamento_id, cds_codice, anno_accademico, 
-                    data_appello, periodo, conn, exclude_exam_id=exam_id_to_exclude
+                conflitto_trovato = grafo.e_sovrapposizione(
+                    insegnamento_id, data_appello, periodo, exclude_exam_id=exam_id_to_exclude
                 )
                 
                 if conflitto_trovato:
                     # 1. Verifica impatto su QUESTO insegnamento
                     # Controlla se questa data era già contata come sovrapposizione (cioè se avevo già altri esami in questa data che confliggevano)
-                    cursor.execute("""
-                        SELECT id FROM esami 
-                        WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-                        AND data_appello = %s AND periodo = %s AND mostra_nel_calendario = true
-                    """ + (" AND id != %s" if exam_id_to_exclude else ""), 
-                    [insegnamento_id, cds_codice, anno_accademico, data_appello, periodo] + 
-                    ([exam_id_to_exclude] if exam_id_to_exclude else []))
-                    
-                    altri_esami_miei = cursor.fetchall()
+                    altri_esami_miei = grafo.esami_nello_slot(
+                        insegnamento_id, data_appello, periodo, exclude_exam_id=exam_id_to_exclude
+                    )
                     
                     # Se ho altri esami in questa data, e 'conflitto_trovato' è true, allora anche loro confliggono.
                     # Quindi la data è già contata. Se NON ho altri esami, è una nuova data.
@@ -473,501 +347,254 @@ def controlla_vincoli(dati_esame, aula_originale=None):
                     
                     if is_nuova_data_sovrapposizione:
                         if current_sovrapposizioni >= 2:
-                            cursor.close()
-                            release_connection(conn)
                             return False, f"Impossibile inserire esame per '{titolo_insegnamento}': raggiunto il limite massimo di sovrapposizioni (2)."
 
                     # 2. Verifica impatto su ALTRI insegnamenti
                     # Trova gli insegnamenti con cui vado in conflitto
-                    cursor.execute("""
-                        SELECT DISTINCT ic.insegnamento, ic.sovrapposizioni, ic.semestre, i.titolo
-                        FROM esami e
-                        JOIN insegnamenti_cds ic ON e.insegnamento = ic.insegnamento 
-                            AND e.cds = ic.cds 
-                            AND e.anno_accademico = ic.anno_accademico
-                        JOIN insegnamenti i ON ic.insegnamento = i.id
-                        WHERE e.cds = %s 
-                            AND e.anno_accademico = %s
-                            AND e.data_appello = %s
-                            AND e.periodo = %s
-                            AND e.mostra_nel_calendario = true
-                            AND e.insegnamento != %s
-                    """, (cds_codice, anno_accademico, data_appello, periodo, insegnamento_id))
-                    
-                    potenziali_conflitti = cursor.fetchall()
-                    
-                    for altro_ins_id, altro_sovrapposizioni, altro_semestre, altro_titolo in potenziali_conflitti:
+                    for altro_ins_id in grafo.insegnamenti_nello_slot(data_appello, periodo):
+                        if altro_ins_id == insegnamento_id:
+                            continue
                         # Verifica compatibilità
-                        if not semestri_compatibili(semestre_ins, altro_semestre):
+                        if not any(semestri_compatibili(semestre_ins, altro_semestre)
+                                   for altro_semestre in grafo.semestri.get(altro_ins_id, ())):
                             continue
-                        if hanno_docenti_comuni(insegnamento_id, altro_ins_id, anno_accademico, conn):
+                        if grafo.hanno_docenti_comuni(insegnamento_id, altro_ins_id):
                             continue
                             
                         # Verifica se per l'altro insegnamento questa è una NUOVA data di sovrapposizione
                         # Controlla se aveva già conflitti con terzi (escludendo me)
-                        aveva_gia_conflitti_con_terzi = conta_sovrapposizioni_per_data(
-                            altro_ins_id, cds_codice, anno_accademico,
-                            data_appello, periodo, conn, exclude_exam_id=exam_id_to_exclude
+                        aveva_gia_conflitti_con_terzi = grafo.e_sovrapposizione(
+                            altro_ins_id, data_appello, periodo, exclude_exam_id=exam_id_to_exclude
                         )
                         
                         if not aveva_gia_conflitti_con_terzi:
                             # Io sono l'unico a creargli conflitto in questa data
-                            if altro_sovrapposizioni >= 2:
-                                cursor.close()
-                                release_connection(conn)
-                                return False, f"Impossibile inserire esame: l'insegnamento '{altro_titolo}' ha raggiunto il limite massimo di sovrapposizioni (2)."
+                            contatore_altro = contesto.sovrapposizioni(
+                                cds_codice, altro_ins_id, max(grafo.contatori[altro_ins_id])
+                            )
+                            if contatore_altro >= 2:
+                                return False, f"Impossibile inserire esame: l'insegnamento '{grafo.titoli[altro_ins_id]}' ha raggiunto il limite massimo di sovrapposizioni (2)."
         
         # Controllo conflitti aula (salta se studio docente, stessa aula originale, o aula non specificata)
         if aula and aula != "Studio docente DMI" and aula != aula_originale:
-            where_clause = "WHERE aula = %s AND data_appello = %s AND periodo = %s"
-            params = [aula, data_appello, periodo]
-            
-            if exam_id_to_exclude:
-                where_clause += " AND id != %s"
-                params.append(exam_id_to_exclude)
-            
-            cursor.execute(f"SELECT COUNT(*) FROM esami {where_clause}", params)
-            
-            if cursor.fetchone()[0] > 0:
-                cursor.close()
-                release_connection(conn)
+            if contesto.aula_occupata(aula, data_appello, periodo, exam_id_to_exclude, docente_form):
                 periodo_str = "pomeriggio" if periodo == 1 else "mattina"
                 return False, f'Conflitto aula: {aula} già occupata il {data_appello} nel periodo {periodo_str}'
     
-    cursor.close()
-    release_connection(conn)
     return True, None
 
-def inserisci_esami(dati_esame):
-    """Inserisce tutti gli esami nel database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    esami_inseriti = []
-    insegnamenti = dati_esame['insegnamenti']
-    docente_form = dati_esame['docente']
-    sezioni_appelli = dati_esame['sezioni_appelli']
-    anno_accademico = dati_esame['anno_accademico']
-    
-    # Determina se è admin
-    is_admin = get_user_admin_status(docente_form)
-    
-    for sezione in sezioni_appelli:
-        for insegnamento_codice in insegnamenti:
-            # Determina il docente specifico per questo insegnamento
-            docente_esame = docente_form if not is_admin else get_titolare_per_insegnamento(
-                insegnamento_codice, anno_accademico, docente_form
-            )
-            
-            # Ottieni ID insegnamento
-            cursor.execute("SELECT id, titolo FROM insegnamenti WHERE id = %s", (insegnamento_codice,))
-            result = cursor.fetchone()
-            if not result:
-                continue
-                
-            insegnamento_id, titolo_insegnamento = result
-            
-            # Ottieni info CdS
-            cursor.execute("""
-                SELECT cds, curriculum_codice, anno_corso FROM insegnamenti_cds 
-                WHERE insegnamento = %s AND anno_accademico = %s LIMIT 1
-            """, (insegnamento_id, anno_accademico))
-            
-            cds_info = cursor.fetchone()
-            if not cds_info:
-                continue
-                
-            cds, curriculum_codice, anno_corso = cds_info
-            
-            # Verifica se è sessione invernale e primo semestre/annuale
-            data_esame = datetime.strptime(sezione['data_appello'], '%Y-%m-%d').date()
-            
-            # Ottieni info sul semestre
-            cursor.execute("""
-                SELECT semestre FROM insegnamenti_cds 
-                WHERE insegnamento = %s AND anno_accademico = %s LIMIT 1
-            """, (insegnamento_id, anno_accademico))
-            semestre_info = cursor.fetchone()
-            semestre = semestre_info[0] if semestre_info else None
-            
-            # Controlla se è sessione invernale
-            cursor.execute("""
-                SELECT tipo_sessione FROM sessioni 
-                WHERE cds = %s AND anno_accademico = %s AND curriculum_codice = %s
-                AND %s BETWEEN inizio AND fine
-                AND tipo_sessione = 'invernale'
-                LIMIT 1
-            """, (cds, anno_accademico, curriculum_codice, data_esame))
-            
-            sessione_invernale = cursor.fetchone()
-            
-            # Inserimento principale
-            cursor.execute("""
-                INSERT INTO esami 
-                (docente, insegnamento, aula, data_appello, ora_appello, 
-                 data_inizio_iscrizione, data_fine_iscrizione, tipo_esame, 
-                 verbalizzazione, descrizione, note_appello, tipo_appello, 
-                 definizione_appello, gestione_prenotazione, riservato, 
-                 tipo_iscrizione, periodo, durata_appello, cds, anno_accademico, 
-                 curriculum_codice, mostra_nel_calendario)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                docente_esame, insegnamento_id, sezione['aula'], sezione['data_appello'],
-                sezione['ora_appello'], sezione['inizio_iscrizione'], sezione['fine_iscrizione'],
-                sezione['tipo_esame'], sezione['verbalizzazione'], sezione['descrizione'],
-                sezione['note_appello'], sezione['tipo_appello'], sezione['definizione_appello'],
-                sezione['gestione_prenotazione'], sezione['riservato'], sezione['tipo_iscrizione'],
-                sezione['periodo'], sezione['durata_appello'], cds, anno_accademico,
-                curriculum_codice, sezione['mostra_nel_calendario']
-            ))
-            
-            exam_id = cursor.fetchone()[0]
-            
-            # Aggiorna sovrapposizioni se esame ufficiale
-            if sezione['mostra_nel_calendario']:
-                aggiorna_sovrapposizioni_dopo_inserimento(
-                    insegnamento_id, cds, anno_accademico,
-                    sezione['data_appello'], sezione['periodo'], conn
-                )
-            
-            esami_inseriti.append(f"{titolo_insegnamento} - {sezione['data_appello']} (Docente: {docente_esame})")
-    
-    conn.commit()
-    cursor.close()
-    release_connection(conn)
-    return esami_inseriti
-
-# ================== Funzioni per la gestione delle sovrapposizioni ==================
-
-def semestri_compatibili(semestre1, semestre2):
-    """Verifica se due semestri sono compatibili per le sovrapposizioni."""
-    # Semestre 3 (annuale) è compatibile con tutti
-    if semestre1 == 3 or semestre2 == 3:
-        return True
-    # Semestri uguali sono compatibili
-    return semestre1 == semestre2
+COLONNE_INSERIMENTO_ESAMI = """
+    docente, insegnamento, aula, data_appello, ora_appello,
+    data_inizio_iscrizione, data_fine_iscrizione, tipo_esame,
+    verbalizzazione, descrizione, note_appello, tipo_appello,
+    definizione_appello, gestione_prenotazione, riservato,
+    tipo_iscrizione, periodo, durata_appello, cds, anno_accademico,
+    curriculum_codice, mostra_nel_calendario, versione
+"""
 
-def hanno_docenti_comuni(insegnamento1_id, insegnamento2_id, anno_accademico, conn):
-    """Verifica se due insegnamenti hanno docenti in comune."""
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            SELECT COUNT(*) FROM (
-                SELECT docente FROM insegnamento_docente 
-                WHERE insegnamento = %s AND annoaccademico = %s
-                INTERSECT
-                SELECT docente FROM insegnamento_docente 
-                WHERE insegnamento = %s AND annoaccademico = %s
-            ) AS comuni
-        """, (insegnamento1_id, anno_accademico, insegnamento2_id, anno_accademico))
-        
-        count = cursor.fetchone()[0]
-        return count > 0
-    finally:
-        cursor.close()
-
-def conta_sovrapposizioni_per_data(insegnamento_id, cds, anno_accademico, data_appello, periodo, conn, exclude_exam_id=None):
+def _prefetch_inserimento(cursor, lista_esami):
     """
-    Conta se la data specifica è una sovrapposizione per l'insegnamento.
-    Ritorna True se esiste almeno un altro esame compatibile in quella data/periodo.
+    Dati necessari all'inserimento di una lista di esami, letti con due query:
+    permessi dei docenti e, per (insegnamento, anno), titolo, primo CdS/curriculum
+    e username del titolare.
     """
-    cursor = conn.cursor()
-    try:
-        # Ottieni il semestre dell'insegnamento
-        cursor.execute("""
-            SELECT semestre FROM insegnamenti_cds 
-            WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-            LIMIT 1
-        """, (insegnamento_id, cds, anno_accademico))
-        
-        result = cursor.fetchone()
-        if not result:
-            return False
-        
-        semestre_ins = result[0]
-        
-        # Trova tutti gli esami ufficiali nella stessa data/periodo/cds
-        query = """
-            SELECT DISTINCT e.insegnamento, ic.semestre
-            FROM esami e
-            JOIN insegnamenti_cds ic ON e.insegnamento = ic.insegnamento 
-                AND e.cds = ic.cds 
-                AND e.anno_accademico = ic.anno_accademico
-            WHERE e.cds = %s 
-                AND e.anno_accademico = %s
-                AND e.data_appello = %s
-                AND e.periodo = %s
-                AND e.mostra_nel_calendario = true
-                AND e.insegnamento != %s
-        """
-        params = [cds, anno_accademico, data_appello, periodo, insegnamento_id]
-        
-        if exclude_exam_id:
-            query += " AND e.id != %s"
-            params.append(exclude_exam_id)
-        
-        cursor.execute(query, params)
-        altri_esami = cursor.fetchall()
-        
-        # Verifica se esiste almeno un esame compatibile senza docenti comuni
-        for altro_ins_id, altro_semestre in altri_esami:
-            # Verifica compatibilità semestre
-            if not semestri_compatibili(semestre_ins, altro_semestre):
-                continue
-            
-            # Verifica nessun docente comune
-            if hanno_docenti_comuni(insegnamento_id, altro_ins_id, anno_accademico, conn):
-                continue
-            
-            # Trovata una sovrapposizione valida
-            return True
-        
-        return False
-    finally:
-        cursor.close()
+    docenti = list({dati_esame['docente'] for dati_esame in lista_esami})
+    cursor.execute("SELECT username, permessi_admin FROM utenti WHERE username = ANY(%s)", (docenti,))
+    admin = {username: bool(permessi_admin) for username, permessi_admin in cursor.fetchall()}
+
+    chiavi = list({
+        (insegnamento, int(dati_esame['anno_accademico']))
+        for dati_esame in lista_esami for insegnamento in dati_esame['insegnamenti']
+    })
+    insegnamenti = {}
+    if chiavi:
+        righe = execute_values(cursor, """
+            SELECT DISTINCT ON (ic.insegnamento, ic.anno_accademico)
+                ic.insegnamento, ic.anno_accademico, i.titolo, ic.cds, ic.curriculum_codice,
+                (SELECT u.username
+                 FROM insegnamenti_cds t
+                 JOIN utenti u ON t.titolare = u.matricola
+                 WHERE t.insegnamento = ic.insegnamento AND t.anno_accademico = ic.anno_accademico
+                 ORDER BY t.cds, t.curriculum_codice
+                 LIMIT 1) AS titolare
+            FROM insegnamenti_cds ic
+            JOIN insegnamenti i ON i.id = ic.insegnamento
+            JOIN (VALUES %s) AS v(insegnamento, anno_accademico)
+                ON ic.insegnamento = v.insegnamento AND ic.anno_accademico = v.anno_accademico
+            ORDER BY ic.insegnamento, ic.anno_accademico, ic.cds, ic.curriculum_codice
+        """, chiavi, template="(%s, %s::integer)", page_size=len(chiavi), fetch=True)
+        for insegnamento, anno, titolo, cds, curriculum_codice, titolare in righe:
+            insegnamenti[(insegnamento, anno)] = {
+                'titolo': titolo,
+                'cds': cds,
+                'curriculum_codice': curriculum_codice,
+                'titolare': titolare
+            }
+    return admin, insegnamenti
 
-def calcola_sovrapposizioni_insegnamento(insegnamento_id, cds, anno_accademico, conn, exclude_exam_id=None):
+def inserisci_esami_bulk(lista_esami):
     """
-    Calcola il numero totale di date in sovrapposizione per un insegnamento.
+    Inserisce gli esami di più form (stesso formato di genera_dati_esame) in un'unica
+    transazione: un prefetch dei dati collegati, un solo INSERT multiriga, una versione
+    per anno, un aggiornamento delle sovrapposizioni per cds sugli slot toccati e il
+    riepilogo. Gli insegnamenti senza CdS nell'anno vengono saltati.
+    Se un inserimento fallisce non viene salvato nessun esame e l'errore viene rilanciato.
+    Ritorna le descrizioni degli esami inseriti.
     """
+    if not lista_esami:
+        return []
+
+    conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        # Trova tutti gli esami ufficiali dell'insegnamento
-        query = """
-            SELECT DISTINCT data_appello, periodo
-            FROM esami
-            WHERE insegnamento = %s 
-                AND cds = %s
-                AND anno_accademico = %s
-                AND mostra_nel_calendario = true
-        """
-        params = [insegnamento_id, cds, anno_accademico]
-        
-        if exclude_exam_id:
-            query += " AND id != %s"
-            params.append(exclude_exam_id)
-        
-        cursor.execute(query, params)
-        date_esami = cursor.fetchall()
-        
-        # Conta quante date hanno sovrapposizioni
-        sovrapposizioni = 0
-        for data_appello, periodo in date_esami:
-            if conta_sovrapposizioni_per_data(insegnamento_id, cds, anno_accademico, 
-                                              data_appello, periodo, conn, exclude_exam_id):
-                sovrapposizioni += 1
-        
-        return sovrapposizioni
+        admin, insegnamenti = _prefetch_inserimento(cursor, lista_esami)
+
+        # Tutti gli esami di un anno ricevono la stessa nuova versione dei dati
+        versioni = {}
+        righe = []
+        descrizioni = []
+        # Slot degli esami ufficiali inseriti, raggruppati per (cds, anno)
+        modifiche_sovrapposizioni = {}
+
+        for dati_esame in lista_esami:
+            docente_form = dati_esame['docente']
+            anno_accademico = int(dati_esame['anno_accademico'])
+            is_admin = admin.get(docente_form, False)
+
+            for sezione in dati_esame['sezioni_appelli']:
+                for insegnamento_id in dati_esame['insegnamenti']:
+                    info = insegnamenti.get((insegnamento_id, anno_accademico))
+                    if not info:
+                        continue
+
+                    # Per gli admin il docente è il titolare dell'insegnamento, se c'è
+                    docente_esame = (info['titolare'] or docente_form) if is_admin else docente_form
+                    if anno_accademico not in versioni:
+                        versioni[anno_accademico] = incrementa_versione_esami(cursor, anno_accademico)
+
+                    righe.append((
+                        docente_esame, insegnamento_id, sezione['aula'], sezione['data_appello'],
+                        sezione['ora_appello'], sezione['inizio_iscrizione'], sezione['fine_iscrizione'],
+                        sezione['tipo_esame'], sezione['verbalizzazione'], sezione['descrizione'],
+                        sezione['note_appello'], sezione['tipo_appello'], sezione['definizione_appello'],
+                        sezione['gestione_prenotazione'], sezione['riservato'], sezione['tipo_iscrizione'],
+                        sezione['periodo'], sezione['durata_appello'], info['cds'], anno_accademico,
+                        info['curriculum_codice'], sezione['mostra_nel_calendario'], versioni[anno_accademico]
+                    ))
+
+                    # Le sovrapposizioni degli esami ufficiali vengono aggiornate alla fine
+                    if sezione['mostra_nel_calendario']:
+                        modifiche_sovrapposizioni.setdefault((info['cds'], anno_accademico), set()).add(
+                            normalizza_slot(sezione['data_appello'], sezione['periodo'])
+                        )
+
+                    descrizioni.append(f"{info['titolo']} - {sezione['data_appello']} (Docente: {docente_esame})")
+
+        if not righe:
+            conn.rollback()
+            return []
+
+        # Un solo INSERT multiriga: gli id tornano nell'ordine delle righe
+        ids_inseriti = [row[0] for row in execute_values(
+            cursor,
+            "INSERT INTO esami (" + COLONNE_INSERIMENTO_ESAMI + ") VALUES %s RETURNING id",
+            righe, page_size=len(righe), fetch=True
+        )]
+
+        # Aggiorna i contatori una sola volta per ogni cds coinvolto, su tutti i suoi slot
+        for (cds, anno), slot in modifiche_sovrapposizioni.items():
+            aggiorna_sovrapposizioni(conn, cds, anno, slot)
+
+        aggiungi_esami_riepilogo(cursor, ids_inseriti)
+        conn.commit()
+        return descrizioni
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         cursor.close()
+        release_connection(conn)
+
+def inserisci_esami(dati_esame):
+    """Inserisce tutti gli esami di un form nel database."""
+    return inserisci_esami_bulk([dati_esame])
 
-def aggiorna_sovrapposizioni_dopo_inserimento(insegnamento_id, cds, anno_accademico, 
-                                               data_appello, periodo, conn):
+# ================== Funzioni per la gestione delle sovrapposizioni ==================
+
+def aggiorna_sovrapposizioni(conn, cds, anno_accademico, slot, exam_id_rimosso=None):
     """
-    Aggiorna i contatori di sovrapposizione dopo l'inserimento di un nuovo esame.
+    Aggiorna i contatori di sovrapposizione di un cds dopo una serie di modifiche.
+    'slot' è la lista delle (data_appello, periodo) toccate: vengono ricalcolati
+    solo i flag di conflitto degli esami in quegli slot e i contatori sono
+    incrementati o decrementati di conseguenza.
     """
-    cursor = conn.cursor()
-    try:
-        # Ottieni il semestre dell'insegnamento inserito
-        cursor.execute("""
-            SELECT semestre FROM insegnamenti_cds 
-            WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-            LIMIT 1
-        """, (insegnamento_id, cds, anno_accademico))
-        
-        result = cursor.fetchone()
-        if not result:
-            return
-        
-        semestre_ins = result[0]
-        
-        # Trova tutti gli insegnamenti che potrebbero essere affetti
-        cursor.execute("""
-            SELECT DISTINCT e.insegnamento, ic.semestre
-            FROM esami e
-            JOIN insegnamenti_cds ic ON e.insegnamento = ic.insegnamento 
-                AND e.cds = ic.cds 
-                AND e.anno_accademico = ic.anno_accademico
-            WHERE e.cds = %s 
-                AND e.anno_accademico = %s
-                AND e.data_appello = %s
-                AND e.periodo = %s
-                AND e.mostra_nel_calendario = true
-        """, (cds, anno_accademico, data_appello, periodo))
-        
-        insegnamenti_affetti = cursor.fetchall()
-        
-        # Aggiorna il contatore per ogni insegnamento compatibile
-        for altro_ins_id, altro_semestre in insegnamenti_affetti:
-            # Verifica compatibilità semestre
-            if not semestri_compatibili(semestre_ins, altro_semestre):
-                continue
-            
-            # Verifica nessun docente comune
-            if hanno_docenti_comuni(insegnamento_id, altro_ins_id, anno_accademico, conn):
-                continue
-            
-            # Ricalcola le sovrapposizioni per questo insegnamento
-            nuove_sovrapposizioni = calcola_sovrapposizioni_insegnamento(
-                altro_ins_id, cds, anno_accademico, conn
-            )
-            
-            cursor.execute("""
-                UPDATE insegnamenti_cds 
-                SET sovrapposizioni = %s
-                WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-            """, (nuove_sovrapposizioni, altro_ins_id, cds, anno_accademico))
-        
-        # Aggiorna anche l'insegnamento appena inserito
-        nuove_sovrapposizioni = calcola_sovrapposizioni_insegnamento(
-            insegnamento_id, cds, anno_accademico, conn
-        )
-        
-        cursor.execute("""
-            UPDATE insegnamenti_cds 
-            SET sovrapposizioni = %s
-            WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-        """, (nuove_sovrapposizioni, insegnamento_id, cds, anno_accademico))
-        
-    finally:
-        cursor.close()
+    aggiorna_conflitti_slot(conn, cds, anno_accademico, slot, exam_id_rimosso=exam_id_rimosso)
 
 def aggiorna_sovrapposizioni_dopo_modifica(exam_id, vecchia_data, vecchio_periodo, 
                                             nuova_data, nuovo_periodo, 
                                             vecchio_mostra, nuovo_mostra, conn):
     """
-    Aggiorna i contatori dopo la modifica di un esame.
+    Aggiorna i contatori dopo la modifica di un esame (già salvata nel database).
     """
+    # Se l'esame non era e non è ufficiale, non fare nulla
+    if not vecchio_mostra and not nuovo_mostra:
+        return
+
+    vecchio_slot = normalizza_slot(vecchia_data, vecchio_periodo)
+    nuovo_slot = normalizza_slot(nuova_data, nuovo_periodo)
+    if vecchio_mostra and nuovo_mostra and vecchio_slot == nuovo_slot:
+        return
+
     cursor = conn.cursor()
     try:
         # Ottieni info esame
         cursor.execute("""
-            SELECT insegnamento, cds, anno_accademico 
+            SELECT cds, anno_accademico 
             FROM esami WHERE id = %s
         """, (exam_id,))
-        
         result = cursor.fetchone()
-        if not result:
-            return
-        
-        insegnamento_id, cds, anno_accademico = result
-        
-        # Se l'esame cambia da non ufficiale a ufficiale o viceversa
-        if vecchio_mostra != nuovo_mostra:
-            if nuovo_mostra:  # Diventa ufficiale
-                aggiorna_sovrapposizioni_dopo_inserimento(
-                    insegnamento_id, cds, anno_accademico, 
-                    nuova_data, nuovo_periodo, conn
-                )
-            else:  # Diventa non ufficiale
-                aggiorna_sovrapposizioni_dopo_eliminazione(
-                    exam_id, vecchia_data, vecchio_periodo, conn
-                )
-            return
-        
-        # Se l'esame non è ufficiale, non fare nulla
-        if not nuovo_mostra:
-            return
-        
-        # Se data o periodo cambiano, rimuovi dalle vecchie sovrapposizioni
-        if vecchia_data != nuova_data or vecchio_periodo != nuovo_periodo:
-            # Ricalcola per la vecchia data
-            cursor.execute("""
-                SELECT DISTINCT e.insegnamento
-                FROM esami e
-                WHERE e.cds = %s 
-                    AND e.anno_accademico = %s
-                    AND e.data_appello = %s
-                    AND e.periodo = %s
-                    AND e.mostra_nel_calendario = true
-                    AND e.id != %s
-            """, (cds, anno_accademico, vecchia_data, vecchio_periodo, exam_id))
-            
-            insegnamenti_vecchia_data = [row[0] for row in cursor.fetchall()]
-            
-            for altro_ins_id in insegnamenti_vecchia_data:
-                nuove_sovrapposizioni = calcola_sovrapposizioni_insegnamento(
-                    altro_ins_id, cds, anno_accademico, conn, exclude_exam_id=exam_id
-                )
-                
-                cursor.execute("""
-                    UPDATE insegnamenti_cds 
-                    SET sovrapposizioni = %s
-                    WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-                """, (nuove_sovrapposizioni, altro_ins_id, cds, anno_accademico))
-            
-            # Aggiungi alle nuove sovrapposizioni
-            aggiorna_sovrapposizioni_dopo_inserimento(
-                insegnamento_id, cds, anno_accademico, 
-                nuova_data, nuovo_periodo, conn
-            )
-        
     finally:
         cursor.close()
 
+    if not result:
+        return
+
+    cds, anno_accademico = result
+
+    slot = []
+    if vecchio_mostra:
+        slot.append(vecchio_slot)
+    if nuovo_mostra:
+        slot.append(nuovo_slot)
+
+    aggiorna_sovrapposizioni(conn, cds, anno_accademico, slot)
+
 def aggiorna_sovrapposizioni_dopo_eliminazione(exam_id, data_appello, periodo, conn):
     """
-    Aggiorna i contatori dopo l'eliminazione di un esame.
+    Aggiorna i contatori prima dell'eliminazione di un esame, escludendolo dal calcolo.
     """
     cursor = conn.cursor()
     try:
         # Ottieni info esame prima dell'eliminazione
         cursor.execute("""
-            SELECT insegnamento, cds, anno_accademico, mostra_nel_calendario
+            SELECT cds, anno_accademico, mostra_nel_calendario
             FROM esami WHERE id = %s
         """, (exam_id,))
-        
         result = cursor.fetchone()
-        if not result:
-            return
-        
-        insegnamento_id, cds, anno_accademico, mostra_nel_calendario = result
-        
-        # Se non è ufficiale, non fare nulla
-        if not mostra_nel_calendario:
-            return
-        
-        # Trova tutti gli insegnamenti affetti
-        cursor.execute("""
-            SELECT DISTINCT e.insegnamento
-            FROM esami e
-            WHERE e.cds = %s 
-                AND e.anno_accademico = %s
-                AND e.data_appello = %s
-                AND e.periodo = %s
-                AND e.mostra_nel_calendario = true
-                AND e.id != %s
-        """, (cds, anno_accademico, data_appello, periodo, exam_id))
-        
-        insegnamenti_affetti = [row[0] for row in cursor.fetchall()]
-        
-        # Ricalcola per ogni insegnamento affetto
-        for altro_ins_id in insegnamenti_affetti:
-            nuove_sovrapposizioni = calcola_sovrapposizioni_insegnamento(
-                altro_ins_id, cds, anno_accademico, conn, exclude_exam_id=exam_id
-            )
-            
-            cursor.execute("""
-                UPDATE insegnamenti_cds 
-                SET sovrapposizioni = %s
-                WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-            """, (nuove_sovrapposizioni, altro_ins_id, cds, anno_accademico))
-        
-        # Ricalcola anche per l'insegnamento dell'esame eliminato
-        nuove_sovrapposizioni = calcola_sovrapposizioni_insegnamento(
-            insegnamento_id, cds, anno_accademico, conn, exclude_exam_id=exam_id
-        )
-        
-        cursor.execute("""
-            UPDATE insegnamenti_cds 
-            SET sovrapposizioni = %s
-            WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-        """, (nuove_sovrapposizioni, insegnamento_id, cds, anno_accademico))
-        
     finally:
         cursor.close()
 
+    if not result:
+        return
+
+    cds, anno_accademico, mostra_nel_calendario = result
+
+    # Se non è ufficiale, non fare nulla
+    if not mostra_nel_calendario:
+        return
+
+    aggiorna_sovrapposizioni(conn, cds, anno_accademico, [(data_appello, periodo)], exam_id_rimosso=exam_id)
+
 # ================== Endpoints API ==================
 
 @exam_bp.route('/api/inserisci-esame', methods=['POST'])
@@ -1090,6 +717,12 @@ def update_esame():
         exam_id = data.get('id')
         if not exam_id:
             return jsonify({'success': False, 'message': 'ID esame non fornito'}), 400
+        # Il client invia l'id come stringa, mentre il grafo delle sovrapposizioni
+        # e il contesto di validazione usano gli id interi del database
+        try:
+            exam_id = int(exam_id)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'ID esame non valido'}), 400
 
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -1138,6 +771,7 @@ def update_esame():
 
             dati_controllo = {
                 'exam_id': exam_id,
+                'aula_originale': esame_dict['aula'],
                 'insegnamenti': [insegnamento_id],
                 'docente': username,
                 'sezioni_appelli': [{
@@ -1151,7 +785,7 @@ def update_esame():
                 'anno_accademico': esame_dict['anno_accademico']
             }
 
-            vincoli_ok, errore = controlla_vincoli(dati_controllo, aula_originale=esame_dict['aula'])
+            vincoli_ok, errore = controlla_vincoli_batch([dati_controllo])[0]
             if not vincoli_ok:
                 cursor.close()
                 release_connection(conn)
@@ -1168,13 +802,16 @@ def update_esame():
         vecchio_mostra_calendario = esame_dict['mostra_nel_calendario']
         nuovo_mostra_calendario = data.get('mostra_nel_calendario', True)
         
-        # Aggiornamento esame
+        # Aggiornamento esame (il riepilogo viene aggiornato togliendo e riaggiungendo l'esame)
+        versione = incrementa_versione_esami(cursor, esame_dict['anno_accademico'])
+        rimuovi_esami_riepilogo(cursor, [exam_id])
         cursor.execute("""
         UPDATE esami SET
             descrizione = %s, tipo_appello = %s, aula = %s, data_appello = %s,
             data_inizio_iscrizione = %s, data_fine_iscrizione = %s, ora_appello = %s,
             durata_appello = %s, periodo = %s, verbalizzazione = %s,
-            tipo_esame = %s, note_appello = %s, mostra_nel_calendario = %s
+            tipo_esame = %s, note_appello = %s, mostra_nel_calendario = %s,
+            versione = %s
         WHERE id = %s
         """, (
             data.get('descrizione'), data.get('tipo_appello'), aula_value,
@@ -1182,8 +819,9 @@ def update_esame():
             data.get('data_fine_iscrizione'), data.get('ora_appello'),
             data.get('durata_appello'), data.get('periodo'), data.get('verbalizzazione'),
             data.get('tipo_esame'), data.get('note_appello'),
-            data.get('mostra_nel_calendario', True), exam_id
+            data.get('mostra_nel_calendario', True), versione, exam_id
         ))
+        aggiungi_esami_riepilogo(cursor, [exam_id])
         
         # Aggiorna sovrapposizioni
         aggiorna_sovrapposizioni_dopo_modifica(
@@ -1215,6 +853,12 @@ def delete_esame():
         exam_id = data.get('id')
         if not exam_id:
             return jsonify({'success': False, 'message': 'ID esame non fornito'}), 400
+        # Il client invia l'id come stringa, mentre il grafo delle sovrapposizioni
+        # e il contesto di validazione usano gli id interi del database
+        try:
+            exam_id = int(exam_id)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'ID esame non valido'}), 400
 
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -1252,7 +896,10 @@ def delete_esame():
         # Aggiorna sovrapposizioni prima dell'eliminazione
         aggiorna_sovrapposizioni_dopo_eliminazione(exam_id, data_appello, periodo, conn)
         
-        # Eliminazione esame
+        # Eliminazione esame, registrata per la sincronizzazione incrementale del calendario
+        versione = incrementa_versione_esami(cursor, esame_dict['anno_accademico'])
+        registra_esami_eliminati(cursor, [esame_dict['id']], esame_dict['anno_accademico'], versione)
+        rimuovi_esami_riepilogo(cursor, [exam_id])
         cursor.execute("DELETE FROM esami WHERE id = %s", (exam_id,))
         conn.commit()
         
@@ -1,12 +1,21 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
+import json
 from db import get_db_connection, release_connection
-from datetime import datetime
+from datetime import datetime, date
 from auth import get_user_data
 from psycopg2.extras import DictCursor
-from utils.sessions import (ottieni_intersezione_sessioni_docente, ottieni_sessioni_da_insegnamenti, ottieni_vacanze, escludi_vacanze_da_sessioni)
+from utils.aule import IndiceOccupazioneAule, giorni_intervallo
+from utils.versioni import ottieni_versioni_esami, codifica_versioni, decodifica_versioni, calcola_etag
+from utils.sessions import (ottieni_sessioni_da_insegnamenti, ottieni_vacanze, escludi_vacanze_da_sessioni, ottieni_finestre_valide)
 
 fetch_bp = Blueprint('fetch', __name__)
 
+# Ampiezza massima dell'intervallo di /api/get-aule-libere
+MAX_GIORNI_AULE_LIBERE = 31
+
+# Tipi di sessione d'esame (vincolo check_tipo_sessione della tabella sessioni)
+TIPI_SESSIONE = ('anticipata', 'estiva', 'autunnale', 'invernale')
+
 def ottieni_insegnamenti_docente(docente, anno_accademico):
     """Ottiene gli insegnamenti di un docente per un anno accademico"""
     try:
@@ -32,6 +41,28 @@ def ottieni_insegnamenti_docente(docente, anno_accademico):
         if 'conn' in locals() and conn:
             release_connection(conn)
 
+def ottieni_insegnamenti_correlati(cursor, insegnamenti, anno_accademico):
+    """
+    Ottiene con una sola query gli insegnamenti correlati a quelli indicati: stesso CdS,
+    stesso anno di corso e semestre compatibile (gli annuali si correlano con tutti,
+    i semestrali con lo stesso semestre e con gli annuali)
+    """
+    if not insegnamenti:
+        return []
+    
+    cursor.execute("""
+        SELECT DISTINCT ic2.insegnamento
+        FROM insegnamenti_cds ic1
+        JOIN insegnamenti_cds ic2 ON ic1.cds = ic2.cds 
+            AND ic1.anno_corso = ic2.anno_corso 
+            AND ic1.anno_accademico = ic2.anno_accademico
+        WHERE ic1.insegnamento = ANY(%s) 
+        AND ic1.anno_accademico = %s
+        AND ic2.semestre IN (1, 2, 3)
+        AND (ic1.semestre = 3 OR ic2.semestre IN (ic1.semestre, 3))
+    """, (list(insegnamenti), anno_accademico))
+    return [row[0] for row in cursor.fetchall()]
+
 @fetch_bp.route('/api/get-aule', methods=['GET'])
 def get_aule():
     data = request.args.get('data')
@@ -51,60 +82,86 @@ def get_aule():
         tutte_aule = [(row[0], row[1]) for row in cursor.fetchall()]
         
         if data and periodo is not None:
-            # Definisci le fasce orarie
-            if periodo == '0':  # Mattina
-                inizio_fascia = '08:30:00'
-                fine_fascia = '13:30:00'
-            else:  # Pomeriggio
-                inizio_fascia = '14:00:00'
-                fine_fascia = '19:00:00'
-            
-            # Recupera aule occupate da esami nel DB locale, escludendo quelle del docente stesso
-            cursor.execute("""
-                SELECT DISTINCT e.aula FROM esami e
-                WHERE e.data_appello = %s AND e.periodo = %s AND e.aula IS NOT NULL AND e.docente != %s
-            """, (data, periodo, docente))
-            
-            aule_occupate_db = {row[0] for row in cursor.fetchall()}
-            
-            # Controlla disponibilità tramite API EasyAcademy
-            aule_occupate_ea = set()
-            try:
-                # Converti data da YYYY-MM-DD a DD-MM-YYYY per EasyAcademy
-                data_parti = data.split('-')
-                data_ea_format = f"{data_parti[2]}-{data_parti[1]}-{data_parti[0]}"
-                
-                url = f'https://easyacademy.unipg.it/agendaweb/rooms_call.php?sede=P02E04&date={data_ea_format}'
-                response = requests.get(url, timeout=5)
-                
-                if response.ok:
-                    data_ea = response.json()
-                    if 'table' in data_ea:
-                        for aula_code, aula_data in data_ea['table'].items():
-                            for slot in aula_data:
-                                if isinstance(slot, dict) and 'from' in slot and 'to' in slot and 'NomeAula' in slot:
-                                    ora_inizio = slot['from']
-                                    ora_fine = slot['to']
-                                    nome_aula = slot['NomeAula']
-                                    
-                                    # Verifica sovrapposizione con la fascia oraria richiesta
-                                    if ((ora_inizio <= fine_fascia and ora_fine >= inizio_fascia) or 
-                                        (ora_inizio >= inizio_fascia and ora_inizio <= fine_fascia) or 
-                                        (ora_fine >= inizio_fascia and ora_fine <= fine_fascia)):
-                                        aule_occupate_ea.add(nome_aula)
-            except Exception as req_error:
-                print(f"Errore nella richiesta a EasyAcademy: {str(req_error)}")
-            
-            # Combina le aule occupate da entrambe le fonti
-            aule_occupate = aule_occupate_db.union(aule_occupate_ea)
-            
-            # Filtra le aule disponibili
-            aule_disponibili = [(aula[0], aula[1]) for aula in tutte_aule if aula[0] not in aule_occupate]
+            # Occupazione dello slot: esami locali (quelli del docente stesso non contano)
+            # e prenotazioni EasyAcademy dalla cache aggiornata in background
+            indice = IndiceOccupazioneAule.carica(conn, [data], easyacademy=True, periodi=(int(periodo),))
+            aule_disponibili = indice.aule_libere(tutte_aule, data, periodo, docente_escluso=docente)
             aule = [{"nome": nome_aula, "posti": posti} for nome_aula, posti in aule_disponibili]
+            stato_ea, aggiornato_ea = indice.stato_esterne[date.fromisoformat(data)]
         else:
             aule = [{"nome": row[0], "posti": row[1]} for row in tutte_aule]
+            stato_ea, aggiornato_ea = None, None
+        
+        risposta = make_response(jsonify(aule))
+        # Indicatore di freschezza dei dati EasyAcademy: aggiornato, obsoleto o non_disponibile
+        if stato_ea:
+            risposta.headers['X-Easyacademy-Stato'] = stato_ea
+            if aggiornato_ea:
+                risposta.headers['X-Easyacademy-Aggiornamento'] = aggiornato_ea.isoformat(timespec='seconds')
+        return risposta
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+        if 'conn' in locals() and conn:
+            release_connection(conn)
+
+@fetch_bp.route('/api/get-aule-libere', methods=['GET'])
+def get_aule_libere():
+    """
+    Aule libere per ogni giorno e periodo di un intervallo di date, con lo stato dei
+    dati EasyAcademy di ogni giorno. Evita al form una chiamata a /api/get-aule per slot.
+    """
+    try:
+        user_data = get_user_data().get_json()
+        if not user_data['authenticated']:
+            return jsonify({'status': 'error', 'message': 'Utente non autenticato'}), 401
+        
+        docente = user_data['user_data']['username']
+        
+        try:
+            inizio = date.fromisoformat(request.args.get('inizio', ''))
+            fine = date.fromisoformat(request.args.get('fine', ''))
+            periodi = (0, 1) if request.args.get('periodo') is None else (int(request.args.get('periodo')),)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Parametri non validi'}), 400
+        
+        if fine < inizio or periodi[0] not in (0, 1):
+            return jsonify({'status': 'error', 'message': 'Parametri non validi'}), 400
+        if (fine - inizio).days >= MAX_GIORNI_AULE_LIBERE:
+            return jsonify({
+                'status': 'error',
+                'message': f'Intervallo troppo ampio (massimo {MAX_GIORNI_AULE_LIBERE} giorni)'
+            }), 400
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
         
-        return jsonify(aule)
+        cursor.execute("SELECT nome, posti FROM aule ORDER BY nome")
+        tutte_aule = [(row[0], row[1]) for row in cursor.fetchall()]
+        
+        giorni = giorni_intervallo(inizio, fine)
+        indice = IndiceOccupazioneAule.carica(conn, giorni, easyacademy=True, periodi=periodi)
+        
+        risultato = {}
+        for giorno in giorni:
+            stato_ea, aggiornato_ea = indice.stato_esterne[giorno]
+            risultato[giorno.isoformat()] = {
+                'periodi': {
+                    str(periodo): [
+                        {"nome": nome_aula, "posti": posti}
+                        for nome_aula, posti in indice.aule_libere(tutte_aule, giorno, periodo, docente_escluso=docente)
+                    ]
+                    for periodo in periodi
+                },
+                'easyacademy': {
+                    'stato': stato_ea,
+                    'aggiornato_il': aggiornato_ea.isoformat(timespec='seconds') if aggiornato_ea else None
+                }
+            }
+        
+        return jsonify(risultato)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
     finally:
@@ -113,6 +170,24 @@ def get_aule():
         if 'conn' in locals() and conn:
             release_connection(conn)
 
+def risposta_esami(exams, token_versioni, etag, since=None, eliminati=()):
+    """
+    Risposta di /api/get-esami con ETag e versione dei dati. Con 'since' restituisce
+    solo gli esami modificati e gli id di quelli eliminati dopo quelle versioni.
+    """
+    if since is None:
+        risposta = make_response(jsonify(exams))
+    else:
+        risposta = make_response(jsonify({
+            'versione': token_versioni,
+            'esami': exams,
+            'eliminati': sorted(eliminati)
+        }))
+    risposta.set_etag(etag)
+    risposta.headers['Cache-Control'] = 'private, no-cache'
+    risposta.headers['X-Versione-Esami'] = token_versioni
+    return risposta
+
 @fetch_bp.route('/api/get-esami', methods=['GET'])
 def get_esami():
     try:
@@ -129,9 +204,27 @@ def get_esami():
         if not docente or not anno:
             return jsonify({'status': 'error', 'message': 'Parametri mancanti'}), 400
 
+        # Sincronizzazione incrementale: token di versione ricevuto da una risposta precedente
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                versioni_client = decodifica_versioni(since)
+            except ValueError:
+                return jsonify({'status': 'error', 'message': 'Parametro since non valido'}), 400
+
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=DictCursor)
         
+        # Se i dati non sono cambiati dall'ultima richiesta uguale, il client ha già la risposta
+        token_versioni = codifica_versioni(ottieni_versioni_esami(cursor))
+        etag = calcola_etag(token_versioni, current_user, is_admin_user, docente, insegnamenti, anno, since)
+        if request.if_none_match.contains(etag):
+            risposta = make_response('', 304)
+            risposta.set_etag(etag)
+            risposta.headers['Cache-Control'] = 'private, no-cache'
+            risposta.headers['X-Versione-Esami'] = token_versioni
+            return risposta
+        
         # Ottieni gli insegnamenti del docente autenticato per identificare le codocenze
         insegnamenti_docente_autenticato = set()
         if not is_admin_user:
@@ -152,37 +245,7 @@ def get_esami():
                 # Se specificati insegnamenti, trova quelli correlati
                 insegnamenti_selezionati = insegnamenti.split(',')
                 
-                # Prima ottieni i semestri degli insegnamenti selezionati
-                cursor.execute("""
-                    SELECT DISTINCT ic1.insegnamento, ic1.semestre
-                    FROM insegnamenti_cds ic1
-                    WHERE ic1.insegnamento = ANY(%s) AND ic1.anno_accademico = %s
-                """, (insegnamenti_selezionati, anno))
-                insegnamenti_con_semestre = {row[0]: row[1] for row in cursor.fetchall()}
-                
-                # Per ogni insegnamento selezionato, trova quelli correlati considerando gli annuali
-                for ins_id, semestre in insegnamenti_con_semestre.items():
-                    if semestre == 3:  # Annuale
-                        # Gli annuali si correlano con: annuali, 1° sem e 2° sem
-                        semestre_condition = "ic2.semestre IN (1, 2, 3)"
-                    else:  # 1° o 2° semestre
-                        # I semestrali si correlano con: stesso semestre + annuali
-                        semestre_condition = f"ic2.semestre IN ({semestre}, 3)"
-                    
-                    cursor.execute(f"""
-                        SELECT DISTINCT i2.id
-                        FROM insegnamenti_cds ic1
-                        JOIN insegnamenti_cds ic2 ON ic1.cds = ic2.cds 
-                            AND ic1.anno_corso = ic2.anno_corso 
-                            AND ic1.anno_accademico = ic2.anno_accademico
-                        JOIN insegnamenti i2 ON ic2.insegnamento = i2.id
-                        WHERE ic1.insegnamento = %s 
-                        AND ic1.anno_accademico = %s
-                        AND ({semestre_condition})
-                    """, (ins_id, anno))
-                    
-                    insegnamenti_autorizzati.extend([row[0] for row in cursor.fetchall()])
-                insegnamenti_autorizzati = list(set(insegnamenti_autorizzati))
+                insegnamenti_autorizzati = ottieni_insegnamenti_correlati(cursor, insegnamenti_selezionati, anno)
             else:
                 insegnamenti_autorizzati = []
                 insegnamenti_selezionati = []
@@ -190,7 +253,7 @@ def get_esami():
             # Non admin: ottieni insegnamenti del docente
             insegnamenti_docente = ottieni_insegnamenti_docente(docente, anno)
             if not insegnamenti_docente:
-                return jsonify([])
+                return risposta_esami([], token_versioni, etag, since)
             
             # SEMPRE includi tutti gli insegnamenti del docente come base
             insegnamenti_autorizzati = list(insegnamenti_docente.keys())
@@ -201,37 +264,8 @@ def get_esami():
                 # Se specificati insegnamenti, aggiungi quelli correlati ai selezionati
                 insegnamenti_selezionati = [ins for ins in insegnamenti_autorizzati if ins in insegnamenti.split(',')]
                 if insegnamenti_selezionati:
-                    cursor.execute("""
-                        SELECT DISTINCT insegnamento, semestre
-                        FROM insegnamenti_cds
-                        WHERE insegnamento = ANY(%s) AND anno_accademico = %s
-                    """, (insegnamenti_selezionati, anno))
-                    insegnamenti_sel_con_semestre = {row[0]: row[1] for row in cursor.fetchall()}
-                    
-                    # Per ogni insegnamento selezionato, trova quelli correlati
-                    for ins_id, semestre in insegnamenti_sel_con_semestre.items():
-                        if semestre == 3:  # Annuale
-                            # Gli annuali si correlano con: annuali, 1° sem e 2° sem
-                            semestre_condition = "ic2.semestre IN (1, 2, 3)"
-                        else:  # 1° o 2° semestre
-                            # I semestrali si correlano con: stesso semestre + annuali
-                            semestre_condition = f"ic2.semestre IN ({semestre}, 3)"
-                        
-                        cursor.execute(f"""
-                            SELECT DISTINCT i2.id
-                            FROM insegnamenti_cds ic1
-                            JOIN insegnamenti_cds ic2 ON ic1.cds = ic2.cds 
-                                AND ic1.anno_corso = ic2.anno_corso 
-                                AND ic1.anno_accademico = ic2.anno_accademico
-                            JOIN insegnamenti i2 ON ic2.insegnamento = i2.id
-                            WHERE ic1.insegnamento = %s 
-                            AND ic1.anno_accademico = %s
-                            AND ({semestre_condition})
-                        """, (ins_id, anno))
-                        
-                        insegnamenti_correlati = [row[0] for row in cursor.fetchall()]
-                        insegnamenti_autorizzati.extend(insegnamenti_correlati)
-                    insegnamenti_autorizzati = list(set(insegnamenti_autorizzati))
+                    insegnamenti_correlati = ottieni_insegnamenti_correlati(cursor, insegnamenti_selezionati, anno)
+                    insegnamenti_autorizzati = list(set(insegnamenti_autorizzati) | set(insegnamenti_correlati))
         # Ottieni i codocenti per gli insegnamenti del docente (solo per non-admin)
         codocenti_set = set()
         if not is_admin_user:
@@ -262,6 +296,14 @@ def get_esami():
                                   (e.mostra_nel_calendario = true OR e.docente = ANY(%s))"""
                 params = (insegnamenti_autorizzati, codocenti_list)
         
+        # In modalità incrementale solo gli esami modificati dopo le versioni del client
+        condizione_versione = "versione > COALESCE((%s::jsonb ->> anno_accademico::text)::bigint, 0)"
+        filtro_versione = ""
+        if since is not None:
+            versioni_json = json.dumps({str(anno_v): v for anno_v, v in versioni_client.items()})
+            filtro_versione = "AND e.versione > COALESCE((%s::jsonb ->> e.anno_accademico::text)::bigint, 0)"
+            params = tuple(params) + (versioni_json,)
+        
         query = f"""
             SELECT e.id, e.descrizione, e.docente, 
                    CONCAT(u.nome, ' ', u.cognome) as docente_nome,
@@ -278,6 +320,7 @@ def get_esami():
             LEFT JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico AND ic.curriculum_codice = c.curriculum_codice
             LEFT JOIN aule a ON e.aula = a.nome
             {where_clause}
+            {filtro_versione}
             ORDER BY e.data_appello, e.ora_appello
         """
         
@@ -334,7 +377,17 @@ def get_esami():
                 }
             })
         
-        return jsonify(exams)
+        if since is None:
+            return risposta_esami(exams, token_versioni, etag)
+        
+        # Esami eliminati, più quelli modificati che non sono più visibili all'utente
+        cursor.execute(f"SELECT id FROM esami_eliminati WHERE {condizione_versione}", (versioni_json,))
+        eliminati = {str(row[0]) for row in cursor.fetchall()}
+        cursor.execute(f"SELECT id FROM esami WHERE {condizione_versione}", (versioni_json,))
+        visibili = {exam['id'] for exam in exams}
+        eliminati |= {str(row[0]) for row in cursor.fetchall()} - visibili
+        
+        return risposta_esami(exams, token_versioni, etag, since, eliminati)
         
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -388,13 +441,13 @@ def get_date_valide():
         # Se sono specificati insegnamenti, usa quelli per filtrare le sessioni
         if insegnamenti:
             sessions = ottieni_sessioni_da_insegnamenti(insegnamenti.split(','), anno)
-        else:
-            # Altrimenti usa tutte le sessioni del docente
-            sessions = ottieni_intersezione_sessioni_docente(docente, anno)
 
-        # Ottieni le vacanze per l'anno accademico e escludile dalle sessioni
-        vacanze = ottieni_vacanze(anno)
-        sessions_senza_vacanze = escludi_vacanze_da_sessioni(sessions, vacanze)
+            # Ottieni le vacanze per l'anno accademico e escludile dalle sessioni
+            vacanze = ottieni_vacanze(anno)
+            sessions_senza_vacanze = escludi_vacanze_da_sessioni(sessions, vacanze)
+        else:
+            # Altrimenti usa tutte le sessioni del docente, già senza vacanze (dalla cache)
+            sessions_senza_vacanze = ottieni_finestre_valide(anno, docente).sessioni
 
         date_valide = [
             [session['inizio'].isoformat(), session['fine'].isoformat(), session['nome'], session.get('sessione_id', ''), session.get('nome_base', session['nome']), session.get('parte_numero'), session.get('totale_parti')]
@@ -499,19 +552,55 @@ def check_esami_minimi():
         target_result = cursor.fetchone()
         target_esami = target_result[0] if target_result else 8
         
-        # 2. Ottieni gli insegnamenti del docente che richiedono inserimento esami
-        cursor.execute("""
-            SELECT DISTINCT i.id, i.titolo, ic.cds, 
-                   COALESCE(c.nome_corso, 'N/D') as nome_corso, ic.semestre
-            FROM insegnamenti i
-            JOIN insegnamento_docente id ON i.id = id.insegnamento
-            JOIN insegnamenti_cds ic ON i.id = ic.insegnamento
-            LEFT JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico 
-                       AND ic.curriculum_codice = c.curriculum_codice
-            WHERE id.docente = %s AND id.annoaccademico = %s AND ic.anno_accademico = %s 
-                  AND ic.inserire_esami = true
-        """, (docente, anno, anno))
+        # 2. Insegnamenti del docente che richiedono inserimento esami, con una sola query
+        #    aggregata: esami ufficiali totali (di qualunque docente) e, per ogni tipo di
+        #    sessione del CdS (curriculum GEN), minimi richiesti ed esami nella sessione.
+        #    Qui gli esami dell'insegnamento si contano nelle sessioni del CdS della riga,
+        #    qualunque sia il loro CdS, quindi non si può leggere riepilogo_esami (che li
+        #    attribuisce alle sessioni del proprio CdS)
+        query = """
+            WITH insegnamenti_docente AS (
+                SELECT DISTINCT i.id, i.titolo, ic.cds,
+                       COALESCE(c.nome_corso, 'N/D') as nome_corso, ic.semestre
+                FROM insegnamenti i
+                JOIN insegnamento_docente id ON i.id = id.insegnamento
+                JOIN insegnamenti_cds ic ON i.id = ic.insegnamento
+                LEFT JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico 
+                           AND ic.curriculum_codice = c.curriculum_codice
+                WHERE id.docente = %s AND id.annoaccademico = %s AND ic.anno_accademico = %s 
+                      AND ic.inserire_esami = true
+            )
+            SELECT d.id, d.titolo, d.cds, d.nome_corso, d.semestre,
+                   COUNT(e.id) as esami_totali
+        """
+        join_sessioni = ""
+        for tipo in TIPI_SESSIONE:
+            query += f""",
+                   s_{tipo}.inizio IS NOT NULL as sessione_{tipo},
+                   s_{tipo}.esami_primo_semestre as primo_{tipo},
+                   s_{tipo}.esami_secondo_semestre as secondo_{tipo},
+                   COUNT(CASE 
+                       WHEN e.data_appello BETWEEN s_{tipo}.inizio AND s_{tipo}.fine 
+                       THEN e.id 
+                   END) as esami_{tipo}
+            """
+            join_sessioni += f"""
+            LEFT JOIN sessioni s_{tipo} ON s_{tipo}.cds = d.cds AND s_{tipo}.anno_accademico = %s
+                      AND s_{tipo}.curriculum_codice = 'GEN' AND s_{tipo}.tipo_sessione = '{tipo}'
+            """
+        query += """
+            FROM insegnamenti_docente d
+            LEFT JOIN esami e ON e.insegnamento = d.id AND e.anno_accademico = %s
+                      AND e.mostra_nel_calendario = true
+        """ + join_sessioni + """
+            GROUP BY d.id, d.titolo, d.cds, d.nome_corso, d.semestre
+        """ + "".join(
+            f", s_{tipo}.inizio, s_{tipo}.esami_primo_semestre, s_{tipo}.esami_secondo_semestre"
+            for tipo in TIPI_SESSIONE
+        ) + " ORDER BY d.titolo, d.cds"
+        params = [docente, anno, anno, anno] + [anno] * len(TIPI_SESSIONE)
         
+        cursor.execute(query, params)
         insegnamenti = cursor.fetchall()
         
         if not insegnamenti:
@@ -524,32 +613,16 @@ def check_esami_minimi():
         
         insegnamenti_problematici = []
         
-        for insegnamento in insegnamenti:
-            ins_id, ins_titolo, cds_code, nome_corso, semestre = insegnamento
+        for riga in insegnamenti:
+            ins_id, ins_titolo, cds_code, nome_corso, semestre, esami_totali = riga[:6]
             
-            # 3. Conta TUTTI gli esami per questo insegnamento (di qualunque docente) che sono ufficiali
-            cursor.execute("""
-                SELECT COUNT(*) FROM esami 
-                WHERE insegnamento = %s AND anno_accademico = %s 
-                      AND mostra_nel_calendario = true
-            """, (ins_id, anno))
-            
-            esami_totali = cursor.fetchone()[0]
-            
-            # 4. Ottieni le sessioni per questo CdS
-            cursor.execute("""
-                SELECT tipo_sessione, inizio, fine, esami_primo_semestre, esami_secondo_semestre
-                FROM sessioni
-                WHERE cds = %s AND anno_accademico = %s AND curriculum_codice = 'GEN'
-            """, (cds_code, anno))
-            
-            sessioni = cursor.fetchall()
-            
-            # 5. Verifica ogni sessione per problemi
+            # 3. Verifica in memoria ogni sessione del CdS
             sessioni_problematiche = []
             
-            for sessione in sessioni:
-                tipo_sess, inizio, fine, esami_primo, esami_secondo = sessione
+            for indice, tipo_sess in enumerate(TIPI_SESSIONE):
+                presente, esami_primo, esami_secondo, esami_presenti = riga[6 + 4 * indice:10 + 4 * indice]
+                if not presente:
+                    continue
                 
                 # Calcola minimo richiesto per questo insegnamento/semestre
                 if semestre == 1:
@@ -560,44 +633,22 @@ def check_esami_minimi():
                     minimo_richiesto = 0
                 
                 if minimo_richiesto > 0:
-                    # 6. Conta TUTTI gli esami in questa sessione (di qualunque docente) che sono ufficiali
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM esami 
-                        WHERE insegnamento = %s AND anno_accademico = %s
-                              AND data_appello >= %s AND data_appello <= %s
-                              AND mostra_nel_calendario = true
-                    """, (ins_id, anno, inizio, fine))
-                    
-                    esami_presenti = cursor.fetchone()[0]
-                    
-                    # 7. Verifica se è problematica
                     if esami_presenti < minimo_richiesto:
                         sessioni_problematiche.append({
                             'tipo_sessione': tipo_sess,
                             'esami_presenti': esami_presenti,
                             'minimo_richiesto': minimo_richiesto
                         })
-                elif semestre == 3 and tipo_sess == 'anticipata' and minimo_richiesto == 0:
-                    # Per insegnamenti annuali in anticipata, verifica che non ci siano appelli
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM esami 
-                        WHERE insegnamento = %s AND anno_accademico = %s
-                              AND data_appello >= %s AND data_appello <= %s
-                              AND mostra_nel_calendario = true
-                    """, (ins_id, anno, inizio, fine))
-                    
-                    esami_presenti = cursor.fetchone()[0]
-                    
-                    # Se ci sono appelli in anticipata per insegnamenti annuali, è un problema
-                    if esami_presenti > 0:
-                        sessioni_problematiche.append({
-                            'tipo_sessione': tipo_sess,
-                            'esami_presenti': esami_presenti,
-                            'minimo_richiesto': 0,
-                            'messaggio': 'Gli insegnamenti annuali non devono avere appelli in sessione anticipata'
-                        })
+                elif semestre == 3 and tipo_sess == 'anticipata' and esami_presenti > 0:
+                    # Gli insegnamenti annuali non devono avere appelli in anticipata
+                    sessioni_problematiche.append({
+                        'tipo_sessione': tipo_sess,
+                        'esami_presenti': esami_presenti,
+                        'minimo_richiesto': 0,
+                        'messaggio': 'Gli insegnamenti annuali non devono avere appelli in sessione anticipata'
+                    })
             
-            # 8. Aggiungi agli insegnamenti problematici se necessario
+            # 4. Aggiungi agli insegnamenti problematici se necessario
             sotto_target = esami_totali < target_esami
             ha_sessioni_problematiche = len(sessioni_problematiche) > 0
             
@@ -2,16 +2,87 @@ from flask import Blueprint, request, jsonify, session, send_file
 from datetime import datetime, timedelta, date, time
 import io
 import logging
+import difflib
+import unicodedata
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.datavalidation import DataValidation
 from db import get_db_connection, release_connection
 from auth import require_auth
-from exams import controlla_vincoli, inserisci_esami
+from exams import controlla_vincoli_batch, inserisci_esami, inserisci_esami_bulk
+from utils.jobs import avvia_job
 
 import_bp = Blueprint('import_bp', __name__)
 
+def _insegnamenti_docente(cursor, username, anno=None):
+    """Insegnamenti del docente (dell'anno, se indicato) come righe (id, titolo, nome CdS, codice CdS)."""
+    query = """
+        SELECT DISTINCT i.id, i.titolo, c.nome_corso, c.codice as cds_codice
+        FROM insegnamenti i
+        JOIN insegnamento_docente id ON i.id = id.insegnamento
+        JOIN insegnamenti_cds ic ON i.id = ic.insegnamento
+        JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico
+        WHERE id.docente = %s
+    """
+    
+    params = [username]
+    if anno:
+        query += " AND id.annoaccademico = %s"
+        params.append(anno)
+        
+    query += " ORDER BY c.nome_corso, i.titolo"
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+def _normalizza_titolo(titolo):
+    """Titolo senza accenti, in minuscolo e con gli spazi compattati, per i confronti."""
+    decomposto = unicodedata.normalize('NFKD', str(titolo))
+    senza_accenti = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(senza_accenti.casefold().split())
+
+class IndiceTitoliInsegnamenti:
+    """
+    Indice in memoria dei titoli degli insegnamenti di un docente, per risolvere le righe
+    del file senza codice insegnamento. Costruito una volta per import con la stessa query
+    del template; cerca il titolo normalizzato esatto, poi i titoli che lo contengono,
+    infine il più simile.
+    """
+    # Somiglianza minima (difflib) per accettare un titolo non identico
+    SOGLIA_SOMIGLIANZA = 0.8
+
+    def __init__(self, insegnamenti):
+        self.per_titolo = {}  # titolo normalizzato -> [(id, nome CdS normalizzato, codice CdS)]
+        for insegnamento_id, titolo, nome_corso, cds_codice in insegnamenti:
+            self.per_titolo.setdefault(_normalizza_titolo(titolo), []).append(
+                (insegnamento_id, _normalizza_titolo(nome_corso or ''), cds_codice)
+            )
+        self.titoli = sorted(self.per_titolo)
+
+    @classmethod
+    def carica(cls, cursor, username, anno):
+        return cls(_insegnamenti_docente(cursor, username, anno))
+
+    def trova(self, titolo, cds_nome=None, codice_cds=None):
+        """Id dell'insegnamento con il titolo indicato (None se non trovato)."""
+        chiave = _normalizza_titolo(titolo)
+        if not chiave:
+            return None
+        candidati = self.per_titolo.get(chiave)
+        if candidati is None:
+            # Titoli che contengono il testo della riga, come la vecchia ricerca con LIKE
+            candidati = [c for t in self.titoli if chiave in t for c in self.per_titolo[t]]
+        if not candidati:
+            simili = difflib.get_close_matches(chiave, self.titoli, n=1, cutoff=self.SOGLIA_SOMIGLIANZA)
+            if not simili:
+                return None
+            candidati = self.per_titolo[simili[0]]
+
+        # A parità di titolo si preferisce l'insegnamento del CdS della riga, poi l'id minore
+        cds_nome = _normalizza_titolo(cds_nome or '')
+        stesso_cds = [c for c in candidati if (codice_cds and c[2] == codice_cds) or (cds_nome and c[1] == cds_nome)]
+        return min(c[0] for c in (stesso_cds or candidati))
+
 @import_bp.route('/api/get-exam-template')
 @require_auth
 def get_exam_template():
@@ -26,24 +97,8 @@ def get_exam_template():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Query per insegnamenti del docente con nomi CdS
-        query = """
-            SELECT DISTINCT i.id, i.titolo, c.nome_corso, c.codice as cds_codice
-            FROM insegnamenti i
-            JOIN insegnamento_docente id ON i.id = id.insegnamento
-            JOIN insegnamenti_cds ic ON i.id = ic.insegnamento
-            JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico
-            WHERE id.docente = %s
-        """
-        
-        params = [username]
-        if anno:
-            query += " AND id.annoaccademico = %s"
-            params.append(anno)
-            
-        query += " ORDER BY c.nome_corso, i.titolo"
-        cursor.execute(query, params)
-        insegnamenti = cursor.fetchall()
+        # Insegnamenti del docente con nomi CdS
+        insegnamenti = _insegnamenti_docente(cursor, username, anno)
         
         # Recupera aule
         cursor.execute("SELECT nome FROM aule WHERE nome != 'Studio docente DMI' ORDER BY nome")
@@ -291,6 +346,185 @@ def get_exam_template():
         logging.error(f"Errore template: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Mappature per conversione valori user-friendly -> valori tecnici
+VERBALIZZAZIONE_MAP = {
+    "Prova finale": "FSS",
+    "Prova finale con pubblicazione": "FWP", 
+    "Prova parziale": "PAR",
+    "Prova parziale con pubblicazione": "PPP"
+}
+
+TIPO_ESAME_MAP = {
+    "Scritto": "S",
+    "Orale": "O", 
+    "Scritto e orale": "SO"
+}
+
+TIPO_APPELLO_MAP = {
+    "Prova finale": "PF",
+    "Prova finale con pubblicazione": "PF",
+    "Prova parziale": "PP", 
+    "Prova parziale con pubblicazione": "PP"
+}
+
+# Colonne del template (vedi get_exam_template) e righe controllate e inserite per volta:
+# il file viene letto in streaming, quindi la memoria usata non dipende dalla sua dimensione
+NUMERO_COLONNE_TEMPLATE = 14
+DIMENSIONE_BLOCCO_IMPORT = 200
+
+def _righe_foglio(foglio):
+    """
+    Genera (numero riga, valori) delle righe del foglio saltando l'header, con i valori
+    completati a NUMERO_COLONNE_TEMPLATE (in read-only le righe possono essere più corte).
+    """
+    for i, values in enumerate(foglio.iter_rows(min_row=2, values_only=True), 2):
+        values = list(values[:NUMERO_COLONNE_TEMPLATE])
+        values += [None] * (NUMERO_COLONNE_TEMPLATE - len(values))
+        yield i, values
+
+def _formatta_data_iscrizione(valore, predefinito):
+    """Data di iscrizione in formato YYYY-MM-DD, con il valore predefinito se mancante."""
+    if not valore:
+        return predefinito
+    if isinstance(valore, (datetime, date)):
+        return valore.strftime('%Y-%m-%d')
+    try:
+        # Prova formato italiano
+        return datetime.strptime(str(valore), '%d-%m-%Y').strftime('%Y-%m-%d')
+    except ValueError:
+        return str(valore)
+
+def _analizza_riga(values, username, anno, indice_titoli):
+    """
+    Converte una riga del template nei dati di un esame per inserisci_esami.
+    Ritorna None per le righe vuote, solleva ValueError se la riga non è valida.
+    """
+    if not any(values[:2]):  # Salta righe vuote (CdS e Insegnamento)
+        return None
+
+    # Estrai valori dalla struttura riorganizzata
+    (cds_nome, insegnamento_nome, id_insegnamento, codice_cds, apertura_appelli, data, ora, durata,
+     aula, inizio_iscr, fine_iscr, verbalizzazione_friendly, tipo_esame_friendly, note) = values
+
+    # Controlli minimi per parsing (solo per evitare errori fatali)
+    if not all([cds_nome, insegnamento_nome, data, ora]):
+        raise ValueError("dati obbligatori mancanti")
+
+    # Parse e validazione data (supporta sia DD-MM-YYYY che YYYY-MM-DD)
+    if isinstance(data, (datetime, date)):
+        data_str = data.strftime('%Y-%m-%d')
+    else:
+        try:
+            data_str_input = str(data)
+            # Prova prima formato italiano DD-MM-YYYY
+            if len(data_str_input) == 10 and '-' in data_str_input:
+                parts = data_str_input.split('-')
+                if len(parts[0]) == 2:  # Formato DD-MM-YYYY
+                    data_obj = datetime.strptime(data_str_input, '%d-%m-%Y')
+                else:  # Formato YYYY-MM-DD
+                    data_obj = datetime.strptime(data_str_input, '%Y-%m-%d')
+            else:
+                # Fallback per altri formati
+                data_obj = datetime.strptime(data_str_input, '%d-%m-%Y')
+            data_str = data_obj.strftime('%Y-%m-%d')
+        except ValueError:
+            raise ValueError("formato data non valido (usare DD-MM-YYYY)")
+
+    # Parse ora
+    if isinstance(ora, (time, datetime)):
+        ora_h, ora_m = ora.hour, ora.minute
+    elif isinstance(ora, str) and ':' in ora:
+        try:
+            ora_h, ora_m = map(int, ora.split(':'))
+        except ValueError:
+            raise ValueError("formato ora non valido (usare HH:MM)")
+    else:
+        raise ValueError("formato ora non valido")
+
+    # Validazione durata (opzionale)
+    if not durata:
+        durata = None
+    else:
+        try:
+            durata = int(durata)
+        except (TypeError, ValueError):
+            raise ValueError("durata deve essere un numero")
+        if durata <= 0:
+            raise ValueError("durata deve essere un numero positivo")
+
+    # Conversione valori user-friendly
+    verbalizzazione = VERBALIZZAZIONE_MAP.get(verbalizzazione_friendly, "FSS")
+    tipo_esame = TIPO_ESAME_MAP.get(tipo_esame_friendly, None) 
+    tipo_appello = TIPO_APPELLO_MAP.get(verbalizzazione_friendly, "PF")
+
+    # Appello ufficiale
+    mostra_calendario = str(apertura_appelli).lower() in ['sì', 'si', 'yes', 'true', '1']
+
+    # Calcola date iscrizione se mancanti (gestisce formato italiano)
+    data_obj = datetime.strptime(data_str, '%Y-%m-%d')
+    inizio_iscr = _formatta_data_iscrizione(inizio_iscr, (data_obj - timedelta(days=30)).strftime('%Y-%m-%d'))
+    fine_iscr = _formatta_data_iscrizione(fine_iscr, (data_obj - timedelta(days=1)).strftime('%Y-%m-%d'))
+
+    # Usa id insegnamento se disponibile, altrimenti cerca per nome tra gli insegnamenti del docente
+    if not id_insegnamento:
+        id_insegnamento = indice_titoli.trova(insegnamento_nome, cds_nome, codice_cds)
+        if not id_insegnamento:
+            raise ValueError(f"insegnamento '{insegnamento_nome}' non trovato")
+
+    return {
+        'insegnamenti': [id_insegnamento],
+        'docente': username,
+        'anno_accademico': int(anno),
+        'sezioni_appelli': [{
+            'descrizione': f"Appello {insegnamento_nome}",
+            'data_appello': data_str,
+            'ora_h': str(ora_h).zfill(2),
+            'ora_m': str(ora_m).zfill(2),
+            'ora_appello': f"{ora_h:02d}:{ora_m:02d}",
+            'durata': str(durata),
+            'durata_appello': durata,
+            'aula': aula,
+            'inizio_iscrizione': inizio_iscr,
+            'fine_iscrizione': fine_iscr,
+            'verbalizzazione': verbalizzazione,
+            'tipo_esame': tipo_esame,
+            'note_appello': note or "",
+            'tipo_appello': tipo_appello,
+            'mostra_nel_calendario': mostra_calendario,
+            'tipo_iscrizione': "SOC" if tipo_esame == "SO" else (tipo_esame if tipo_esame else None),
+            'definizione_appello': 'STD',
+            'gestione_prenotazione': 'STD',
+            'riservato': False,
+            'posti': None,
+            'periodo': 1 if ora_h >= 14 else 0
+        }]
+    }
+
+def _esami_da_righe(righe, username, anno, indice_titoli, errori):
+    """Genera (numero riga, esame) per le righe valide, aggiungendo a 'errori' le altre."""
+    for i, values in righe:
+        try:
+            esame = _analizza_riga(values, username, anno, indice_titoli)
+        except ValueError as e:
+            errori.append(f"Riga {i}: {str(e)}")
+            continue
+        except Exception as e:
+            errori.append(f"Riga {i}: errore elaborazione - {str(e)}")
+            continue
+        if esame is not None:
+            yield i, esame
+
+def _blocchi(righe, dimensione):
+    """Raggruppa un iterabile in liste di al più 'dimensione' elementi."""
+    blocco = []
+    for riga in righe:
+        blocco.append(riga)
+        if len(blocco) == dimensione:
+            yield blocco
+            blocco = []
+    if blocco:
+        yield blocco
+
 @import_bp.route('/api/import-exams-from-file', methods=['POST'])
 @require_auth
 def import_exams_from_file():
@@ -306,236 +540,104 @@ def import_exams_from_file():
     if not username or not anno:
         return jsonify({"success": False, "message": "Dati mancanti"}), 401
     
+    # L'import viene eseguito in background: la risposta è il risultato del job
+    job_id = avvia_job('import_esami', username, importa_esami_da_file, file.read(), username, anno, bypass)
+    return jsonify({"success": True, "status": "accepted", "job_id": job_id}), 202
+
+def _titolo_insegnamento(cursor, insegnamento_id):
+    """Titolo dell'insegnamento per i messaggi di errore (l'id se non trovato)."""
     try:
-        # Mappature per conversione valori user-friendly -> valori tecnici
-        verbalizzazione_map = {
-            "Prova finale": "FSS",
-            "Prova finale con pubblicazione": "FWP", 
-            "Prova parziale": "PAR",
-            "Prova parziale con pubblicazione": "PPP"
-        }
-        
-        tipo_esame_map = {
-            "Scritto": "S",
-            "Orale": "O", 
-            "Scritto e orale": "SO"
-        }
-        
-        tipo_appello_map = {
-            "Prova finale": "PF",
-            "Prova finale con pubblicazione": "PF",
-            "Prova parziale": "PP", 
-            "Prova parziale con pubblicazione": "PP"
-        }
-        
-        # Processa Excel
-        wb = load_workbook(io.BytesIO(file.read()), data_only=True)
-        rows = list(wb.active.rows)[1:]  # Salta header
-        
-        esami = []
-        errori = []
-        
-        for i, row in enumerate(rows, 2):
-            values = [cell.value for cell in row]
-            
-            if not any(values[:2]):  # Salta righe vuote (CdS e Insegnamento)
-                continue
-                
+        cursor.execute("SELECT titolo FROM insegnamenti WHERE id = %s", (insegnamento_id,))
+        result = cursor.fetchone()
+        return result[0] if result else insegnamento_id
+    except Exception:
+        return insegnamento_id
+
+def _avanzamento_righe(job, ultima_riga, righe_totali, inizio, fine, messaggio):
+    """Avanzamento del job tra 'inizio' e 'fine' in base all'ultima riga elaborata."""
+    if righe_totali:
+        job.avanzamento(min(fine, inizio + (fine - inizio) * ultima_riga // righe_totali),
+                        f'{messaggio}: {ultima_riga - 1}')
+    else:
+        job.avanzamento((inizio + fine) // 2, f'{messaggio}: {ultima_riga - 1}')
+
+def importa_esami_da_file(job, contenuto, username, anno, bypass):
+    """
+    Legge il file Excel in streaming e ritorna la risposta JSON.
+    Prima tutte le righe vengono controllate a blocchi rispetto allo stesso stato del
+    database, senza inserire nulla: i contesti di validazione sono condivisi tra i
+    blocchi, così ogni riga è controllata anche rispetto alle precedenti accettate.
+    Poi gli esami accettati, già analizzati, vengono inseriti a blocchi. La memoria
+    usata cresce quindi con il numero di righe accettate; con i controlli bypassati
+    ogni blocco viene inserito appena letto.
+    """
+    errori = []
+    fallimenti = []
+    successi = 0
+    validi = 0
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    wb = None
+    try:
+        job.avanzamento(5, 'Lettura del file')
+        wb = load_workbook(io.BytesIO(contenuto), read_only=True, data_only=True)
+        foglio = wb.active
+        righe_totali = foglio.max_row or 0  # dalle dimensioni dichiarate nel file, se presenti
+        indice_titoli = IndiceTitoliInsegnamenti.carica(cursor, username, anno)
+
+        righe = _esami_da_righe(_righe_foglio(foglio), username, anno, indice_titoli, errori)
+
+        # Controllo di tutto il file prima di inserire: inserire mentre si controlla
+        # renderebbe incoerente il contesto (contatori di sovrapposizione contati due
+        # volte, grafi già caricati senza gli insegnamenti dei blocchi successivi)
+        if not bypass:
+            righe_valide = []
+            contesti = {}
+            for blocco in _blocchi(righe, DIMENSIONE_BLOCCO_IMPORT):
+                esiti = controlla_vincoli_batch([esame for _, esame in blocco], conn=conn, contesti=contesti)
+                for riga, (ok, msg) in zip(blocco, esiti):
+                    if ok:
+                        righe_valide.append(riga)
+                    else:
+                        errori.append(f"Riga {riga[0]}: {msg}")
+                _avanzamento_righe(job, blocco[-1][0], righe_totali, 10, 50, 'Righe controllate')
+            contesti.clear()
+            wb.close()
+            wb = None
+            righe = righe_valide
+
+        for blocco in _blocchi(righe, DIMENSIONE_BLOCCO_IMPORT):
+            esami = [esame for _, esame in blocco]
+            validi += len(esami)
+
+            # Inserisci gli esami del blocco in un'unica transazione; se fallisce si
+            # riprova esame per esame per individuare quelli non inseribili. Un esame
+            # non inserito non invalida i controlli delle righe successive, che possono
+            # solo essere stati più restrittivi per la sua presenza
             try:
-                # Estrai valori dalla struttura riorganizzata
-                cds_nome = values[0]
-                insegnamento_nome = values[1] 
-                
-                # Valori nascosti per elaborazione (ora subito dopo l'insegnamento)
-                id_insegnamento = values[2] if len(values) > 2 else None
-                codice_cds = values[3] if len(values) > 3 else None
-                
-                apertura_appelli = values[4]
-                data = values[5]
-                ora = values[6]
-                durata = values[7]
-                aula = values[8]
-                inizio_iscr = values[9]
-                fine_iscr = values[10]
-                verbalizzazione_friendly = values[11]
-                tipo_esame_friendly = values[12]
-                note = values[13]
-                
-                # Controlli minimi per parsing (solo per evitare errori fatali)
-                if not all([cds_nome, insegnamento_nome, data, ora]):
-                    errori.append(f"Riga {i}: dati obbligatori mancanti")
-                    continue
-                
-                # Parse e validazione data (supporta sia DD-MM-YYYY che YYYY-MM-DD)
-                if isinstance(data, (datetime, date)):
-                    data_str = data.strftime('%Y-%m-%d')
-                else:
-                    try:
-                        data_str_input = str(data)
-                        # Prova prima formato italiano DD-MM-YYYY
-                        if len(data_str_input) == 10 and '-' in data_str_input:
-                            parts = data_str_input.split('-')
-                            if len(parts[0]) == 2:  # Formato DD-MM-YYYY
-                                data_obj = datetime.strptime(data_str_input, '%d-%m-%Y')
-                            else:  # Formato YYYY-MM-DD
-                                data_obj = datetime.strptime(data_str_input, '%Y-%m-%d')
-                        else:
-                            # Fallback per altri formati
-                            data_obj = datetime.strptime(data_str_input, '%d-%m-%Y')
-                        data_str = data_obj.strftime('%Y-%m-%d')
-                    except:
-                        errori.append(f"Riga {i}: formato data non valido (usare DD-MM-YYYY)")
-                        continue
-                
-                # Parse ora
-                if isinstance(ora, (time, datetime)):
-                    ora_h, ora_m = ora.hour, ora.minute
-                elif isinstance(ora, str) and ':' in ora:
-                    try:
-                        ora_h, ora_m = map(int, ora.split(':'))
-                    except:
-                        errori.append(f"Riga {i}: formato ora non valido (usare HH:MM)")
-                        continue
-                else:
-                    errori.append(f"Riga {i}: formato ora non valido")
-                    continue
-                
-                # Validazione durata (opzionale)
-                if not durata:
-                    durata = None
-                else:
+                inserisci_esami_bulk(esami)
+                successi += len(esami)
+            except Exception:
+                for esame in esami:
                     try:
-                        durata = int(durata)
-                        if durata <= 0:
-                            errori.append(f"Riga {i}: durata deve essere un numero positivo")
-                            continue
-                    except:
-                        errori.append(f"Riga {i}: durata deve essere un numero")
-                        continue
-                
-                # Conversione valori user-friendly
-                verbalizzazione = verbalizzazione_map.get(verbalizzazione_friendly, "FSS")
-                tipo_esame = tipo_esame_map.get(tipo_esame_friendly, None) 
-                tipo_appello = tipo_appello_map.get(verbalizzazione_friendly, "PF")
-                
-                # Appello ufficiale
-                mostra_calendario = str(apertura_appelli).lower() in ['sì', 'si', 'yes', 'true', '1']
-                
-                # Calcola date iscrizione se mancanti (gestisce formato italiano)
-                data_obj = datetime.strptime(data_str, '%Y-%m-%d')
-                
-                if not inizio_iscr:
-                    inizio_iscr = (data_obj - timedelta(days=30)).strftime('%Y-%m-%d')
-                elif isinstance(inizio_iscr, (datetime, date)):
-                    inizio_iscr = inizio_iscr.strftime('%Y-%m-%d')
-                else:
-                    try:
-                        # Prova formato italiano
-                        inizio_obj = datetime.strptime(str(inizio_iscr), '%d-%m-%Y')
-                        inizio_iscr = inizio_obj.strftime('%Y-%m-%d')
-                    except:
-                        inizio_iscr = str(inizio_iscr)
-                
-                if not fine_iscr:
-                    fine_iscr = (data_obj - timedelta(days=1)).strftime('%Y-%m-%d')
-                elif isinstance(fine_iscr, (datetime, date)):
-                    fine_iscr = fine_iscr.strftime('%Y-%m-%d')
-                else:
-                    try:
-                        # Prova formato italiano
-                        fine_obj = datetime.strptime(str(fine_iscr), '%d-%m-%Y')
-                        fine_iscr = fine_obj.strftime('%Y-%m-%d')
-                    except:
-                        fine_iscr = str(fine_iscr)
-                
-                # Usa id insegnamento se disponibile, altrimenti cerca per nome
-                if not id_insegnamento:
-                    # Fallback: cerca insegnamento per nome (meno affidabile)
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT id FROM insegnamenti WHERE titolo LIKE %s LIMIT 1", 
-                                 (f"%{insegnamento_nome}%",))
-                    result = cursor.fetchone()
-                    cursor.close()
-                    release_connection(conn)
-                    
-                    if not result:
-                        errori.append(f"Riga {i}: insegnamento '{insegnamento_nome}' non trovato")
-                        continue
-                    id_insegnamento = result[0]
-                
-                esame = {
-                    'insegnamenti': [id_insegnamento],
-                    'docente': username,
-                    'anno_accademico': int(anno),
-                    'sezioni_appelli': [{
-                        'descrizione': f"Appello {insegnamento_nome}",
-                        'data_appello': data_str,
-                        'ora_h': str(ora_h).zfill(2),
-                        'ora_m': str(ora_m).zfill(2),
-                        'ora_appello': f"{ora_h:02d}:{ora_m:02d}",
-                        'durata': str(durata),
-                        'durata_appello': durata,
-                        'aula': aula,
-                        'inizio_iscrizione': inizio_iscr,
-                        'fine_iscrizione': fine_iscr,
-                        'verbalizzazione': verbalizzazione,
-                        'tipo_esame': tipo_esame,
-                        'note_appello': note or "",
-                        'tipo_appello': tipo_appello,
-                        'mostra_nel_calendario': mostra_calendario,
-                        'tipo_iscrizione': "SOC" if tipo_esame == "SO" else (tipo_esame if tipo_esame else None),
-                        'definizione_appello': 'STD',
-                        'gestione_prenotazione': 'STD',
-                        'riservato': False,
-                        'posti': None,
-                        'periodo': 1 if ora_h >= 14 else 0
-                    }]
-                }
-                
-                # Controllo vincoli tramite funzione centralizzata
-                if not bypass:
-                    ok, msg = controlla_vincoli(esame)
-                    if not ok:
-                        errori.append(f"Riga {i}: {msg}")
-                        continue
-                
-                esami.append(esame)
-                
-            except Exception as e:
-                errori.append(f"Riga {i}: errore elaborazione - {str(e)}")
-        
-        if not esami:
-            return jsonify({
+                        inserisci_esami(esame)
+                        successi += 1
+                    except Exception as e:
+                        # Nome dell'insegnamento per un errore più chiaro
+                        titolo = _titolo_insegnamento(cursor, esame['insegnamenti'][0])
+                        fallimenti.append(f"Inserimento {titolo}: {str(e)}")
+
+            _avanzamento_righe(job, blocco[-1][0], righe_totali, 50 if not bypass else 10, 95, 'Righe inserite')
+
+        if not validi:
+            return {
                 "success": False,
                 "message": f"Nessun esame valido trovato. {len(errori)} errori rilevati.",
                 "formatErrors": errori,
                 "totalErrors": len(errori)
-            }), 400
-        
-        # Inserisci esami
-        successi = 0
-        fallimenti = []
-        
-        for esame in esami:
-            try:
-                inserisci_esami(esame)
-                successi += 1
-            except Exception as e:
-                # Trova il nome dell'insegnamento per un errore più chiaro
-                try:
-                    conn_temp = get_db_connection()
-                    cursor_temp = conn_temp.cursor()
-                    cursor_temp.execute("SELECT titolo FROM insegnamenti WHERE id = %s", (esame['insegnamenti'][0],))
-                    result = cursor_temp.fetchone()
-                    titolo = result[0] if result else esame['insegnamenti'][0]
-                    cursor_temp.close()
-                    release_connection(conn_temp)
-                except:
-                    titolo = esame['insegnamenti'][0]
-                
-                fallimenti.append(f"Inserimento {titolo}: {str(e)}")
-        
+            }
+
         # Prepara risposta con errori categorizzati
         message = f"{successi} esami inseriti con successo"
         if bypass:
@@ -545,15 +647,20 @@ def import_exams_from_file():
         if total_errors > 0:
             message += f", {total_errors} errori rilevati"
         
-        return jsonify({
+        return {
             "success": successi > 0,
             "message": message,
             "importedCount": successi,
             "totalErrors": total_errors,
             "formatErrors": errori,
             "insertionErrors": fallimenti
-        })
+        }
     
     except Exception as e:
         logging.error(f"Errore import: {e}")
-        return jsonify({"success": False, "message": f"Errore durante l'importazione: {e}"}), 500
\ No newline at end of file
+        return {"success": False, "message": f"Errore durante l'importazione: {e}"}
+    finally:
+        if wb is not None:
+            wb.close()
+        cursor.close()
+        release_connection(conn)
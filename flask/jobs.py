@@ -0,0 +1,32 @@
+from flask import Blueprint, jsonify, session, send_file
+import io
+from auth import require_auth
+from utils.jobs import stato_job, file_job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+def _autorizzato(utente):
+    """Un job è visibile a chi l'ha avviato e agli admin."""
+    return session.get('permessi_admin') or utente == session.get('username')
+
+@jobs_bp.route('/api/jobs/<job_id>')
+@require_auth
+def get_job(job_id):
+    """Stato, avanzamento e, a job concluso, risultato di un job in background."""
+    job = stato_job(job_id)
+    if job is None or not _autorizzato(job['utente']):
+        return jsonify({'status': 'error', 'message': 'Job non trovato'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+@jobs_bp.route('/api/jobs/<job_id>/file')
+@require_auth
+def download_job_file(job_id):
+    """Scarica il file prodotto da un job concluso."""
+    trovato = file_job(job_id)
+    if trovato is None or not _autorizzato(trovato[0]):
+        return jsonify({'status': 'error', 'message': 'File non trovato'}), 404
+    _, file = trovato
+    return send_file(io.BytesIO(file.contenuto),
+                     mimetype=file.mimetype,
+                     as_attachment=True,
+                     download_name=file.nome_file)
@@ -5,6 +5,7 @@ import os
 
 # Import delle funzioni di supporto
 from db import init_db
+from utils.easyacademy import avvia_aggiornamento as avvia_aggiornamento_easyacademy
 
 # Import dei blueprint
 from auth import auth_bp
@@ -12,6 +13,7 @@ from fetch import fetch_bp
 from exams import exam_bp
 from user_preferences import preferences_bp
 from import_esami import import_bp
+from jobs import jobs_bp
 
 # Import dei blueprint oh-issa
 from oh_issa.common import common_bp
@@ -38,6 +40,9 @@ app.wsgi_app = ProxyFix(
 # Inizializza il pool di connessioni
 init_db()
 
+# Avvia l'aggiornamento in background della cache delle aule di EasyAcademy
+avvia_aggiornamento_easyacademy()
+
 # Configurazione della sessione
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['SESSION_TYPE'] = 'filesystem'  # Future work: usare Redis o altro backend
@@ -50,6 +55,7 @@ app.register_blueprint(fetch_bp)
 app.register_blueprint(preferences_bp)
 app.register_blueprint(exam_bp)
 app.register_blueprint(import_bp)
+app.register_blueprint(jobs_bp)
 
 # Registrazione dei blueprint oh-issa
 app.register_blueprint(common_bp)
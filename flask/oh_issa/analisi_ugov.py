@@ -0,0 +1,636 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+import xlrd
+
+# Analisi dei file U-GOV (foglio "Insegnamenti e coperture"), condivisa da anteprima e import.
+# Il file analizzato viene conservato in cache per hash SHA-256 del contenuto: l'import
+# dopo l'anteprima riusa l'analisi senza rileggere il file.
+# La cache è locale al processo: con più worker gunicorn ognuno ha la propria copia.
+TTL_ANALISI = 30 * 60     # secondi
+MAX_ANALISI_IN_CACHE = 4
+
+_analisi = OrderedDict()  # hash -> (AnalisiUgov, momento dell'analisi)
+_lock = threading.Lock()
+
+# Mapping periodo → semestre (case-insensitive), default 3=Annuale
+_PERIODI_TO_SEMESTRE = {'PRIMO SEMESTRE': 1, 'SECONDO SEMESTRE': 2, 'ANNUALE': 3}
+def map_semestre_from_periodo(periodo):
+    return _PERIODI_TO_SEMESTRE.get(str(periodo).strip().upper(), 3)
+
+def _get_header_indices(sheet):
+    # Indici base (posizioni tipiche)
+    idx = {
+        'anno_accademico': 0,                      # A - Anno Offerta
+        'cod_cds': 6,                              # G - Cod. Corso di Studio
+        'des_cds': 8,                              # I - Des. C.d.S.
+        'cod_curriculum': 12,                      # M - Cod. Curriculum
+        'des_curriculum': 13,                      # N - Des. Curriculum
+        'id_insegnamento': 14,                     # O - Id. Insegnamento
+        'cod_insegnamento': 15,                    # P - Cod. Insegnamento
+        'des_insegnamento': 16,                    # Q - Des. Insegnamento
+        'cod_taf_insegnamento': 18,                # S - Cod. TAF Insegnamento
+        'id_ambito_insegnamento': 20,              # U - Id. Ambito Insegnamento
+        'anno_corso': 28,                          # AC - Anno Corso
+        'cfu_insegnamento': 29,                    # AD - CFU
+        'des_periodo_insegnamento': 39,            # AN - Periodo Insegnamento
+        'matricola_titolare': 55,                  # BD - Matricola Resp. Did.
+        'af_master_insegnamento': 60,              # BI - AF Master Insegnamento
+        'des_raggruppamento_insegnamento': 63,     # BL - Des. Raggruppamento Ins.
+        'id_unita_didattica': 65,                  # BN - Id. Unità Didattica
+        'cod_unita_didattica': 66,                 # BO - Cod. Unità Didattica
+        'des_unita_didattica': 67,                 # BP - Des. Unità Didattica
+        'des_periodo_unita_didattica': 84,         # CC - Des. Periodo UD (se presente)
+        'af_master_unita_didattica': 99,           # CT - AF Master UD
+        'des_raggruppamento_unita_didattica': 100, # CW - Des. Raggruppamento UD
+        'matricola_docente': 105,                  # DB - Matricola Docente
+        'cognome_docente': 106,                    # DC - Cognome Docente
+        'nome_docente': 107,                       # DD - Nome Docente
+        'username_docente': 108                    # DE - Username
+    }
+    # Header dinamico
+    if sheet.nrows > 0:
+        header = [str(sheet.cell_value(0, i)).strip().upper() for i in range(sheet.ncols)]
+        header_map = {
+            'ANNO OFFERTA': 'anno_accademico',
+            'COD. CORSO DI STUDIO': 'cod_cds',
+            'DES. CORSO DI STUDIO': 'des_cds',
+            'COD. CURRICULUM': 'cod_curriculum',
+            'DES. CURRICULUM': 'des_curriculum',
+            'ID INSEGNAMENTO': 'id_insegnamento',
+            'COD. INSEGNAMENTO': 'cod_insegnamento',
+            'DES. INSEGNAMENTO': 'des_insegnamento',
+            'COD. TAF INSEGNAMENTO': 'cod_taf_insegnamento',
+            'ID. AMBITO INSEGNAMENTO': 'id_ambito_insegnamento',
+            'ANNO CORSO': 'anno_corso',
+            'PESO INSEGNAMENTO': 'cfu_insegnamento',
+            'DES. PERIODO INSEGNAMENTO': 'des_periodo_insegnamento',
+            'MATRICOLA RESP. DID. INSEGNAMENTO': 'matricola_titolare',
+            'AF MASTER INSEGNAMENTO': 'af_master_insegnamento',
+            'DES. RAGGRUPPAMENTO INSEGNAMENTO': 'des_raggruppamento_insegnamento',
+            'ID UNITÀ DIDATTICA': 'id_unita_didattica',
+            'COD. UNITÀ DIDATTICA': 'cod_unita_didattica',
+            'DES. UNITÀ DIDATTICA': 'des_unita_didattica',
+            'AF MASTER UNITÀ DIDATTICA': 'af_master_unita_didattica',
+            'DES. RAGGRUPPAMENTO UNITÀ DIDATTICA': 'des_raggruppamento_unita_didattica',
+            'MATRICOLA DOCENTE': 'matricola_docente',
+            'COGNOME DOCENTE': 'cognome_docente',
+            'NOME DOCENTE': 'nome_docente',
+            'USERNAME': 'username_docente',
+            "DES. PERIODO UNITÀ DIDATTICA": 'des_periodo_unita_didattica',
+            "DES. PERIODO UNITA DIDATTICA": 'des_periodo_unita_didattica',
+            "DES. PERIODO UNITA' DIDATTICA": 'des_periodo_unita_didattica'
+        }
+        for i, col_name in enumerate(header):
+            mapped = header_map.get(col_name)
+            if mapped:
+                idx[mapped] = i
+    return idx
+
+def _cell(sheet, row, col, default=''):
+    try:
+        val = sheet.cell_value(row, col)
+        return default if val in (None, '') else val
+    except Exception:
+        return default
+
+def _should_import_row(sheet, row_idx, idx):
+    # Logica: accetta S in {A,B,C,NULL} oppure S=F e U=70285
+    cod_taf_raw = _cell(sheet, row_idx, idx.get('cod_taf_insegnamento', 18), None)
+    cod_taf = str(cod_taf_raw).strip().upper() if cod_taf_raw else ''
+    if cod_taf in ('', 'A', 'B', 'C'):
+        return True, None
+    if cod_taf == 'F':
+        id_ambito_raw = _cell(sheet, row_idx, idx.get('id_ambito_insegnamento', 20), '')
+        id_ambito = str(int(float(id_ambito_raw))).strip()
+        if id_ambito == '70285':
+            return True, None
+        else:
+            return False, f"Cod. TAF = 'F' ma Id. Ambito ≠ 70285 (valore: '{id_ambito}')"
+    return False, f"Cod. TAF non valido per importazione (valore: '{cod_taf}')"
+
+def _parse_row(sheet, row_idx, idx):
+    return {
+        'anno_accademico': int(float(_cell(sheet, row_idx, idx['anno_accademico'], 0))),
+        'cod_cds': str(_cell(sheet, row_idx, idx['cod_cds'], '???CDS???')).strip(),
+        'des_cds': str(_cell(sheet, row_idx, idx['des_cds'], '???NOME_CDS???')).strip(),
+        'cod_curriculum': str(_cell(sheet, row_idx, idx['cod_curriculum'], 'GEN')).strip(),
+        'des_curriculum': str(_cell(sheet, row_idx, idx['des_curriculum'], 'CORSO GENERICO')).strip(),
+        'id_insegnamento': str(_cell(sheet, row_idx, idx['id_insegnamento'], '???ID???')).replace('.0', '').strip(),
+        'cod_insegnamento': str(_cell(sheet, row_idx, idx['cod_insegnamento'], '???COD???')).strip(),
+        'des_insegnamento': str(_cell(sheet, row_idx, idx['des_insegnamento'], '???NOME_INSEGNAMENTO???')).strip(),
+        'id_unita_didattica': (str(_cell(sheet, row_idx, idx.get('id_unita_didattica', -1), '')).replace('.0', '').strip() or None),
+        'cod_unita_didattica': (str(_cell(sheet, row_idx, idx.get('cod_unita_didattica', -1), '')).strip() or None),
+        'des_unita_didattica': (str(_cell(sheet, row_idx, idx.get('des_unita_didattica', -1), '')).strip() or None),
+        'af_master_insegnamento': bool(_cell(sheet, row_idx, idx.get('af_master_insegnamento', -1), 1)),
+        'af_master_unita_didattica': bool(_cell(sheet, row_idx, idx.get('af_master_unita_didattica', -1), 1)),
+        'des_raggruppamento_insegnamento': str(_cell(sheet, row_idx, idx.get('des_raggruppamento_insegnamento', -1), '')).strip(),
+        'des_raggruppamento_unita_didattica': str(_cell(sheet, row_idx, idx.get('des_raggruppamento_unita_didattica', -1), '')).strip(),
+        'anno_corso': int(float(_cell(sheet, row_idx, idx['anno_corso'], 1))),
+        'cfu_insegnamento': int(float(_cell(sheet, row_idx, idx['cfu_insegnamento'], 6))),
+        'des_periodo_insegnamento': str(_cell(sheet, row_idx, idx['des_periodo_insegnamento'], 'Annuale')).strip(),
+        'des_periodo_unita_didattica': (str(_cell(sheet, row_idx, idx.get('des_periodo_unita_didattica', -1), '')).strip()
+                                         if idx.get('des_periodo_unita_didattica') is not None else None),
+        'matricola_titolare': str(_cell(sheet, row_idx, idx['matricola_titolare'], '')).strip(),
+        'matricola_docente': str(_cell(sheet, row_idx, idx['matricola_docente'], '')).strip(),
+        'cognome_docente': str(_cell(sheet, row_idx, idx['cognome_docente'], '???COGNOME???')).strip(),
+        'nome_docente': str(_cell(sheet, row_idx, idx['nome_docente'], '???NOME???')).strip(),
+        'username_docente': str(_cell(sheet, row_idx, idx['username_docente'], '')).strip() or None
+    }
+
+_RE_MUTUAZIONE = re.compile(
+    r'Mutua\s+da:\s+Af\s+([A-Z0-9]+)\s+Cds\s+([A-Z0-9]+)(?:\s+Reg\s+\d+)?\s+Pds\s+([A-Z0-9]+)', re.IGNORECASE
+)
+
+def estrai_info_master(raggruppamento_str):
+    if not raggruppamento_str:
+        return None
+    match = _RE_MUTUAZIONE.search(raggruppamento_str)
+    if match:
+        return {'codice': match.group(1), 'cds': match.group(2), 'curriculum': match.group(3)}
+    return None
+
+class IndiceRigheUgov:
+    """
+    Righe U-GOV importabili con indici hash per risolvere master e mutuazioni in tempo
+    costante. A parità di chiave vale la prima riga del file, come nella ricerca lineare.
+    """
+
+    def __init__(self):
+        self.righe = []
+        self.insegnamenti = {}  # (cod_insegnamento, cds, curriculum, anno) -> riga
+        self.moduli = {}        # (cod_unita_didattica, cds, curriculum, anno) -> riga
+        self.per_id = {}        # id_insegnamento -> riga
+
+    def aggiungi(self, riga):
+        self.righe.append(riga)
+        anno = riga['anno_accademico']
+        self.insegnamenti.setdefault((riga['cod_insegnamento'], riga['cod_cds'], riga['cod_curriculum'], anno), riga)
+        if riga['cod_unita_didattica']:
+            self.moduli.setdefault((riga['cod_unita_didattica'], riga['cod_cds'], riga['cod_curriculum'], anno), riga)
+        self.per_id.setdefault(riga['id_insegnamento'], riga)
+
+    def riga_insegnamento(self, id_insegnamento):
+        """Prima riga dell'insegnamento con l'id indicato (None se assente)."""
+        return self.per_id.get(id_insegnamento)
+
+    def riga_modulo(self, info_master, anno_accademico):
+        """Riga del modulo indicato da una mutuazione (None se il master non è un modulo)."""
+        if not info_master:
+            return None
+        return self.moduli.get((info_master['codice'], info_master['cds'], info_master['curriculum'], anno_accademico))
+
+    def trova_id_master(self, info_master, anno_accademico):
+        """
+        ID dell'insegnamento master: prima tra gli insegnamenti (colonna P), poi tra
+        i moduli (colonna BO), di cui si restituisce l'insegnamento padre.
+        """
+        if not info_master:
+            return None
+        chiave = (info_master['codice'], info_master['cds'], info_master['curriculum'], anno_accademico)
+        riga = self.insegnamenti.get(chiave) or self.moduli.get(chiave)
+        return riga['id_insegnamento'] if riga else None
+
+class AnalisiUgov:
+    """Righe di un file U-GOV già lette e indicizzate, con i motivi delle righe saltate."""
+
+    def __init__(self, hash_file, indice, righe_saltate_motivi):
+        self.hash = hash_file
+        self.indice = indice
+        self.righe_saltate_motivi = righe_saltate_motivi
+        self._dati_import = None
+        self._lock = threading.Lock()
+
+    @property
+    def righe_saltate(self):
+        return len(self.righe_saltate_motivi)
+
+    def dati_import(self):
+        """Dati da caricare nel database, calcolati una sola volta (da non modificare)."""
+        with self._lock:
+            if self._dati_import is None:
+                self._dati_import = prepara_dati_import(self.indice)
+            return self._dati_import
+
+def _leggi_file(contenuto, hash_file):
+    workbook = xlrd.open_workbook(file_contents=contenuto)
+    sheet = workbook.sheet_by_index(0)  # Foglio "Insegnamenti e coperture"
+
+    colonna_indices = _get_header_indices(sheet)
+
+    # Lettura delle righe e costruzione degli indici in un solo passaggio
+    indice = IndiceRigheUgov()
+    righe_saltate_motivi = []
+    for row_idx in range(1, sheet.nrows):
+        try:
+            should_import, motivo = _should_import_row(sheet, row_idx, colonna_indices)
+            if not should_import:
+                righe_saltate_motivi.append({
+                    "row": row_idx+1,
+                    "reason": motivo or "Non rispetta la logica di import (_should_import_row)"
+                })
+                continue
+            try:
+                indice.aggiungi(_parse_row(sheet, row_idx, colonna_indices))
+            except Exception as e:
+                righe_saltate_motivi.append({
+                    "row": row_idx+1,
+                    "reason": f"Errore parsing: {str(e)}"
+                })
+                continue
+        except Exception as e:
+            righe_saltate_motivi.append({
+                "row": row_idx+1,
+                "reason": f"Errore generico: {str(e)}"
+            })
+            continue
+
+    return AnalisiUgov(hash_file, indice, righe_saltate_motivi)
+
+def _rimuovi_scadute(adesso):
+    for hash_file in [h for h, (_, creata) in _analisi.items() if adesso - creata > TTL_ANALISI]:
+        del _analisi[hash_file]
+
+def analizza_file(contenuto):
+    """Analizza il contenuto di un file U-GOV, riusando l'analisi in cache se lo stesso file è già stato letto."""
+    hash_file = hashlib.sha256(contenuto).hexdigest()
+    analisi = analisi_da_hash(hash_file)
+    if analisi is not None:
+        return analisi
+
+    analisi = _leggi_file(contenuto, hash_file)
+    with _lock:
+        _analisi[hash_file] = (analisi, time.monotonic())
+        _analisi.move_to_end(hash_file)
+        while len(_analisi) > MAX_ANALISI_IN_CACHE:
+            _analisi.popitem(last=False)
+    return analisi
+
+def analisi_da_hash(hash_file):
+    """Analisi in cache per l'hash indicato (None se assente o scaduta)."""
+    with _lock:
+        _rimuovi_scadute(time.monotonic())
+        voce = _analisi.get(hash_file)
+        if voce is None:
+            return None
+        _analisi.move_to_end(hash_file)
+        return voce[0]
+
+def prepara_dati_import(indice):
+    """
+    Applica la logica dei 6 casi di master e mutuazioni alle righe indicizzate e
+    restituisce le righe da caricare per cds, insegnamenti, utenti, insegnamenti_cds
+    e insegnamento_docente.
+    """
+    # Dati per l'inserimento
+    insegnamenti_data = []
+    insegnamenti_cds_data = []
+    cds_data = []
+    utenti_data = []
+    insegnamento_docente_data = []
+    # Insiemi per deduplicazione
+    insegnamenti_set = set()
+    cds_set = set()
+    utenti_set = set()
+    insegnamento_docente_set = set()
+    insegnamenti_cds_set = set()
+
+    # Applica la logica dei 6 casi, con una sola passata sulle righe
+    for riga in indice.righe:
+        try:
+            # Determina se è un modulo o un insegnamento
+            is_modulo = riga['id_unita_didattica'] is not None
+            
+            # Variabili che vengono sempre settate allo stesso valore
+            cfu_effettivi = riga['cfu_insegnamento']  # Usa sempre la colonna AD
+            periodo_effettivo = riga['des_periodo_insegnamento']  # Usa sempre il periodo dell'insegnamento
+            
+            # Flag per determinare se il docente deve inserire esami per questo insegnamento
+            # Inizializzato a False, verrà settato a True nei casi appropriati
+            inserire_esami = False
+            
+            # L'ID che verrà salvato nel DB è SEMPRE id_insegnamento (padre)
+            # id_unita_didattica viene usato solo per i controlli
+            id_da_salvare = riga['id_insegnamento']
+            
+            # Logica per determinare master e descrizione effettivi
+            if is_modulo:
+                # CASI 3-4: Gestione moduli
+                if riga['af_master_unita_didattica']:
+                    # CASO 3: Modulo è master -> carica il padre
+                    des_effettiva = riga['des_insegnamento']
+                    master_id = None
+                    # CASO 3: Modulo master -> il docente deve inserire esami (no mutuazione)
+                    inserire_esami = True
+                else:
+                    # CASI 4: Modulo NON è master
+                    info_master = estrai_info_master(riga['des_raggruppamento_unita_didattica'])
+                    
+                    if info_master:
+                        # Trova l'ID del master usando codice + CdS + curriculum
+                        master_id_found = indice.trova_id_master(info_master, riga['anno_accademico'])
+                        
+                        if master_id_found:
+                            master_id = master_id_found  # Il master è l'insegnamento trovato
+                            # CASO 4: Modulo che mutua -> il docente NON deve inserire esami (mutuazione)
+                            inserire_esami = False
+                            
+                            # Trova i dettagli del master
+                            master_row = indice.riga_insegnamento(master_id_found)
+                            if master_row:
+                                des_effettiva = master_row['des_insegnamento']
+                                # Aggiungi anche l'insegnamento master alla lista
+                                if master_id_found not in insegnamenti_set:
+                                    insegnamenti_data.append((master_id_found, master_row['cod_insegnamento'], master_row['des_insegnamento']))
+                                    insegnamenti_set.add(master_id_found)
+                            else:
+                                continue
+                        else:
+                            continue
+                    else:
+                        continue
+            else:
+                # CASI 1-2: Gestione insegnamenti
+                if riga['af_master_insegnamento']:
+                    # CASO 1: Insegnamento è master -> caricalo sempre
+                    des_effettiva = riga['des_insegnamento']
+                    master_id = None
+                    # CASO 1: Insegnamento master -> il docente deve inserire esami (no mutuazione)
+                    inserire_esami = True
+                else:
+                    # CASO 2: Insegnamento NON è master
+                    info_master = estrai_info_master(riga['des_raggruppamento_insegnamento'])
+                    
+                    if info_master:
+                        # Trova l'ID del master usando codice + CdS + curriculum
+                        master_id_found = indice.trova_id_master(info_master, riga['anno_accademico'])
+                        
+                        if master_id_found:
+                            # SOTTOCASO 2: Inserisci sia figlio che master
+                            des_effettiva = riga['des_insegnamento']
+                            master_id = master_id_found  # Il master è l'insegnamento trovato
+                            
+                            # CASO 2: Verifica se mutua da un modulo
+                            # Se il master è un modulo (presente in cod_unita_didattica), allora è caso speciale
+                            master_e_modulo = indice.riga_modulo(info_master, riga['anno_accademico']) is not None
+                            
+                            if master_e_modulo:
+                                # CASO 2 SPECIALE: Insegnamento che mutua da un modulo
+                                # Verifica il semestre: se è secondo semestre, NON deve inserire esami
+                                semestre_corrente = map_semestre_from_periodo(periodo_effettivo)
+                                
+                                if semestre_corrente == 2:  # Secondo semestre
+                                    # CASO 2 SPECIALE - SECONDO SEMESTRE: Insegnamento che mutua da un modulo nel secondo semestre ->
+                                    # il docente NON deve inserire esami (evita duplicazione con primo semestre)
+                                    inserire_esami = False
+                                else:
+                                    # CASO 2 SPECIALE - PRIMO SEMESTRE/ANNUALE: Insegnamento che mutua da un modulo ->
+                                    # il docente DEVE inserire esami (sia figlio che padre del modulo vengono caricati)
+                                    inserire_esami = True
+                            else:
+                                # CASO 2 NORMALE: Insegnamento che mutua da un altro insegnamento ->
+                                # il docente NON deve inserire esami (mutuazione normale)
+                                inserire_esami = False
+                            
+                            # Assicurati che anche l'insegnamento master sia nella lista
+                            master_row = indice.riga_insegnamento(master_id_found)
+                            if master_row and master_id_found not in insegnamenti_set:
+                                insegnamenti_data.append((master_id_found, master_row['cod_insegnamento'], master_row['des_insegnamento']))
+                                insegnamenti_set.add(master_id_found)
+                        else:
+                            continue
+                    else:
+                        continue
+            
+            semestre = map_semestre_from_periodo(periodo_effettivo)
+            matricola_titolare = riga['matricola_titolare'] or riga['matricola_docente']
+            
+            # Se la matricola è stringa vuota, imposta a None per rispettare il vincolo FK
+            if matricola_titolare == '':
+                matricola_titolare = None
+            
+            # Aggiungi CdS se non già presente
+            cds_key = (riga['cod_cds'], riga['anno_accademico'], riga['cod_curriculum'])
+            if cds_key not in cds_set:
+                cds_data.append((riga['cod_cds'], riga['anno_accademico'], riga['des_cds'], 
+                               riga['cod_curriculum'], riga['des_curriculum']))
+                cds_set.add(cds_key)
+            
+            # Aggiungi insegnamento padre se non già presente
+            if id_da_salvare not in insegnamenti_set:
+                insegnamenti_data.append((id_da_salvare, riga['cod_insegnamento'], des_effettiva))
+                insegnamenti_set.add(id_da_salvare)
+            
+            # Aggiungi insegnamento_cds
+            insegnamenti_cds_key = (id_da_salvare, riga['anno_accademico'], riga['cod_cds'], riga['cod_curriculum'])
+            if insegnamenti_cds_key not in insegnamenti_cds_set:
+                insegnamenti_cds_data.append((
+                    id_da_salvare,
+                    riga['anno_accademico'], 
+                    riga['cod_cds'], 
+                    riga['cod_curriculum'],
+                    riga['anno_corso'], 
+                    semestre,
+                    cfu_effettivi,
+                    master_id,
+                    matricola_titolare,
+                    inserire_esami
+                ))
+                insegnamenti_cds_set.add(insegnamenti_cds_key)
+            
+            # Aggiungi utente se non già presente (solo se c'è un docente)
+            if riga['username_docente'] and riga['username_docente'] not in utenti_set:
+                utenti_data.append((riga['username_docente'], riga['matricola_docente'], 
+                                  riga['nome_docente'], riga['cognome_docente'], False))
+                utenti_set.add(riga['username_docente'])
+            
+            # Aggiungi insegnamento_docente (solo se c'è un docente)
+            if riga['username_docente']:
+                insegnamento_docente_key = (id_da_salvare, riga['username_docente'], riga['anno_accademico'])
+                if insegnamento_docente_key not in insegnamento_docente_set:
+                    insegnamento_docente_data.append((id_da_salvare, riga['username_docente'], riga['anno_accademico']))
+                    insegnamento_docente_set.add(insegnamento_docente_key)
+                
+        except Exception:
+            continue
+    
+    # Assicurati che tutti i master ID referenziati esistano nella lista insegnamenti
+    for posizione, item in enumerate(insegnamenti_cds_data):
+        master_id = item[7]  # Campo master è il 7° elemento
+        if master_id and master_id not in insegnamenti_set:
+            # Cerca il master nelle righe dati
+            master_row = indice.riga_insegnamento(master_id)
+            if master_row:
+                insegnamenti_data.append((master_id, master_row['cod_insegnamento'], master_row['des_insegnamento']))
+                insegnamenti_set.add(master_id)
+            else:
+                # Se non troviamo il master, imposta il campo master a NULL
+                item_list = list(item)
+                item_list[7] = None
+                insegnamenti_cds_data[posizione] = tuple(item_list)
+
+    return {
+        'cds': cds_data,
+        'insegnamenti': insegnamenti_data,
+        'utenti': utenti_data,
+        'insegnamenti_cds': insegnamenti_cds_data,
+        'insegnamento_docente': insegnamento_docente_data
+    }
+
+# Colonne delle righe da importare, nell'ordine usato da prepara_dati_import e dalle
+# query di confronto; 'chiave' sono le posizioni della chiave primaria.
+# Le righe eliminabili vengono confrontate solo nell'ambito coperto dal file: i (cds, anno)
+# per insegnamenti_cds, gli (insegnamento, anno) per insegnamento_docente. Un file parziale
+# o di un solo CdS non tocca così i dati degli altri CdS.
+_TABELLE_UGOV = {
+    'cds': {
+        'colonne': ('codice', 'anno_accademico', 'nome_corso', 'curriculum_codice', 'curriculum_nome'),
+        'chiave': (0, 1, 3),
+        'query': """
+            SELECT codice, anno_accademico, nome_corso, curriculum_codice, curriculum_nome
+            FROM cds WHERE anno_accademico = ANY(%(anni)s)
+        """
+    },
+    'insegnamenti': {
+        'colonne': ('id', 'codice', 'titolo'),
+        'chiave': (0,),
+        'query': "SELECT id, codice, titolo FROM insegnamenti WHERE id = ANY(%(insegnamenti)s)"
+    },
+    'utenti': {
+        # permessi_admin non viene mai aggiornato dall'import
+        'colonne': ('username', 'matricola', 'nome', 'cognome'),
+        'chiave': (0,),
+        'query': "SELECT username, matricola, nome, cognome FROM utenti WHERE username = ANY(%(utenti)s)"
+    },
+    'insegnamenti_cds': {
+        'colonne': ('insegnamento', 'anno_accademico', 'cds', 'curriculum_codice', 'anno_corso',
+                    'semestre', 'cfu', 'master', 'titolare', 'inserire_esami'),
+        'chiave': (0, 1, 2, 3),
+        'query': """
+            SELECT insegnamento, anno_accademico, cds, curriculum_codice, anno_corso,
+                   semestre, cfu, master, titolare, inserire_esami
+            FROM insegnamenti_cds WHERE (cds, anno_accademico) IN %(cds_anni)s
+        """,
+        'elimina': True
+    },
+    'insegnamento_docente': {
+        'colonne': ('insegnamento', 'docente', 'annoaccademico'),
+        'chiave': (0, 1, 2),
+        'query': """
+            SELECT insegnamento, docente, annoaccademico
+            FROM insegnamento_docente WHERE (insegnamento, annoaccademico) IN %(insegnamenti_anni)s
+        """,
+        'elimina': True
+    }
+}
+
+class DifferenzeUgov:
+    """
+    Differenze tra i dati di un file U-GOV e il contenuto del database per gli anni del file.
+    CdS, insegnamenti e utenti vengono solo inseriti o aggiornati. Vengono eliminate le righe
+    di insegnamenti_cds dei (cds, anno) del file e quelle di insegnamento_docente degli
+    (insegnamento, anno) del file che nel file non ci sono più.
+    """
+
+    def __init__(self, anni):
+        self.anni = sorted(anni)
+        self.inserire = {tabella: [] for tabella in _TABELLE_UGOV}
+        self.aggiornare = {tabella: [] for tabella in _TABELLE_UGOV}  # coppie (riga attuale, riga nuova)
+        self.eliminare = {tabella: [] for tabella in _TABELLE_UGOV}
+        # (insegnamento, anno) con semestre o docenti cambiati: le loro sovrapposizioni vanno ricalcolate
+        self.insegnamenti_modificati = set()
+
+    def vuote(self):
+        return not any(self.inserire.values()) and not any(self.aggiornare.values()) \
+            and not any(self.eliminare.values())
+
+    def righe_da_caricare(self, tabella):
+        """Righe nuove o modificate della tabella, nel formato di prepara_dati_import."""
+        return self.inserire[tabella] + [nuova for _, nuova in self.aggiornare[tabella]]
+
+    def eliminazioni(self):
+        """Righe da eliminare, come testo, per chiedere conferma prima dell'import."""
+        return [
+            f"{tabella}: " + " / ".join(str(riga[i]) for i in _TABELLE_UGOV[tabella]['chiave'])
+            for tabella in _TABELLE_UGOV for riga in self.eliminare[tabella]
+        ]
+
+    def conteggi(self):
+        return {
+            tabella: {
+                'inserire': len(self.inserire[tabella]),
+                'aggiornare': len(self.aggiornare[tabella]),
+                'eliminare': len(self.eliminare[tabella])
+            }
+            for tabella in _TABELLE_UGOV
+        }
+
+    def report(self):
+        """Righe di testo con le differenze, per l'anteprima."""
+        lines = []
+        for tabella, spec in _TABELLE_UGOV.items():
+            chiave = lambda riga: " / ".join(str(riga[i]) for i in spec['chiave'])
+            lines.append(f"► {tabella}: {len(self.inserire[tabella])} da inserire, "
+                         f"{len(self.aggiornare[tabella])} da aggiornare, {len(self.eliminare[tabella])} da eliminare")
+            for riga in self.inserire[tabella]:
+                lines.append(f"  + {chiave(riga)}")
+            for attuale, nuova in self.aggiornare[tabella]:
+                cambiati = ", ".join(
+                    f"{colonna}: {attuale[i]} → {nuova[i]}"
+                    for i, colonna in enumerate(spec['colonne']) if attuale[i] != nuova[i]
+                )
+                lines.append(f"  ~ {chiave(nuova)} ({cambiati})")
+            for riga in self.eliminare[tabella]:
+                lines.append(f"  - {chiave(riga)}")
+            lines.append("")
+        return lines
+
+def calcola_differenze(cursor, dati):
+    """Confronta i dati da importare (prepara_dati_import) con il database, con una query per tabella."""
+    differenze = DifferenzeUgov({riga[1] for riga in dati['cds']} | {riga[1] for riga in dati['insegnamenti_cds']})
+    # (cds, anno) e (insegnamento, anno) presenti nel file; la coppia fittizia evita una IN vuota
+    cds_anni = {(riga[0], riga[1]) for riga in dati['cds']} | \
+        {(riga[2], riga[1]) for riga in dati['insegnamenti_cds']}
+    insegnamenti_anni = {(riga[0], riga[1]) for riga in dati['insegnamenti_cds']} | \
+        {(riga[0], riga[2]) for riga in dati['insegnamento_docente']}
+    parametri = {
+        'anni': differenze.anni,
+        'insegnamenti': [riga[0] for riga in dati['insegnamenti']],
+        'utenti': [riga[0] for riga in dati['utenti']],
+        'cds_anni': tuple(sorted(cds_anni, key=str)) or ((None, None),),
+        'insegnamenti_anni': tuple(sorted(insegnamenti_anni, key=str)) or ((None, None),)
+    }
+
+    for tabella, spec in _TABELLE_UGOV.items():
+        numero_colonne = len(spec['colonne'])
+        chiave = lambda riga: tuple(riga[i] for i in spec['chiave'])
+
+        cursor.execute(spec['query'], parametri)
+        attuali = {chiave(riga): tuple(riga) for riga in cursor.fetchall()}
+
+        nel_file = set()
+        for riga in dati[tabella]:
+            k = chiave(riga)
+            nel_file.add(k)
+            attuale = attuali.get(k)
+            if attuale is None:
+                differenze.inserire[tabella].append(riga)
+            elif attuale != tuple(riga[:numero_colonne]):
+                differenze.aggiornare[tabella].append((attuale, riga))
+
+        if spec.get('elimina'):
+            differenze.eliminare[tabella] = [riga for k, riga in attuali.items() if k not in nel_file]
+
+    # Insegnamenti con semestre o docenti cambiati (l'anno è in seconda posizione in
+    # insegnamenti_cds, in terza in insegnamento_docente)
+    for riga in differenze.inserire['insegnamenti_cds'] + differenze.eliminare['insegnamenti_cds']:
+        differenze.insegnamenti_modificati.add((riga[0], riga[1]))
+    for attuale, nuova in differenze.aggiornare['insegnamenti_cds']:
+        if attuale[5] != nuova[5]:
+            differenze.insegnamenti_modificati.add((nuova[0], nuova[1]))
+    for riga in differenze.inserire['insegnamento_docente'] + differenze.eliminare['insegnamento_docente']:
+        differenze.insegnamenti_modificati.add((riga[0], riga[2]))
+
+    return differenze
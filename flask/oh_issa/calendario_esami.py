@@ -1,12 +1,19 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, session
 from db import get_db_connection, release_connection
+from utils.jobs import avvia_job, FileJob
 from psycopg2.extras import DictCursor
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
 from openpyxl.utils import get_column_letter
-from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import logging
+import os
+import tempfile
+import zipfile
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from openpyxl.cell.rich_text import CellRichText, TextBlock
 from openpyxl.cell.text import InlineFont
 
@@ -292,9 +299,199 @@ def get_calendario_esami():
     if 'conn' in locals() and conn:
       release_connection(conn)
 
+# Export XLSX del calendario: il workbook è in modalità write-only, quindi le righe
+# vengono scritte su disco man mano invece di restare in memoria, e le celle usano
+# stili con nome registrati una volta per workbook invece di oggetti Font/Border/Fill
+# per cella. Il file viene poi restituito a blocchi da un file temporaneo.
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+ORDINE_SESSIONI = ['anticipata', 'estiva', 'autunnale', 'invernale']
+NOMI_SESSIONI = {
+    'anticipata': 'Sessione Anticipata',
+    'estiva': 'Sessione Estiva',
+    'autunnale': 'Sessione Autunnale',
+    'invernale': 'Sessione Invernale'
+}
+NOMI_SEMESTRI = {1: "Primo semestre", 2: "Secondo semestre", 3: "Annuale"}
+ORDINE_SEMESTRI = {3: 0, 1: 1, 2: 2}
+ALTEZZA_INTESTAZIONE = 45
+ALTEZZA_RIGA = 60
+DIMENSIONE_BLOCCO_STREAM = 64 * 1024
+
+# Font del testo ricco (titolo + semestre), condivisi da tutte le celle
+FONT_TITOLO = InlineFont(sz=12, color="000000", rFont="Arial")
+FONT_SEMESTRE = InlineFont(sz=10, color="808080", rFont="Arial")
+
+def _registra_stili_calendario(workbook):
+    """Registra nel workbook gli stili con nome usati dalle celle del calendario."""
+    bordo = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    sfondo_bianco = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+    stili = [
+        NamedStyle(name='cal_anno',
+                   font=Font(bold=True, size=16, color="FFFFFF", name="Arial"),
+                   fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
+                   alignment=Alignment(horizontal='center', vertical='center'),
+                   border=bordo),
+        NamedStyle(name='cal_intestazione',
+                   font=Font(bold=True, size=14, name="Arial"),
+                   fill=PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid"),
+                   alignment=Alignment(horizontal='center', vertical='center'),
+                   border=bordo),
+        NamedStyle(name='cal_insegnamento',
+                   font=Font(size=12, name="Arial"),
+                   fill=sfondo_bianco,
+                   alignment=Alignment(horizontal='left', vertical='center', wrap_text=True),
+                   border=bordo),
+        NamedStyle(name='cal_date',
+                   font=Font(size=12, name="Arial"),
+                   fill=sfondo_bianco,
+                   alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+                   border=bordo),
+        # Date degli insegnamenti annuali nella sessione anticipata
+        NamedStyle(name='cal_date_anticipata',
+                   font=Font(size=12, color="00BFFF", name="Arial"),
+                   fill=sfondo_bianco,
+                   alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+                   border=bordo),
+    ]
+    for stile in stili:
+        workbook.add_named_style(stile)
+
+def _cella(sheet, valore, stile):
+    cella = WriteOnlyCell(sheet, value=valore)
+    cella.style = stile
+    return cella
+
+def _sessioni_calendario(sessioni_dict):
+    """Sessioni del calendario con nome e date, None per quelle non definite."""
+    sessioni_calendario = {
+        tipo: {'nome': nome, 'inizio': None, 'fine': None} for tipo, nome in NOMI_SESSIONI.items()
+    }
+    for tipo_sessione, data_sessione in sessioni_dict.items():
+        if tipo_sessione in sessioni_calendario:
+            sessioni_calendario[tipo_sessione].update(data_sessione)
+    return sessioni_calendario
+
+def _raggruppa_insegnamenti(insegnamenti_base, esami_per_insegnamento):
+    """
+    Insegnamenti raggruppati per anno di corso (1 se non indicato), ordinati
+    per semestre (annuali, primo, secondo) e poi per titolo.
+    """
+    insegnamenti = [{
+        'titolo': row['titolo'],
+        'anno_corso': row['anno_corso'],
+        'semestre': row['semestre'],
+        'esami': esami_per_insegnamento.get(row['id'], [])
+    } for row in insegnamenti_base]
+    insegnamenti.sort(key=lambda x: (ORDINE_SEMESTRI.get(x['semestre'], 999), x['titolo']))
+
+    insegnamenti_per_anno = {}
+    for ins in insegnamenti:
+        insegnamenti_per_anno.setdefault(ins['anno_corso'] or 1, []).append(ins)
+    return insegnamenti_per_anno
+
+def _testo_date(insegnamento, tipo_sessione, sessione):
+    """Contenuto e stile della cella di un insegnamento in una sessione."""
+    esami_sessione = [
+        esame for esame in insegnamento['esami']
+        if sessione['inizio'] <= esame['data_appello'] <= sessione['fine']
+    ]
+    if not esami_sessione:
+        return "--", 'cal_date'
+
+    # Tutti gli esami annuali dell'anticipata in blu, nelle altre sessioni solo gli ufficiali
+    if insegnamento['semestre'] == 3 and tipo_sessione == 'anticipata':
+        date_esami = sorted({e['data_appello'] for e in esami_sessione})
+        return '\n'.join(d.strftime('%d/%m/%Y') for d in date_esami), 'cal_date_anticipata'
+
+    date_esami = sorted(e['data_appello'] for e in esami_sessione if e['mostra_nel_calendario'])
+    return '\n'.join(d.strftime('%d/%m/%Y') for d in date_esami), 'cal_date'
+
+def _scrivi_foglio_calendario(workbook, titolo, insegnamenti_per_anno, sessioni_calendario, sessioni_attive):
+    """
+    Aggiunge al workbook (write-only, con gli stili già registrati) il foglio del
+    calendario di un CdS: per ogni anno di corso un'intestazione e una riga per insegnamento,
+    con una colonna per ciascuna delle sessioni attive.
+    """
+    sheet = workbook.create_sheet(title=titolo)
+
+    # In modalità write-only colonne e altezze vanno impostate prima di scrivere le righe
+    sheet.column_dimensions['A'].width = 60
+    for col_num in range(2, len(sessioni_attive) + 2):
+        sheet.column_dimensions[get_column_letter(col_num)].width = 40
+
+    riga = 0
+    def aggiungi(celle, altezza):
+        nonlocal riga
+        riga += 1
+        sheet.row_dimensions[riga].height = altezza
+        sheet.append(celle)
+
+    end_col = min(1 + len(sessioni_attive), 26)
+    for anno_corso in sorted(insegnamenti_per_anno):
+        aggiungi([_cella(sheet, f"{anno_corso}° Anno", 'cal_anno')], ALTEZZA_INTESTAZIONE)
+        sheet.merged_cells.add(f'A{riga}:{get_column_letter(end_col)}{riga}')
+
+        aggiungi([_cella(sheet, 'INSEGNAMENTO', 'cal_intestazione')] +
+                 [_cella(sheet, sessioni_calendario[tipo]['nome'].upper(), 'cal_intestazione')
+                  for tipo in sessioni_attive],
+                 ALTEZZA_INTESTAZIONE)
+
+        for insegnamento in insegnamenti_per_anno[anno_corso]:
+            semestre_str = NOMI_SEMESTRI.get(insegnamento['semestre'], "")
+            if semestre_str:
+                # Titolo e semestre in stili diversi nella stessa cella
+                nome = CellRichText(
+                    TextBlock(FONT_TITOLO, insegnamento['titolo']),
+                    TextBlock(FONT_SEMESTRE, f"\n{semestre_str}")
+                )
+            else:
+                nome = insegnamento['titolo']
+
+            celle = [_cella(sheet, nome, 'cal_insegnamento')]
+            for tipo in sessioni_attive:
+                valore, stile = _testo_date(insegnamento, tipo, sessioni_calendario[tipo])
+                celle.append(_cella(sheet, valore, stile))
+            aggiungi(celle, ALTEZZA_RIGA)
+
+        # Riga vuota di separazione tra gli anni
+        aggiungi([], ALTEZZA_RIGA)
+
+    return sheet
+
+def _risposta_file_temporaneo(file, nome_file, mimetype):
+    """
+    Restituisce il contenuto di un file temporaneo a blocchi, chiudendolo
+    (e quindi eliminandolo) alla fine dell'invio.
+    """
+    dimensione = file.seek(0, os.SEEK_END)
+    file.seek(0)
+
+    def genera():
+        try:
+            while True:
+                blocco = file.read(DIMENSIONE_BLOCCO_STREAM)
+                if not blocco:
+                    break
+                yield blocco
+        finally:
+            file.close()
+
+    return Response(
+        genera(),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{nome_file}"',
+            'Content-Length': str(dimensione)
+        }
+    )
+
 # API per esportare il calendario esami in formato XLSX
 @calendario_esami_bp.route('/esporta-calendario-esami')
 def esporta_calendario_esami():
+    file = None
     try:
         cds_code = request.args.get('cds')
         anno_accademico_str = request.args.get('anno')
@@ -344,227 +541,218 @@ def esporta_calendario_esami():
             ORDER BY inizio
         """, (cds_code, anno_accademico, curriculum))
         
-        sessioni = cursor.fetchall()
-        
-        sessioni_dict = {s['tipo_sessione']: {'inizio': s['inizio'], 'fine': s['fine']} for s in sessioni}
-        
-        sessioni_calendario = {
-            'anticipata': {'nome': 'Sessione Anticipata', 'inizio': None, 'fine': None},
-            'estiva': {'nome': 'Sessione Estiva', 'inizio': None, 'fine': None},
-            'autunnale': {'nome': 'Sessione Autunnale', 'inizio': None, 'fine': None},
-            'invernale': {'nome': 'Sessione Invernale', 'inizio': None, 'fine': None}
-        }
-        
-        for tipo_sessione, data_sessione in sessioni_dict.items():
-            if tipo_sessione in sessioni_calendario:
-                sessioni_calendario[tipo_sessione].update(data_sessione)
+        sessioni_dict = {s['tipo_sessione']: {'inizio': s['inizio'], 'fine': s['fine']} for s in cursor.fetchall()}
+        sessioni_calendario = _sessioni_calendario(sessioni_dict)
         
         # Usa la funzione helper per ottenere gli esami
         esami_per_insegnamento = _get_esami_per_insegnamento(
             cursor, cds_code, anno_accademico, curriculum, insegnamenti_base, sessioni_calendario
         )
+        insegnamenti_per_anno = _raggruppa_insegnamenti(insegnamenti_base, esami_per_insegnamento)
+        sessioni_attive = [tipo for tipo in ORDINE_SESSIONI
+                           if tipo in sessioni_dict and sessioni_calendario[tipo]['inizio']]
         
-        # Costruisci lista insegnamenti finale
-        insegnamenti = []
-        for row in insegnamenti_base:
-            insegnamenti.append({
-                'id': row['id'],
-                'codice': row['codice'],
-                'titolo': row['titolo'],
-                'anno_corso': row['anno_corso'],
-                'semestre': row['semestre'],
-                'curriculum_codice': row['curriculum_codice'],
-                'esami': esami_per_insegnamento.get(row['id'], [])
-            })
-        
-        # Ordina insegnamenti per semestre (3, 1, 2) e poi alfabeticamente
-        semestre_order = {3: 0, 1: 1, 2: 2}
-        insegnamenti.sort(key=lambda x: (semestre_order.get(x['semestre'], 999), x['titolo']))
-        
-        # Raggruppa gli insegnamenti per anno di corso
-        insegnamenti_per_anno = {}
-        for ins in insegnamenti:
-            anno = ins['anno_corso'] or 1
-            insegnamenti_per_anno.setdefault(anno, []).append(ins)
-        
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.title = f"Calendario {cds_code} {anno_accademico}"
-        
-        header_font = Font(bold=True, size=14, name="Arial")
-        year_header_font = Font(bold=True, size=16, color="FFFFFF", name="Arial")
-        insegnamento_font = Font(bold=False, size=12, name="Arial")
-        blue_font = Font(bold=False, size=12, color="00BFFF", name="Arial")
-        center_alignment = Alignment(horizontal='center', vertical='center')
-        left_alignment = Alignment(horizontal='left', vertical='center')
-        center_wrap_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        left_wrap_alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-        
-        thin_border = Border(
-            left=Side(style='thin'), right=Side(style='thin'),
-            top=Side(style='thin'), bottom=Side(style='thin')
-        )
-        year_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-        # Sfondo bianco per insegnamenti e date
-        white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-        
-        current_row = 1
-        ordine_sessioni = ['anticipata', 'estiva', 'autunnale', 'invernale']
+        workbook = Workbook(write_only=True)
+        _registra_stili_calendario(workbook)
+        _scrivi_foglio_calendario(workbook, f"Calendario {cds_code} {anno_accademico}",
+                                  insegnamenti_per_anno, sessioni_calendario, sessioni_attive)
         
-        for anno_corso in sorted(insegnamenti_per_anno.keys()):
-            if not insegnamenti_per_anno[anno_corso]:
-                continue
-            
-            num_colonne_sessioni = sum(1 for tipo in ordine_sessioni 
-                                     if tipo in sessioni_dict and sessioni_calendario[tipo]['inizio'])
-            total_columns = 1 + num_colonne_sessioni
-            
-            year_cell = sheet.cell(row=current_row, column=1, value=f"{anno_corso}° Anno")
-            year_cell.font = year_header_font
-            year_cell.alignment = center_alignment
-            year_cell.fill = year_fill
-            year_cell.border = thin_border
-            
-            end_col = min(total_columns, 26)
-            sheet.merge_cells(f'A{current_row}:{get_column_letter(end_col)}{current_row}')
-            current_row += 1
-            
-            insegnamento_cell = sheet.cell(row=current_row, column=1, value='INSEGNAMENTO')
-            insegnamento_cell.font = header_font
-            insegnamento_cell.alignment = center_alignment
-            insegnamento_cell.fill = header_fill
-            insegnamento_cell.border = thin_border
-            
-            current_col = 2
-            for tipo_sessione in ordine_sessioni:
-                if tipo_sessione in sessioni_dict and sessioni_calendario[tipo_sessione]['inizio']:
-                    session_cell = sheet.cell(row=current_row, column=current_col, 
-                                            value=sessioni_calendario[tipo_sessione]['nome'].upper())
-                    session_cell.font = header_font
-                    session_cell.alignment = center_alignment
-                    session_cell.fill = header_fill
-                    session_cell.border = thin_border
-                    current_col += 1
-            
-            current_row += 1
-            
-            col_positions = [1]
-            data_col = 2
-            for tipo_sessione in ordine_sessioni:
-                if tipo_sessione in sessioni_dict and sessioni_calendario[tipo_sessione]['inizio']:
-                    col_positions.append(data_col)
-                    data_col += 1
-            
-            for insegnamento in insegnamenti_per_anno[anno_corso]:
-                semestre = insegnamento.get('semestre')
-                if semestre == 1:
-                    semestre_str = "Primo semestre"
-                elif semestre == 2:
-                    semestre_str = "Secondo semestre"
-                elif semestre == 3:
-                    semestre_str = "Annuale"
-                else:
-                    semestre_str = ""
-                
-                name_cell = sheet.cell(row=current_row, column=1)
-                
-                if semestre_str:
-                    # Crea RichText con titolo e semestre in stili diversi
-                    rt = CellRichText(
-                        TextBlock(InlineFont(sz=12, color="000000", rFont="Arial"), insegnamento['titolo']),
-                        TextBlock(InlineFont(sz=10, color="808080", rFont="Arial"), f"\n{semestre_str}")
-                    )
-                    name_cell.value = rt
-                else:
-                    name_cell.value = insegnamento['titolo']
-                
-                name_cell.alignment = left_wrap_alignment
-                name_cell.border = thin_border
-                name_cell.fill = white_fill
-                col_index = 0
-                for tipo_sessione in ordine_sessioni:
-                    if tipo_sessione in sessioni_dict and sessioni_calendario[tipo_sessione]['inizio']:
-                        col_index += 1
-                        # Filtra esami per sessione corrente
-                        esami_sessione = [
-                            esame for esame in insegnamento['esami']
-                            if sessioni_calendario[tipo_sessione]['inizio'] <= esame['data_appello'] <= sessioni_calendario[tipo_sessione]['fine']
-                        ]
-                        
-                        cell_value = ""
-                        cell_font = insegnamento_font
-                        
-                        if esami_sessione:
-                            # Separa esami ufficiali e non ufficiali
-                            esami_ufficiali = [e for e in esami_sessione if e['mostra_nel_calendario']]
-                            esami_non_ufficiali = [e for e in esami_sessione if not e['mostra_nel_calendario']]
-                            
-                            # Tutti gli esami annuali dell'anticipata in blu
-                            if semestre == 3 and tipo_sessione == 'anticipata':
-                                tutte_date = sorted(set([e['data_appello'] for e in esami_sessione]))
-                                date_list = [d.strftime('%d/%m/%Y') for d in tutte_date]
-                                cell_value = '\n'.join(date_list)
-                                cell_font = blue_font
-                            else:
-                                # Per altre sessioni mostra solo esami ufficiali
-                                if esami_ufficiali:
-                                    esami_ufficiali.sort(key=lambda x: x['data_appello'])
-                                    date_list = [esame['data_appello'].strftime('%d/%m/%Y') for esame in esami_ufficiali]
-                                    cell_value = '\n'.join(date_list)
-                        else:
-                            cell_value = "--"
-                        
-                        if col_index < len(col_positions):
-                            date_cell = sheet.cell(row=current_row, column=col_positions[col_index], value=cell_value)
-                            date_cell.alignment = center_wrap_alignment
-                            date_cell.border = thin_border
-                            date_cell.fill = white_fill
-                            date_cell.font = cell_font
-                
-                current_row += 1
-            
-            current_row += 1
-        
-        sheet.column_dimensions['A'].width = 60
-        for col_num in range(2, data_col):
-            sheet.column_dimensions[get_column_letter(col_num)].width = 40
+        file = tempfile.TemporaryFile(suffix='.xlsx')
+        workbook.save(file)
         
-        # Imposta altezza righe: header 45, insegnamenti 60
-        for row_num in range(1, current_row):
-            row_obj = sheet.row_dimensions[row_num]
-            # Verifica se è un header (anno o intestazione colonne)
-            cell_value = sheet.cell(row=row_num, column=1).value
-            if cell_value and (str(cell_value).endswith('° Anno') or cell_value == 'INSEGNAMENTO'):
-                row_obj.height = 45
-            else:
-                row_obj.height = 60
-        
-        output = BytesIO()
-        workbook.save(output)
-        output.seek(0)
-        
-        file_size = len(output.getvalue())
-        if file_size == 0:
-            return jsonify({'error': 'Errore nella generazione del file Excel'}), 500
-        
-        filename = f"calendario_esami_{cds_code}_{anno_accademico_str}_{curriculum.replace(' ', '_').replace('/', '_')}.xlsx"
-        
-        return Response(
-            output.getvalue(),
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={
-                'Content-Disposition': f'attachment; filename="{filename}"',
-                'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                'Content-Length': str(file_size)
-            }
-        )
+        risposta = _risposta_file_temporaneo(file, _nome_file_calendario(cds_code, anno_accademico_str, curriculum),
+                                             MIMETYPE_XLSX)
+        file = None  # ora lo chiude la risposta
+        return risposta
         
     except Exception as e:
         logging.error(f"Errore durante l'esportazione XLSX: {str(e)}", exc_info=True)
         return jsonify({"error": f"Errore interno del server: {str(e)}"}), 500
     finally:
+        if file:
+            file.close()
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            release_connection(conn)
\ No newline at end of file
+            release_connection(conn)
+
+# Export del calendario di tutti i CdS di un anno: i dati vengono letti con poche query
+# per l'intero anno e i file dei singoli (cds, curriculum) vengono generati in parallelo
+# da un pool di processi, poi raccolti in un unico zip. I processi sono avviati con
+# 'spawn' per non ereditare connessioni e lock del worker web.
+MAX_PROCESSI_CALENDARI = int(os.environ.get('CALENDARI_MAX_PROCESSI', min(4, os.cpu_count() or 1)))
+
+def _nome_file_calendario(cds_code, anno_accademico, curriculum):
+    return f"calendario_esami_{cds_code}_{anno_accademico}_{curriculum.replace(' ', '_').replace('/', '_')}.xlsx"
+
+def _genera_xlsx_calendario(titolo, insegnamenti_per_anno, sessioni_calendario, sessioni_attive):
+    """Contenuto del file XLSX del calendario di un CdS. Eseguita nei processi del pool."""
+    workbook = Workbook(write_only=True)
+    _registra_stili_calendario(workbook)
+    _scrivi_foglio_calendario(workbook, titolo, insegnamenti_per_anno, sessioni_calendario, sessioni_attive)
+    with tempfile.TemporaryFile(suffix='.xlsx') as file:
+        workbook.save(file)
+        file.seek(0)
+        return file.read()
+
+def _esami_per_insegnamento_da_prefetch(esami_per_id, cds_code, anno_accademico, curriculum,
+                                       insegnamenti_base, sessioni_calendario):
+    """
+    Stesso risultato di _get_esami_per_insegnamento, calcolato dagli esami dell'anno
+    già letti e indicizzati per insegnamento invece che con query per CdS e insegnamento.
+    """
+    inizio_anno = date(anno_accademico, 1, 1)
+    curricula = (curriculum, 'GEN')
+    esami_per_insegnamento = {}
+
+    for ins in insegnamenti_base:
+        if ins['inserire_esami'] or ins['master'] is None:
+            # Esami diretti (uno per ogni riga di insegnamenti_cds, come nel join)
+            esami = [e for e in esami_per_id.get(ins['id'], [])
+                     if e['cds'] == cds_code and e['curriculum_codice'] in curricula
+                     and e['data_appello'] >= inizio_anno and e['mostra_nel_calendario']]
+        elif ins['inserire_esami'] is False:
+            # Esami dal master, di qualunque CdS
+            esami = [e for e in esami_per_id.get(ins['master'], []) if e['mostra_nel_calendario']]
+        else:
+            continue
+        for e in esami:
+            esami_per_insegnamento.setdefault(ins['id'], []).append({
+                'data_appello': e['data_appello'],
+                'mostra_nel_calendario': e['mostra_nel_calendario']
+            })
+
+    # Esami non ufficiali SOLO per insegnamenti annuali nella sessione anticipata
+    anticipata = sessioni_calendario['anticipata']
+    if anticipata['inizio']:
+        for ins in insegnamenti_base:
+            if ins['semestre'] != 3:
+                continue
+            date_esistenti = {e['data_appello'] for e in esami_per_insegnamento.get(ins['id'], [])}
+            date_non_ufficiali = [
+                e['data_appello'] for e in esami_per_id.get(ins['id'], [])
+                if e['cds'] == cds_code and e['curriculum_codice'] in (ins['curriculum_codice'], 'GEN')
+                and e['data_appello'] >= inizio_anno
+                and anticipata['inizio'] <= e['data_appello'] <= anticipata['fine']
+                and e['data_appello'] not in date_esistenti
+            ]
+            esami_ins = esami_per_insegnamento.setdefault(ins['id'], [])
+            for data in filtra_date_14_giorni(date_non_ufficiali):
+                esami_ins.append({'data_appello': data, 'mostra_nel_calendario': False})
+
+    return esami_per_insegnamento
+
+def _prefetch_calendari(cursor, anno_accademico):
+    """
+    Dati di tutti i calendari dell'anno, con una query per tabella. Restituisce la lista
+    dei file da generare: (nome file, titolo del foglio, insegnamenti per anno di corso,
+    sessioni del calendario, sessioni attive).
+    """
+    cursor.execute("""
+        SELECT codice, curriculum_codice
+        FROM cds
+        WHERE anno_accademico = %s
+        ORDER BY codice, curriculum_codice
+    """, (anno_accademico,))
+    corsi = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT ic.cds, i.id, i.codice, i.titolo, ic.anno_corso, ic.semestre,
+               ic.curriculum_codice, ic.inserire_esami, ic.master
+        FROM insegnamenti i
+        JOIN insegnamenti_cds ic ON i.id = ic.insegnamento
+        WHERE ic.anno_accademico = %s
+        ORDER BY ic.anno_corso, i.titolo
+    """, (anno_accademico,))
+    insegnamenti_per_cds = {}
+    for row in cursor.fetchall():
+        insegnamenti_per_cds.setdefault(row['cds'], []).append(dict(row))
+
+    cursor.execute("""
+        SELECT cds, curriculum_codice, tipo_sessione, inizio, fine
+        FROM sessioni
+        WHERE anno_accademico = %s
+        ORDER BY inizio
+    """, (anno_accademico,))
+    sessioni_per_cds = {}
+    for row in cursor.fetchall():
+        sessioni_per_cds.setdefault(row['cds'], []).append(dict(row))
+
+    cursor.execute("""
+        SELECT insegnamento, cds, curriculum_codice, data_appello, mostra_nel_calendario
+        FROM esami
+        WHERE anno_accademico = %s
+        ORDER BY data_appello
+    """, (anno_accademico,))
+    esami_per_id = {}
+    for row in cursor.fetchall():
+        esami_per_id.setdefault(row['insegnamento'], []).append(dict(row))
+
+    calendari = []
+    for corso in corsi:
+        cds_code, curriculum = corso['codice'], corso['curriculum_codice']
+        curricula = (curriculum, 'GEN')
+        insegnamenti_base = [ins for ins in insegnamenti_per_cds.get(cds_code, [])
+                             if ins['curriculum_codice'] in curricula]
+        if not insegnamenti_base:
+            continue
+
+        sessioni_dict = {s['tipo_sessione']: {'inizio': s['inizio'], 'fine': s['fine']}
+                         for s in sessioni_per_cds.get(cds_code, []) if s['curriculum_codice'] in curricula}
+        sessioni_calendario = _sessioni_calendario(sessioni_dict)
+        esami_per_insegnamento = _esami_per_insegnamento_da_prefetch(
+            esami_per_id, cds_code, anno_accademico, curriculum, insegnamenti_base, sessioni_calendario
+        )
+        sessioni_attive = [tipo for tipo in ORDINE_SESSIONI
+                           if tipo in sessioni_dict and sessioni_calendario[tipo]['inizio']]
+        calendari.append((
+            _nome_file_calendario(cds_code, anno_accademico, curriculum),
+            f"Calendario {cds_code} {anno_accademico}",
+            _raggruppa_insegnamenti(insegnamenti_base, esami_per_insegnamento),
+            sessioni_calendario,
+            sessioni_attive
+        ))
+    return calendari
+
+def _genera_calendari_dipartimento(job, anno_accademico):
+    """Genera lo zip con i calendari di tutti i (cds, curriculum) dell'anno."""
+    job.avanzamento(0, 'Lettura dei dati')
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=DictCursor)
+    try:
+        calendari = _prefetch_calendari(cursor, anno_accademico)
+    finally:
+        cursor.close()
+        release_connection(conn)
+
+    if not calendari:
+        raise ValueError(f"Nessun corso di studi con insegnamenti per l'anno {anno_accademico}")
+
+    output = BytesIO()
+    # I file xlsx sono già compressi: nello zip vengono solo archiviati
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archivio, \
+         ProcessPoolExecutor(max_workers=min(MAX_PROCESSI_CALENDARI, len(calendari)),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(_genera_xlsx_calendario, *calendario[1:]): calendario[0]
+                   for calendario in calendari}
+        for completati, future in enumerate(as_completed(futures), start=1):
+            archivio.writestr(futures[future], future.result())
+            job.avanzamento(completati * 100 / len(calendari),
+                            f"Generati {completati} calendari su {len(calendari)}")
+
+    return FileJob(output.getvalue(), f"calendari_esami_{anno_accademico}.zip", 'application/zip')
+
+# API per esportare in un unico zip i calendari di tutti i CdS di un anno
+@calendario_esami_bp.route('/esporta-calendari-esami')
+def esporta_calendari_esami():
+    """Avvia in background la generazione dei calendari di tutti i CdS, scaricabile a job concluso."""
+    if not session.get('permessi_admin'):
+        return jsonify({'status': 'error', 'message': 'Accesso non autorizzato'}), 401
+
+    try:
+        anno_accademico = int(request.args.get('anno', ''))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Anno accademico non valido'}), 400
+
+    job_id = avvia_job('export_calendari', session.get('username'), _genera_calendari_dipartimento, anno_accademico)
+    return jsonify({'status': 'accepted', 'job_id': job_id}), 202
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify, session
 from db import get_db_connection, release_connection
 from psycopg2.extras import DictCursor
 import logging
+from utils.riepilogo import TIPO_TOTALE
 
 controllo_esami_minimi_bp = Blueprint('controllo_esami_minimi', __name__, url_prefix='/api/oh-issa')
 
@@ -110,7 +111,8 @@ def controlla_esami_minimi():
                 rules_map[key] = {}
             rules_map[key][r['tipo_sessione']] = { 1: r['min_1'], 2: r['min_2'] }
         
-        # Query base per ottenere tutti gli insegnamenti dell'anno con conteggio esami per sessione
+        # Query base per ottenere tutti gli insegnamenti dell'anno con il numero di esami
+        # per sessione, letto dal riepilogo mantenuto dalle scritture sugli esami
         base_query = """
             SELECT 
                 i.id as insegnamento_id,
@@ -121,22 +123,20 @@ def controlla_esami_minimi():
                 ic.curriculum_codice,
                 ic.anno_corso,
                 ic.semestre,
-                COUNT(CASE WHEN e.mostra_nel_calendario = TRUE THEN e.id END) as numero_esami,
+                COALESCE(MAX(CASE WHEN r.tipo_sessione = %s THEN r.numero_esami END), 0) as numero_esami,
                 u.username as docente_username,
                 u.nome as docente_nome,
                 u.cognome as docente_cognome
         """
+        params = [TIPO_TOTALE]
         
         # Aggiungi conteggio per ogni sessione
         for sessione in sessioni:
             tipo = sessione['tipo_sessione']
             base_query += f""",
-                COUNT(CASE 
-                    WHEN e.mostra_nel_calendario = TRUE 
-                    AND e.data_appello BETWEEN %s AND %s
-                    THEN e.id 
-                END) as esami_{tipo}
+                COALESCE(MAX(CASE WHEN r.tipo_sessione = %s THEN r.numero_esami END), 0) as esami_{tipo}
             """
+            params.append(tipo)
         
         base_query += """
             FROM insegnamenti i
@@ -144,16 +144,12 @@ def controlla_esami_minimi():
             JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico AND ic.curriculum_codice = c.curriculum_codice
             LEFT JOIN insegnamento_docente id ON i.id = id.insegnamento AND id.annoaccademico = %s
             LEFT JOIN utenti u ON id.docente = u.username
-            LEFT JOIN esami e ON i.id = e.insegnamento AND e.anno_accademico = %s AND e.cds = ic.cds AND e.curriculum_codice = ic.curriculum_codice
+            LEFT JOIN riepilogo_esami r ON r.insegnamento = i.id AND r.cds = ic.cds
+                      AND r.curriculum_codice = ic.curriculum_codice AND r.anno_accademico = ic.anno_accademico
             WHERE ic.anno_accademico = %s
             AND ic.inserire_esami = TRUE
         """
-        
-        # Prepara i parametri includendo le date delle sessioni
-        params = []
-        for sessione in sessioni:
-            params.extend([sessione['inizio'], sessione['fine']])
-        params.extend([anno, anno, anno])
+        params.extend([anno, anno])
         
         # Aggiungi filtri se specificati
         if cds_filter:
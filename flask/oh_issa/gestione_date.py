@@ -2,6 +2,8 @@ from flask import Blueprint, request, jsonify, session
 from db import get_db_connection, release_connection
 from auth import require_auth
 from datetime import datetime, date
+from utils.sessions import invalida_finestre_valide
+from utils.riepilogo import ricostruisci_riepilogo
 
 gestione_date_bp = Blueprint('gestione_date', __name__, url_prefix='/api/oh-issa')
 
@@ -185,8 +187,14 @@ def save_cds_dates():
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
           """, (codice_cds, anno_accademico, curriculum_codice, tipo_sessione, inizio, fine, esami_primo, esami_secondo))
 
+    # Con le nuove date gli esami dei CdS cambiano sessione: ricalcola il riepilogo
+    # (anche dell'anno successivo, di cui può cambiare la sessione anticipata)
+    for anno in (anno_accademico, anno_accademico + 1):
+      ricostruisci_riepilogo(cursor, anno, codici_cds)
+    
     # Commit delle modifiche
     conn.commit()
+    invalida_finestre_valide()
     
     message = f"Date aggiornate con successo per {len(codici_cds)} corsi per l'anno accademico {anno_accademico}"
     
@@ -417,6 +425,7 @@ def save_global_dates():
         
         # Commit delle modifiche
         conn.commit()
+        invalida_finestre_valide()
         
         return jsonify({
             'status': 'success',
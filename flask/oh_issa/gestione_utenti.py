@@ -2,6 +2,9 @@ from flask import Blueprint, request, jsonify, session
 from db import get_db_connection, release_connection
 from psycopg2.extras import DictCursor
 from auth import require_auth
+from utils.docenti import invalida_indice_docenti
+from utils.versioni import incrementa_versione_esami, registra_esami_eliminati
+from utils.riepilogo import rimuovi_esami_riepilogo
 
 gestione_utenti_bp = Blueprint('gestione_utenti', __name__, url_prefix='/api/oh-issa')
 
@@ -109,9 +112,17 @@ def delete_user():
     if not cursor.fetchone():
       return jsonify({'status': 'error', 'message': f'Utente {username} non trovato'}), 404
       
-    # Elimina l'utente
+    # I suoi esami vengono eliminati a cascata: registrali per la sincronizzazione del calendario
+    cursor.execute("SELECT anno_accademico, array_agg(id) FROM esami WHERE docente = %s GROUP BY anno_accademico", (username,))
+    for anno_accademico, exam_ids in cursor.fetchall():
+      versione = incrementa_versione_esami(cursor, anno_accademico)
+      registra_esami_eliminati(cursor, exam_ids, anno_accademico, versione)
+      rimuovi_esami_riepilogo(cursor, exam_ids)
+      
+    # Elimina l'utente (le sue righe in insegnamento_docente vengono eliminate a cascata)
     cursor.execute("DELETE FROM utenti WHERE username = %s", (username,))
     conn.commit()
+    invalida_indice_docenti()
     
     return jsonify({
       'status': 'success',
@@ -1,578 +1,408 @@
 from flask import Blueprint, request, make_response, jsonify, session, send_file
 from db import get_db_connection, release_connection
+from psycopg2.extras import execute_values
 import io
 from datetime import datetime, timedelta
 import xlwt
-import xlrd
 from auth import require_auth
+from utils.docenti import invalida_indice_docenti
+from utils.sessions import invalida_finestre_valide
+from utils.versioni import incrementa_versione_esami, segna_esami_modificati
+from utils.sovrapposizioni import aggiorna_conflitti_slot
+from utils.jobs import avvia_job, FileJob
+from oh_issa.analisi_ugov import analizza_file, analisi_da_hash, map_semestre_from_periodo, estrai_info_master, calcola_differenze
 
 import_export_bp = Blueprint('import_export', __name__, url_prefix='/api/oh-issa')
 
-# Mapping periodo → semestre (case-insensitive), default 3=Annuale
-_PERIODI_TO_SEMESTRE = {'PRIMO SEMESTRE': 1, 'SECONDO SEMESTRE': 2, 'ANNUALE': 3}
-def map_semestre_from_periodo(periodo):
-    return _PERIODI_TO_SEMESTRE.get(str(periodo).strip().upper(), 3)
-
-def _get_header_indices(sheet):
-    # Indici base (posizioni tipiche)
-    idx = {
-        'anno_accademico': 0,                      # A - Anno Offerta
-        'cod_cds': 6,                              # G - Cod. Corso di Studio
-        'des_cds': 8,                              # I - Des. C.d.S.
-        'cod_curriculum': 12,                      # M - Cod. Curriculum
-        'des_curriculum': 13,                      # N - Des. Curriculum
-        'id_insegnamento': 14,                     # O - Id. Insegnamento
-        'cod_insegnamento': 15,                    # P - Cod. Insegnamento
-        'des_insegnamento': 16,                    # Q - Des. Insegnamento
-        'cod_taf_insegnamento': 18,                # S - Cod. TAF Insegnamento
-        'id_ambito_insegnamento': 20,              # U - Id. Ambito Insegnamento
-        'anno_corso': 28,                          # AC - Anno Corso
-        'cfu_insegnamento': 29,                    # AD - CFU
-        'des_periodo_insegnamento': 39,            # AN - Periodo Insegnamento
-        'matricola_titolare': 55,                  # BD - Matricola Resp. Did.
-        'af_master_insegnamento': 60,              # BI - AF Master Insegnamento
-        'des_raggruppamento_insegnamento': 63,     # BL - Des. Raggruppamento Ins.
-        'id_unita_didattica': 65,                  # BN - Id. Unità Didattica
-        'cod_unita_didattica': 66,                 # BO - Cod. Unità Didattica
-        'des_unita_didattica': 67,                 # BP - Des. Unità Didattica
-        'des_periodo_unita_didattica': 84,         # CC - Des. Periodo UD (se presente)
-        'af_master_unita_didattica': 99,           # CT - AF Master UD
-        'des_raggruppamento_unita_didattica': 100, # CW - Des. Raggruppamento UD
-        'matricola_docente': 105,                  # DB - Matricola Docente
-        'cognome_docente': 106,                    # DC - Cognome Docente
-        'nome_docente': 107,                       # DD - Nome Docente
-        'username_docente': 108                    # DE - Username
-    }
-    # Header dinamico
-    if sheet.nrows > 0:
-        header = [str(sheet.cell_value(0, i)).strip().upper() for i in range(sheet.ncols)]
-        header_map = {
-            'ANNO OFFERTA': 'anno_accademico',
-            'COD. CORSO DI STUDIO': 'cod_cds',
-            'DES. CORSO DI STUDIO': 'des_cds',
-            'COD. CURRICULUM': 'cod_curriculum',
-            'DES. CURRICULUM': 'des_curriculum',
-            'ID INSEGNAMENTO': 'id_insegnamento',
-            'COD. INSEGNAMENTO': 'cod_insegnamento',
-            'DES. INSEGNAMENTO': 'des_insegnamento',
-            'COD. TAF INSEGNAMENTO': 'cod_taf_insegnamento',
-            'ID. AMBITO INSEGNAMENTO': 'id_ambito_insegnamento',
-            'ANNO CORSO': 'anno_corso',
-            'PESO INSEGNAMENTO': 'cfu_insegnamento',
-            'DES. PERIODO INSEGNAMENTO': 'des_periodo_insegnamento',
-            'MATRICOLA RESP. DID. INSEGNAMENTO': 'matricola_titolare',
-            'AF MASTER INSEGNAMENTO': 'af_master_insegnamento',
-            'DES. RAGGRUPPAMENTO INSEGNAMENTO': 'des_raggruppamento_insegnamento',
-            'ID UNITÀ DIDATTICA': 'id_unita_didattica',
-            'COD. UNITÀ DIDATTICA': 'cod_unita_didattica',
-            'DES. UNITÀ DIDATTICA': 'des_unita_didattica',
-            'AF MASTER UNITÀ DIDATTICA': 'af_master_unita_didattica',
-            'DES. RAGGRUPPAMENTO UNITÀ DIDATTICA': 'des_raggruppamento_unita_didattica',
-            'MATRICOLA DOCENTE': 'matricola_docente',
-            'COGNOME DOCENTE': 'cognome_docente',
-            'NOME DOCENTE': 'nome_docente',
-            'USERNAME': 'username_docente',
-            "DES. PERIODO UNITÀ DIDATTICA": 'des_periodo_unita_didattica',
-            "DES. PERIODO UNITA DIDATTICA": 'des_periodo_unita_didattica',
-            "DES. PERIODO UNITA' DIDATTICA": 'des_periodo_unita_didattica'
-        }
-        for i, col_name in enumerate(header):
-            mapped = header_map.get(col_name)
-            if mapped:
-                idx[mapped] = i
-    return idx
-
-def _cell(sheet, row, col, default=''):
-    try:
-        val = sheet.cell_value(row, col)
-        return default if val in (None, '') else val
-    except Exception:
-        return default
-
-def _should_import_row(sheet, row_idx, idx):
-    # Logica: accetta S in {A,B,C,NULL} oppure S=F e U=70285
-    cod_taf_raw = _cell(sheet, row_idx, idx.get('cod_taf_insegnamento', 18), None)
-    cod_taf = str(cod_taf_raw).strip().upper() if cod_taf_raw else ''
-    if cod_taf in ('', 'A', 'B', 'C'):
-        return True, None
-    if cod_taf == 'F':
-        id_ambito_raw = _cell(sheet, row_idx, idx.get('id_ambito_insegnamento', 20), '')
-        id_ambito = str(int(float(id_ambito_raw))).strip()
-        if id_ambito == '70285':
-            return True, None
-        else:
-            return False, f"Cod. TAF = 'F' ma Id. Ambito ≠ 70285 (valore: '{id_ambito}')"
-    return False, f"Cod. TAF non valido per importazione (valore: '{cod_taf}')"
-
-def _parse_row(sheet, row_idx, idx):
-    return {
-        'anno_accademico': int(float(_cell(sheet, row_idx, idx['anno_accademico'], 0))),
-        'cod_cds': str(_cell(sheet, row_idx, idx['cod_cds'], '???CDS???')).strip(),
-        'des_cds': str(_cell(sheet, row_idx, idx['des_cds'], '???NOME_CDS???')).strip(),
-        'cod_curriculum': str(_cell(sheet, row_idx, idx['cod_curriculum'], 'GEN')).strip(),
-        'des_curriculum': str(_cell(sheet, row_idx, idx['des_curriculum'], 'CORSO GENERICO')).strip(),
-        'id_insegnamento': str(_cell(sheet, row_idx, idx['id_insegnamento'], '???ID???')).replace('.0', '').strip(),
-        'cod_insegnamento': str(_cell(sheet, row_idx, idx['cod_insegnamento'], '???COD???')).strip(),
-        'des_insegnamento': str(_cell(sheet, row_idx, idx['des_insegnamento'], '???NOME_INSEGNAMENTO???')).strip(),
-        'id_unita_didattica': (str(_cell(sheet, row_idx, idx.get('id_unita_didattica', -1), '')).replace('.0', '').strip() or None),
-        'cod_unita_didattica': (str(_cell(sheet, row_idx, idx.get('cod_unita_didattica', -1), '')).strip() or None),
-        'des_unita_didattica': (str(_cell(sheet, row_idx, idx.get('des_unita_didattica', -1), '')).strip() or None),
-        'af_master_insegnamento': bool(_cell(sheet, row_idx, idx.get('af_master_insegnamento', -1), 1)),
-        'af_master_unita_didattica': bool(_cell(sheet, row_idx, idx.get('af_master_unita_didattica', -1), 1)),
-        'des_raggruppamento_insegnamento': str(_cell(sheet, row_idx, idx.get('des_raggruppamento_insegnamento', -1), '')).strip(),
-        'des_raggruppamento_unita_didattica': str(_cell(sheet, row_idx, idx.get('des_raggruppamento_unita_didattica', -1), '')).strip(),
-        'anno_corso': int(float(_cell(sheet, row_idx, idx['anno_corso'], 1))),
-        'cfu_insegnamento': int(float(_cell(sheet, row_idx, idx['cfu_insegnamento'], 6))),
-        'des_periodo_insegnamento': str(_cell(sheet, row_idx, idx['des_periodo_insegnamento'], 'Annuale')).strip(),
-        'des_periodo_unita_didattica': (str(_cell(sheet, row_idx, idx.get('des_periodo_unita_didattica', -1), '')).strip()
-                                         if idx.get('des_periodo_unita_didattica') is not None else None),
-        'matricola_titolare': str(_cell(sheet, row_idx, idx['matricola_titolare'], '')).strip(),
-        'matricola_docente': str(_cell(sheet, row_idx, idx['matricola_docente'], '')).strip(),
-        'cognome_docente': str(_cell(sheet, row_idx, idx['cognome_docente'], '???COGNOME???')).strip(),
-        'nome_docente': str(_cell(sheet, row_idx, idx['nome_docente'], '???NOME???')).strip(),
-        'username_docente': str(_cell(sheet, row_idx, idx['username_docente'], '')).strip() or None
-    }
-
-def estrai_info_master(raggruppamento_str):
-    import re
-    if not raggruppamento_str:
-        return None
-    match = re.search(r'Mutua\s+da:\s+Af\s+([A-Z0-9]+)\s+Cds\s+([A-Z0-9]+)(?:\s+Reg\s+\d+)?\s+Pds\s+([A-Z0-9]+)', raggruppamento_str, re.IGNORECASE)
-    if match:
-        return {'codice': match.group(1), 'cds': match.group(2), 'curriculum': match.group(3)}
-    return None
-
-def trova_id_master(info_master, righe_dati, anno_accademico):
-    if not info_master:
-        return None
-    for r in righe_dati:
-        if (r['cod_insegnamento'] == info_master['codice'] and
-            r['cod_cds'] == info_master['cds'] and
-            r['cod_curriculum'] == info_master['curriculum'] and
-            r['anno_accademico'] == anno_accademico):
-            return r['id_insegnamento']
-    for r in righe_dati:
-        if (r['cod_unita_didattica'] == info_master['codice'] and
-            r['cod_cds'] == info_master['cds'] and
-            r['cod_curriculum'] == info_master['curriculum'] and
-            r['anno_accademico'] == anno_accademico):
-            return r['id_insegnamento']
-    return None
+# Tabelle temporanee per il caricamento in blocco dei dati U-GOV (eliminate al commit).
+# La colonna 'motivo' indica perché una riga viene scartata.
+_STAGING_UGOV = """
+  CREATE TEMP TABLE staging_cds (
+    codice TEXT, anno_accademico INT, nome_corso TEXT, curriculum_codice TEXT, curriculum_nome TEXT,
+    motivo TEXT
+  ) ON COMMIT DROP;
+  CREATE TEMP TABLE staging_insegnamenti (
+    id TEXT, codice TEXT, titolo TEXT,
+    motivo TEXT
+  ) ON COMMIT DROP;
+  CREATE TEMP TABLE staging_utenti (
+    posizione INT, username TEXT, matricola TEXT, nome TEXT, cognome TEXT, permessi_admin BOOLEAN,
+    motivo TEXT
+  ) ON COMMIT DROP;
+  CREATE TEMP TABLE staging_insegnamenti_cds (
+    insegnamento TEXT, anno_accademico INT, cds TEXT, curriculum_codice TEXT, anno_corso INT,
+    semestre INT, cfu INT, master TEXT, titolare TEXT, inserire_esami BOOLEAN,
+    motivo TEXT, titolare_sconosciuto TEXT
+  ) ON COMMIT DROP;
+  CREATE TEMP TABLE staging_insegnamento_docente (
+    insegnamento TEXT, docente TEXT, annoaccademico INT,
+    motivo TEXT
+  ) ON COMMIT DROP;
+"""
+
+def _carica_dati_ugov(cursor, cds_data, insegnamenti_data, utenti_data, insegnamenti_cds_data, insegnamento_docente_data):
+  """
+  Carica i dati U-GOV con execute_values in tabelle temporanee e li copia nelle tabelle
+  definitive con un INSERT ... SELECT ... ON CONFLICT per tabella, nella transazione
+  del chiamante. Le righe non valide vengono scartate e segnalate invece di far fallire
+  l'intera transazione.
+  Ritorna (righe importate per tabella, righe scartate, avvisi).
+  """
+  cursor.execute(_STAGING_UGOV)
+  execute_values(cursor, "INSERT INTO staging_cds (codice, anno_accademico, nome_corso, curriculum_codice, curriculum_nome) VALUES %s",
+                 cds_data, page_size=1000)
+  execute_values(cursor, "INSERT INTO staging_insegnamenti (id, codice, titolo) VALUES %s",
+                 insegnamenti_data, page_size=1000)
+  execute_values(cursor, "INSERT INTO staging_utenti (posizione, username, matricola, nome, cognome, permessi_admin) VALUES %s",
+                 [(posizione,) + tuple(item) for posizione, item in enumerate(utenti_data)], page_size=1000)
+  execute_values(cursor, """
+    INSERT INTO staging_insegnamenti_cds
+    (insegnamento, anno_accademico, cds, curriculum_codice, anno_corso, semestre, cfu, master, titolare, inserire_esami)
+    VALUES %s
+  """, insegnamenti_cds_data, page_size=1000)
+  execute_values(cursor, "INSERT INTO staging_insegnamento_docente (insegnamento, docente, annoaccademico) VALUES %s",
+                 insegnamento_docente_data, page_size=1000)
+
+  # 1. Cds
+  cursor.execute("""
+    UPDATE staging_cds SET motivo = CASE
+      WHEN codice IS NULL OR curriculum_codice IS NULL OR anno_accademico IS NULL THEN 'Chiave del CdS mancante'
+      WHEN anno_accademico NOT BETWEEN 1900 AND 2100 THEN 'Anno accademico non valido'
+      WHEN nome_corso IS NULL OR curriculum_nome IS NULL THEN 'Nome del CdS o del curriculum mancante'
+    END;
+    INSERT INTO cds (codice, anno_accademico, nome_corso, curriculum_codice, curriculum_nome)
+    SELECT codice, anno_accademico, nome_corso, curriculum_codice, curriculum_nome
+    FROM staging_cds WHERE motivo IS NULL
+    ON CONFLICT (codice, anno_accademico, curriculum_codice) DO UPDATE 
+    SET nome_corso = EXCLUDED.nome_corso,
+        curriculum_nome = EXCLUDED.curriculum_nome;
+  """)
+
+  # 2. Insegnamenti
+  cursor.execute("""
+    UPDATE staging_insegnamenti SET motivo = CASE
+      WHEN id IS NULL THEN 'ID mancante'
+      WHEN codice IS NULL OR titolo IS NULL THEN 'Codice o titolo mancante'
+    END;
+    INSERT INTO insegnamenti (id, codice, titolo)
+    SELECT id, codice, titolo FROM staging_insegnamenti WHERE motivo IS NULL
+    ON CONFLICT (id) DO UPDATE 
+    SET codice = EXCLUDED.codice,
+        titolo = EXCLUDED.titolo;
+  """)
+
+  # 3. Utenti (la matricola è unica: una matricola già usata da un altro utente viene scartata)
+  cursor.execute("""
+    UPDATE staging_utenti s SET motivo = CASE
+      WHEN COALESCE(s.matricola, '') = '' THEN 'Matricola mancante'
+      WHEN EXISTS (
+        SELECT 1 FROM staging_utenti s2
+        WHERE s2.matricola = s.matricola AND s2.posizione < s.posizione
+      ) THEN 'Matricola già presente nel file per un altro docente'
+      WHEN EXISTS (
+        SELECT 1 FROM utenti u WHERE u.matricola = s.matricola AND u.username <> s.username
+      ) THEN 'Matricola già assegnata a un altro utente'
+    END;
+    INSERT INTO utenti (username, matricola, nome, cognome, permessi_admin)
+    SELECT username, matricola, nome, cognome, permessi_admin FROM staging_utenti WHERE motivo IS NULL
+    ON CONFLICT (username) DO UPDATE 
+    SET matricola = EXCLUDED.matricola,
+        nome = EXCLUDED.nome,
+        cognome = EXCLUDED.cognome;
+  """)
+
+  # 4. Insegnamenti_cds: un master sconosciuto diventa NULL, un titolare sconosciuto
+  #    diventa NULL con un avviso
+  cursor.execute("""
+    UPDATE staging_insegnamenti_cds s SET motivo = CASE
+      WHEN NOT EXISTS (SELECT 1 FROM insegnamenti i WHERE i.id = s.insegnamento) THEN 'Insegnamento non importato'
+      WHEN NOT EXISTS (
+        SELECT 1 FROM cds c
+        WHERE c.codice = s.cds AND c.anno_accademico = s.anno_accademico AND c.curriculum_codice = s.curriculum_codice
+      ) THEN 'CdS non importato'
+      WHEN s.anno_corso IS NULL OR s.semestre NOT IN (1, 2, 3) THEN 'Anno di corso o semestre non valido'
+    END;
+    UPDATE staging_insegnamenti_cds s SET master = NULL
+    WHERE s.master IS NOT NULL AND NOT EXISTS (SELECT 1 FROM insegnamenti i WHERE i.id = s.master);
+  """)
+  cursor.execute("""
+    UPDATE staging_insegnamenti_cds s SET titolare_sconosciuto = s.titolare, titolare = NULL
+    WHERE s.motivo IS NULL AND s.titolare IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM utenti u WHERE u.matricola = s.titolare)
+    RETURNING s.insegnamento, s.cds, s.curriculum_codice, s.anno_accademico, s.titolare_sconosciuto
+  """)
+  avvisi = [
+    f"Insegnamento {ins} ({cds}/{curriculum}, {anno}): titolare con matricola {titolare} non trovato, lasciato vuoto"
+    for ins, cds, curriculum, anno, titolare in cursor.fetchall()
+  ]
+  cursor.execute("""
+    INSERT INTO insegnamenti_cds 
+    (insegnamento, anno_accademico, cds, curriculum_codice, anno_corso, semestre, cfu, master, titolare, inserire_esami)
+    SELECT insegnamento, anno_accademico, cds, curriculum_codice, anno_corso, semestre, cfu, master, titolare, inserire_esami
+    FROM staging_insegnamenti_cds WHERE motivo IS NULL
+    ON CONFLICT (insegnamento, anno_accademico, cds, curriculum_codice) DO UPDATE 
+    SET anno_corso = EXCLUDED.anno_corso,
+        semestre = EXCLUDED.semestre,
+        cfu = EXCLUDED.cfu,
+        master = EXCLUDED.master,
+        titolare = EXCLUDED.titolare,
+        inserire_esami = EXCLUDED.inserire_esami;
+  """)
+
+  # 5. Insegnamento_docente
+  cursor.execute("""
+    UPDATE staging_insegnamento_docente s SET motivo = CASE
+      WHEN NOT EXISTS (SELECT 1 FROM insegnamenti i WHERE i.id = s.insegnamento) THEN 'Insegnamento non importato'
+      WHEN NOT EXISTS (SELECT 1 FROM utenti u WHERE u.username = s.docente) THEN 'Docente non importato'
+    END;
+    INSERT INTO insegnamento_docente (insegnamento, docente, annoaccademico)
+    SELECT insegnamento, docente, annoaccademico FROM staging_insegnamento_docente WHERE motivo IS NULL
+    ON CONFLICT (insegnamento, docente, annoaccademico) DO NOTHING;
+  """)
+
+  # Righe scartate di tutte le tabelle, con una sola query
+  cursor.execute("""
+    SELECT 'cds', concat_ws(' / ', codice, anno_accademico, curriculum_codice), motivo
+    FROM staging_cds WHERE motivo IS NOT NULL
+    UNION ALL
+    SELECT 'insegnamenti', concat_ws(' / ', id, codice, titolo), motivo
+    FROM staging_insegnamenti WHERE motivo IS NOT NULL
+    UNION ALL
+    SELECT 'utenti', concat_ws(' / ', username, matricola, cognome, nome), motivo
+    FROM staging_utenti WHERE motivo IS NOT NULL
+    UNION ALL
+    SELECT 'insegnamenti_cds', concat_ws(' / ', insegnamento, cds, curriculum_codice, anno_accademico), motivo
+    FROM staging_insegnamenti_cds WHERE motivo IS NOT NULL
+    UNION ALL
+    SELECT 'insegnamento_docente', concat_ws(' / ', insegnamento, docente, annoaccademico), motivo
+    FROM staging_insegnamento_docente WHERE motivo IS NOT NULL
+  """)
+  scartate = [{'tabella': tabella, 'riga': riga, 'motivo': motivo} for tabella, riga, motivo in cursor.fetchall()]
+
+  scartate_per_tabella = {}
+  for scarto in scartate:
+    scartate_per_tabella[scarto['tabella']] = scartate_per_tabella.get(scarto['tabella'], 0) + 1
+  importate = {
+    'cds': len(cds_data) - scartate_per_tabella.get('cds', 0),
+    'insegnamenti': len(insegnamenti_data) - scartate_per_tabella.get('insegnamenti', 0),
+    'utenti': len(utenti_data) - scartate_per_tabella.get('utenti', 0),
+    'insegnamenti_cds': len(insegnamenti_cds_data) - scartate_per_tabella.get('insegnamenti_cds', 0),
+    'insegnamento_docente': len(insegnamento_docente_data) - scartate_per_tabella.get('insegnamento_docente', 0)
+  }
+  return importate, scartate, avvisi
+
+def _applica_differenze_ugov(conn, cursor, differenze):
+  """
+  Import incrementale: elimina le righe non più presenti nel file, carica solo quelle
+  nuove o modificate e ricalcola le sovrapposizioni dei soli insegnamenti con semestre
+  o docenti cambiati. Ritorna (importate, scartate, avvisi, errore_sovrapposizioni).
+  """
+  if differenze.eliminare['insegnamento_docente']:
+    execute_values(cursor, """
+      DELETE FROM insegnamento_docente AS d
+      USING (VALUES %s) AS v(insegnamento, docente, annoaccademico)
+      WHERE d.insegnamento = v.insegnamento AND d.docente = v.docente AND d.annoaccademico = v.annoaccademico
+    """, differenze.eliminare['insegnamento_docente'], template="(%s, %s, %s::integer)")
+  if differenze.eliminare['insegnamenti_cds']:
+    execute_values(cursor, """
+      DELETE FROM insegnamenti_cds AS ic
+      USING (VALUES %s) AS v(insegnamento, anno_accademico, cds, curriculum_codice)
+      WHERE ic.insegnamento = v.insegnamento AND ic.anno_accademico = v.anno_accademico
+        AND ic.cds = v.cds AND ic.curriculum_codice = v.curriculum_codice
+    """, [riga[:4] for riga in differenze.eliminare['insegnamenti_cds']], template="(%s, %s::integer, %s, %s)")
+
+  importate, scartate, avvisi = _carica_dati_ugov(
+    cursor,
+    differenze.righe_da_caricare('cds'),
+    differenze.righe_da_caricare('insegnamenti'),
+    differenze.righe_da_caricare('utenti'),
+    differenze.righe_da_caricare('insegnamenti_cds'),
+    differenze.righe_da_caricare('insegnamento_docente')
+  )
+
+  if not differenze.insegnamenti_modificati:
+    return importate, scartate, avvisi, None
+
+  # Slot degli esami ufficiali degli insegnamenti modificati, per cds e anno
+  slot_per_cds = {}
+  for cds, anno, data_appello, periodo in execute_values(cursor, """
+    SELECT DISTINCT e.cds, e.anno_accademico, e.data_appello, e.periodo
+    FROM esami e
+    JOIN (VALUES %s) AS v(insegnamento, anno_accademico)
+      ON e.insegnamento = v.insegnamento AND e.anno_accademico = v.anno_accademico
+    WHERE e.mostra_nel_calendario = true
+  """, list(differenze.insegnamenti_modificati), template="(%s, %s::integer)", fetch=True):
+    slot_per_cds.setdefault((cds, anno), set()).add((data_appello, periodo))
+
+  # L'indice dei docenti deve riflettere le assegnazioni appena caricate
+  invalida_indice_docenti()
+  # Un contatore fuori dai limiti non deve annullare l'import: in quel caso
+  # si torna al savepoint e va lanciato il ricalcolo globale
+  cursor.execute("SAVEPOINT sovrapposizioni_ugov")
+  try:
+    for (cds, anno), slot in slot_per_cds.items():
+      aggiorna_conflitti_slot(conn, cds, anno, slot)
+    cursor.execute("RELEASE SAVEPOINT sovrapposizioni_ugov")
+  except Exception as e:
+    cursor.execute("ROLLBACK TO SAVEPOINT sovrapposizioni_ugov")
+    return importate, scartate, avvisi, str(e)
+  return importate, scartate, avvisi, None
 
 @import_export_bp.route('/upload-file-ugov', methods=['POST'])
 def upload_ugov():
+    """Avvia l'import U-GOV in background; la risposta dell'import è il risultato del job."""
     if not session.get('permessi_admin'):
         return jsonify({'status': 'error', 'message': 'Accesso non autorizzato'}), 401
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    if 'file' not in request.files:
-      return jsonify({'status': 'error', 'message': 'Nessun file selezionato'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-      return jsonify({'status': 'error', 'message': 'Nessun file selezionato'}), 400
-      
-    if not file.filename.endswith('.xls'):
-      return jsonify({'status': 'error', 'message': 'Formato file non supportato'}), 400
-    
-    # Leggi il file Excel
-    workbook = xlrd.open_workbook(file_contents=file.read())
-    sheet = workbook.sheet_by_index(0)  # Foglio "Insegnamenti e coperture"
-    
-    colonna_indices = _get_header_indices(sheet)
-
-    # Dati per l'inserimento
-    insegnamenti_data = []
-    insegnamenti_cds_data = []
-    cds_data = []
-    utenti_data = []
-    insegnamento_docente_data = []
-    # Insiemi per deduplicazione
-    insegnamenti_set = set()
-    cds_set = set()
-    utenti_set = set()
-    insegnamento_docente_set = set()
-    insegnamenti_cds_set = set()
-
-    # Verifica header per determinare gli indici corretti
-    if sheet.nrows > 0:
-      header = [str(sheet.cell_value(0, i)).strip().upper() for i in range(sheet.ncols)]
+    analisi = None
+    contenuto = None
+    hash_file = request.form.get('hash')
+    if hash_file:
+      # Import dopo l'anteprima: il file già analizzato viene ripreso dalla cache
+      analisi = analisi_da_hash(hash_file)
+      if analisi is None:
+        return jsonify({
+          'status': 'error',
+          'codice': 'hash_scaduto',
+          'message': "Anteprima scaduta o non trovata: ricaricare il file"
+        }), 404
+    else:
+      if 'file' not in request.files:
+        return jsonify({'status': 'error', 'message': 'Nessun file selezionato'}), 400
       
-      # Mappa nomi colonne a indici
-      header_map = {
-        'ANNO OFFERTA': 'anno_accademico',
-        'COD. CORSO DI STUDIO': 'cod_cds',
-        'DES. CORSO DI STUDIO': 'des_cds',
-        'COD. CURRICULUM': 'cod_curriculum',
-        'DES. CURRICULUM': 'des_curriculum',
-        'ID INSEGNAMENTO': 'id_insegnamento',
-        'COD. INSEGNAMENTO': 'cod_insegnamento',
-        'DES. INSEGNAMENTO': 'des_insegnamento',
-        'COD. TAF INSEGNAMENTO': 'cod_taf_insegnamento',
-        'ID. AMBITO INSEGNAMENTO': 'id_ambito_insegnamento',
-        'ANNO CORSO': 'anno_corso',
-        'PESO INSEGNAMENTO': 'cfu_insegnamento',
-        'DES. PERIODO INSEGNAMENTO': 'des_periodo_insegnamento',
-        'MATRICOLA RESP. DID. INSEGNAMENTO': 'matricola_titolare',
-        'AF MASTER INSEGNAMENTO': 'af_master_insegnamento',
-        'DES. RAGGRUPPAMENTO INSEGNAMENTO': 'des_raggruppamento_insegnamento',
-        'ID UNITÀ DIDATTICA': 'id_unita_didattica',
-        'COD. UNITÀ DIDATTICA': 'cod_unita_didattica',
-        'DES. UNITÀ DIDATTICA': 'des_unita_didattica',
-        'AF MASTER UNITÀ DIDATTICA': 'af_master_unita_didattica',
-        'DES. RAGGRUPPAMENTO UNITÀ DIDATTICA': 'des_raggruppamento_unita_didattica',
-        'MATRICOLA DOCENTE': 'matricola_docente',
-        'COGNOME DOCENTE': 'cognome_docente',
-        'NOME DOCENTE': 'nome_docente',
-        'USERNAME': 'username_docente'
-      }
+      file = request.files['file']
+      if file.filename == '':
+        return jsonify({'status': 'error', 'message': 'Nessun file selezionato'}), 400
+        
+      if not file.filename.endswith('.xls'):
+        return jsonify({'status': 'error', 'message': 'Formato file non supportato'}), 400
       
-      # Aggiorna gli indici in base all'header reale
-      for i, col_name in enumerate(header):
-        for key, value in header_map.items():
-          if key == col_name:
-            colonna_indices[value] = i
-            break
-    
-    # Prima fase: raccogliamo tutti i dati dal file
-    righe_dati = []
-    righe_saltate = 0
+      contenuto = file.read()
 
-    for row_idx in range(1, sheet.nrows):
-        try:
-            should_import, _ = _should_import_row(sheet, row_idx, colonna_indices)
-            if not should_import:
-              righe_saltate += 1
-              continue
-            riga_dati = _parse_row(sheet, row_idx, colonna_indices)
-            righe_dati.append(riga_dati)
-        except Exception:
-            righe_saltate += 1
-            continue
-    
-    # Crea mappature per trovare l'ID master dal codice + CdS + curriculum
-    def trova_id_master(info_master, righe, anno):
-        """Trova l'ID dell'insegnamento master basandosi su codice, CdS, curriculum e anno"""
-        if not info_master:
-            return None
-            
-        # Prima cerca negli insegnamenti (colonna P)
-        for riga in righe:
-            if (riga['cod_insegnamento'] == info_master['codice'] and
-                riga['cod_cds'] == info_master['cds'] and 
-                riga['cod_curriculum'] == info_master['curriculum'] and
-                riga['anno_accademico'] == anno):
-                return riga['id_insegnamento']
-        
-        # Poi cerca nei moduli (colonna BO) e restituisce l'ID del padre
-        for riga in righe:
-            if (riga['cod_unita_didattica'] == info_master['codice'] and
-                riga['cod_cds'] == info_master['cds'] and 
-                riga['cod_curriculum'] == info_master['curriculum'] and
-                riga['anno_accademico'] == anno):
-                return riga['id_insegnamento']  # Restituisce l'ID del padre del modulo
-        
-        return None
-    
-    # Crea mappature codice → ID per poter trovare l'ID master dal codice
-    codice_to_id_insegnamenti = {}
-    codice_to_id_moduli = {}
-    
-    for riga in righe_dati:
-        # Mappa codici insegnamenti → ID
-        if riga['cod_insegnamento'] and riga['id_insegnamento']:
-            codice_to_id_insegnamenti[riga['cod_insegnamento']] = riga['id_insegnamento']
-        
-        # Mappa codici moduli → ID (e anche il padre)
-        if riga['cod_unita_didattica'] and riga['id_unita_didattica']:
-            codice_to_id_moduli[riga['cod_unita_didattica']] = {
-                'id_modulo': riga['id_unita_didattica'],
-                'id_padre': riga['id_insegnamento']
-            }
-    
-    # Seconda fase: applica la logica dei 6 casi
-    for riga in righe_dati:
-        try:
-            # Determina se è un modulo o un insegnamento
-            is_modulo = riga['id_unita_didattica'] is not None
-            
-            # Variabili che vengono sempre settate allo stesso valore
-            cfu_effettivi = riga['cfu_insegnamento']  # Usa sempre la colonna AD
-            periodo_effettivo = riga['des_periodo_insegnamento']  # Usa sempre il periodo dell'insegnamento
-            
-            # Flag per determinare se il docente deve inserire esami per questo insegnamento
-            # Inizializzato a False, verrà settato a True nei casi appropriati
-            inserire_esami = False
-            
-            # L'ID che verrà salvato nel DB è SEMPRE id_insegnamento (padre)
-            # id_unita_didattica viene usato solo per i controlli
-            id_da_salvare = riga['id_insegnamento']
-            
-            # Logica per determinare master e descrizione effettivi
-            if is_modulo:
-                # CASI 3-4: Gestione moduli
-                if riga['af_master_unita_didattica']:
-                    # CASO 3: Modulo è master -> carica il padre
-                    des_effettiva = riga['des_insegnamento']
-                    master_id = None
-                    # CASO 3: Modulo master -> il docente deve inserire esami (no mutuazione)
-                    inserire_esami = True
-                else:
-                    # CASI 4: Modulo NON è master
-                    info_master = estrai_info_master(riga['des_raggruppamento_unita_didattica'])
-                    
-                    if info_master:
-                        # Trova l'ID del master usando codice + CdS + curriculum
-                        master_id_found = trova_id_master(info_master, righe_dati, riga['anno_accademico'])
-                        
-                        if master_id_found:
-                            master_id = master_id_found  # Il master è l'insegnamento trovato
-                            # CASO 4: Modulo che mutua -> il docente NON deve inserire esami (mutuazione)
-                            inserire_esami = False
-                            
-                            # Trova i dettagli del master
-                            master_row = next((r for r in righe_dati if r['id_insegnamento'] == master_id_found), None)
-                            if master_row:
-                                des_effettiva = master_row['des_insegnamento']
-                                # Aggiungi anche l'insegnamento master alla lista
-                                if master_id_found not in insegnamenti_set:
-                                    insegnamenti_data.append((master_id_found, master_row['cod_insegnamento'], master_row['des_insegnamento']))
-                                    insegnamenti_set.add(master_id_found)
-                            else:
-                                continue
-                        else:
-                            continue
-                    else:
-                        continue
-            else:
-                # CASI 1-2: Gestione insegnamenti
-                if riga['af_master_insegnamento']:
-                    # CASO 1: Insegnamento è master -> caricalo sempre
-                    des_effettiva = riga['des_insegnamento']
-                    master_id = None
-                    # CASO 1: Insegnamento master -> il docente deve inserire esami (no mutuazione)
-                    inserire_esami = True
-                else:
-                    # CASO 2: Insegnamento NON è master
-                    info_master = estrai_info_master(riga['des_raggruppamento_insegnamento'])
-                    
-                    if info_master:
-                        # Trova l'ID del master usando codice + CdS + curriculum
-                        master_id_found = trova_id_master(info_master, righe_dati, riga['anno_accademico'])
-                        
-                        if master_id_found:
-                            # SOTTOCASO 2: Inserisci sia figlio che master
-                            des_effettiva = riga['des_insegnamento']
-                            master_id = master_id_found  # Il master è l'insegnamento trovato
-                            
-                            # CASO 2: Verifica se mutua da un modulo
-                            # Se il master è un modulo (presente in cod_unita_didattica), allora è caso speciale
-                            master_e_modulo = any(r['cod_unita_didattica'] == info_master['codice'] and
-                                                r['cod_cds'] == info_master['cds'] and
-                                                r['cod_curriculum'] == info_master['curriculum'] and
-                                                r['anno_accademico'] == riga['anno_accademico'] 
-                                                for r in righe_dati)
-                            
-                            if master_e_modulo:
-                                # CASO 2 SPECIALE: Insegnamento che mutua da un modulo
-                                # Verifica il semestre: se è secondo semestre, NON deve inserire esami
-                                semestre_corrente = map_semestre_from_periodo(periodo_effettivo)
-                                
-                                if semestre_corrente == 2:  # Secondo semestre
-                                    # CASO 2 SPECIALE - SECONDO SEMESTRE: Insegnamento che mutua da un modulo nel secondo semestre ->
-                                    # il docente NON deve inserire esami (evita duplicazione con primo semestre)
-                                    inserire_esami = False
-                                else:
-                                    # CASO 2 SPECIALE - PRIMO SEMESTRE/ANNUALE: Insegnamento che mutua da un modulo ->
-                                    # il docente DEVE inserire esami (sia figlio che padre del modulo vengono caricati)
-                                    inserire_esami = True
-                            else:
-                                # CASO 2 NORMALE: Insegnamento che mutua da un altro insegnamento ->
-                                # il docente NON deve inserire esami (mutuazione normale)
-                                inserire_esami = False
-                            
-                            # Assicurati che anche l'insegnamento master sia nella lista
-                            master_row = next((r for r in righe_dati if r['id_insegnamento'] == master_id_found), None)
-                            if master_row and master_id_found not in insegnamenti_set:
-                                insegnamenti_data.append((master_id_found, master_row['cod_insegnamento'], master_row['des_insegnamento']))
-                                insegnamenti_set.add(master_id_found)
-                        else:
-                            continue
-                    else:
-                        continue
-            
-            semestre = map_semestre_from_periodo(periodo_effettivo)
-            matricola_titolare = riga['matricola_titolare'] or riga['matricola_docente']
-            
-            # Se la matricola è stringa vuota, imposta a None per rispettare il vincolo FK
-            if matricola_titolare == '':
-                matricola_titolare = None
-            
-            # Aggiungi CdS se non già presente
-            cds_key = (riga['cod_cds'], riga['anno_accademico'], riga['cod_curriculum'])
-            if cds_key not in cds_set:
-                cds_data.append((riga['cod_cds'], riga['anno_accademico'], riga['des_cds'], 
-                               riga['cod_curriculum'], riga['des_curriculum']))
-                cds_set.add(cds_key)
-            
-            # Aggiungi insegnamento padre se non già presente
-            if id_da_salvare not in insegnamenti_set:
-                insegnamenti_data.append((id_da_salvare, riga['cod_insegnamento'], des_effettiva))
-                insegnamenti_set.add(id_da_salvare)
-            
-            # Aggiungi insegnamento_cds
-            insegnamenti_cds_key = (id_da_salvare, riga['anno_accademico'], riga['cod_cds'], riga['cod_curriculum'])
-            if insegnamenti_cds_key not in insegnamenti_cds_set:
-                insegnamenti_cds_data.append((
-                    id_da_salvare,
-                    riga['anno_accademico'], 
-                    riga['cod_cds'], 
-                    riga['cod_curriculum'],
-                    riga['anno_corso'], 
-                    semestre,
-                    cfu_effettivi,
-                    master_id,
-                    matricola_titolare,
-                    inserire_esami
-                ))
-                insegnamenti_cds_set.add(insegnamenti_cds_key)
-            
-            # Aggiungi utente se non già presente (solo se c'è un docente)
-            if riga['username_docente'] and riga['username_docente'] not in utenti_set:
-                utenti_data.append((riga['username_docente'], riga['matricola_docente'], 
-                                  riga['nome_docente'], riga['cognome_docente'], False))
-                utenti_set.add(riga['username_docente'])
-            
-            # Aggiungi insegnamento_docente (solo se c'è un docente)
-            if riga['username_docente']:
-                insegnamento_docente_key = (id_da_salvare, riga['username_docente'], riga['anno_accademico'])
-                if insegnamento_docente_key not in insegnamento_docente_set:
-                    insegnamento_docente_data.append((id_da_salvare, riga['username_docente'], riga['anno_accademico']))
-                    insegnamento_docente_set.add(insegnamento_docente_key)
-                
-        except Exception:
-            continue
-    
-    # Terza fase: Assicurati che tutti i master ID referenziati esistano nella lista insegnamenti
-    for item in insegnamenti_cds_data:
-        master_id = item[7]  # Campo master è il 7° elemento
-        if master_id and master_id not in insegnamenti_set:
-            # Cerca il master nelle righe dati
-            master_row = next((r for r in righe_dati if r['id_insegnamento'] == master_id), None)
-            if master_row:
-                insegnamenti_data.append((master_id, master_row['cod_insegnamento'], master_row['des_insegnamento']))
-                insegnamenti_set.add(master_id)
-            else:
-                # Se non troviamo il master, imposta il campo master a NULL
-                item_list = list(item)
-                item_list[7] = None
-                idx = insegnamenti_cds_data.index(item)
-                insegnamenti_cds_data[idx] = tuple(item_list)
-
-    # Inserisci dati nel database
-    # 0. Configurazioni globali (inserisce l'anno accademico se non esiste)
-    if cds_data:  # Solo se ci sono dati da importare
-      anno_accademico_import = cds_data[0][1]  # Prende l'anno dal primo CdS
+    # Con 'incrementale' vengono applicate solo le differenze rispetto al database;
+    # le eliminazioni vengono applicate solo se confermate con 'conferma_eliminazioni'
+    incrementale = request.form.get('incrementale') == 'true'
+    conferma_eliminazioni = request.form.get('conferma_eliminazioni') == 'true'
+    job_id = avvia_job('import_ugov', session.get('username'), _importa_ugov, analisi, contenuto,
+                       incrementale, conferma_eliminazioni)
+    return jsonify({'status': 'accepted', 'job_id': job_id}), 202
+
+def _importa_ugov(job, analisi, contenuto, incrementale, conferma_eliminazioni=False):
+    """
+    Import U-GOV eseguito dal job: analizza il file se serve e carica i dati.
+    Se l'import incrementale eliminerebbe delle righe non confermate, non modifica nulla
+    e risponde con status 'conferma_richiesta', l'elenco delle eliminazioni e l'hash del file.
+    """
+    if analisi is None:
+      # Leggi e analizza il file Excel
+      job.avanzamento(5, 'Lettura del file')
       try:
+        analisi = analizza_file(contenuto)
+      except Exception as e:
+        return {'status': 'error', 'message': f'Errore nella lettura del file: {str(e)}'}
+
+    differenze = None
+    errore_sovrapposizioni = None
+
+    job.avanzamento(30, 'Preparazione dei dati')
+    dati = analisi.dati_import()
+    cds_data = dati['cds']
+    insegnamenti_data = dati['insegnamenti']
+    utenti_data = dati['utenti']
+    insegnamenti_cds_data = dati['insegnamenti_cds']
+    insegnamento_docente_data = dati['insegnamento_docente']
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # Inserisci dati nel database, in blocco e in un'unica transazione
+    job.avanzamento(50, 'Caricamento nel database')
+    try:
+      # 0. Configurazioni globali (inserisce l'anno accademico se non esiste)
+      if cds_data:  # Solo se ci sono dati da importare
+        anno_accademico_import = cds_data[0][1]  # Prende l'anno dal primo CdS
         cursor.execute("""
           INSERT INTO configurazioni_globali (anno_accademico, target_esami_default)
           VALUES (%s, NULL)
           ON CONFLICT (anno_accademico) DO NOTHING
         """, (anno_accademico_import,))
-      except Exception as e:
-        pass
-    
-    # 1. Cds
-    for item in cds_data:
-      try:
-        cursor.execute("""
-          INSERT INTO cds (codice, anno_accademico, nome_corso, curriculum_codice, curriculum_nome)
-          VALUES (%s, %s, %s, %s, %s)
-          ON CONFLICT (codice, anno_accademico, curriculum_codice) DO UPDATE 
-          SET nome_corso = EXCLUDED.nome_corso,
-              curriculum_nome = EXCLUDED.curriculum_nome
-        """, item)
-      except Exception:
-        continue
-    
-    # 2. Insegnamenti
-    for item in insegnamenti_data:
-      try:
-        cursor.execute("""
-          INSERT INTO insegnamenti (id, codice, titolo)
-          VALUES (%s, %s, %s)
-          ON CONFLICT (id) DO UPDATE 
-          SET codice = EXCLUDED.codice,
-              titolo = EXCLUDED.titolo
-        """, item)
-      except Exception:
-        continue
-    
-    # 3. Utenti
-    for item in utenti_data:
-      try:
-        cursor.execute("""
-          INSERT INTO utenti (username, matricola, nome, cognome, permessi_admin)
-          VALUES (%s, %s, %s, %s, %s)
-          ON CONFLICT (username) DO UPDATE 
-          SET matricola = EXCLUDED.matricola,
-              nome = EXCLUDED.nome,
-              cognome = EXCLUDED.cognome
-        """, item)
-      except Exception:
-        continue
-    
-    # 4. Insegnamenti_cds
-    for item in insegnamenti_cds_data:
-      try:
-        cursor.execute("""
-          INSERT INTO insegnamenti_cds 
-          (insegnamento, anno_accademico, cds, curriculum_codice, anno_corso, semestre, cfu, master, titolare, inserire_esami)
-          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-          ON CONFLICT (insegnamento, anno_accademico, cds, curriculum_codice) DO UPDATE 
-          SET anno_corso = EXCLUDED.anno_corso,
-              semestre = EXCLUDED.semestre,
-              cfu = EXCLUDED.cfu,
-              master = EXCLUDED.master,
-              titolare = EXCLUDED.titolare,
-              inserire_esami = EXCLUDED.inserire_esami
-        """, item)
-      except Exception:
-        continue
-    
-    # 5. Insegnamento_docente
-    for item in insegnamento_docente_data:
-      try:
-        cursor.execute("""
-          INSERT INTO insegnamento_docente (insegnamento, docente, annoaccademico)
-          VALUES (%s, %s, %s)
-          ON CONFLICT (insegnamento, docente, annoaccademico) DO NOTHING
-        """, item)
-      except Exception:
-        continue
-    
-    # Commit delle modifiche
-    conn.commit()
-    cursor.close()
-    release_connection(conn)
+      
+      # 1-5. Cds, insegnamenti, utenti, insegnamenti_cds e insegnamento_docente
+      if incrementale:
+        differenze = calcola_differenze(cursor, dati)
+        eliminazioni = differenze.eliminazioni()
+        if eliminazioni and not conferma_eliminazioni:
+          conn.rollback()
+          return {
+            'status': 'conferma_richiesta',
+            'message': f"L'import eliminerà {len(eliminazioni)} righe non più presenti nel file per i CdS e gli insegnamenti del file.",
+            'eliminazioni': eliminazioni,
+            'hash': analisi.hash
+          }
+        importate, scartate, avvisi, errore_sovrapposizioni = _applica_differenze_ugov(conn, cursor, differenze)
+        anni_modificati = set() if differenze.vuote() else set(differenze.anni)
+      else:
+        importate, scartate, avvisi = _carica_dati_ugov(
+          cursor, cds_data, insegnamenti_data, utenti_data, insegnamenti_cds_data, insegnamento_docente_data
+        )
+        anni_modificati = {item[1] for item in cds_data}
+      
+      # Titoli, CdS e docenti mostrati nel calendario potrebbero essere cambiati
+      for anno in anni_modificati:
+        versione = incrementa_versione_esami(cursor, anno)
+        segna_esami_modificati(cursor, anno, versione)
+      
+      # Commit delle modifiche
+      conn.commit()
+    except Exception as e:
+      conn.rollback()
+      return {'status': 'error', 'message': f"Errore durante l'importazione: {str(e)}"}
+    finally:
+      cursor.close()
+      release_connection(conn)
+      # I docenti degli insegnamenti (e quindi i loro CdS) potrebbero essere cambiati;
+      # l'import incrementale può aver letto l'indice dentro la transazione
+      invalida_indice_docenti()
+      invalida_finestre_valide()
 
-    return jsonify({
-        'status': 'success',
-        'message': 'Importazione completata con successo.',
-        'details': f"""
+    details = f"""
         Importati:
-        - {len(cds_data)} corsi di studio
-        - {len(insegnamenti_data)} insegnamenti
-        - {len(insegnamenti_cds_data)} assegnazioni insegnamento-CdS
-        - {len(utenti_data)} docenti
-        - {len(insegnamento_docente_data)} assegnazioni docente-insegnamento
+        - {importate['cds']} corsi di studio
+        - {importate['insegnamenti']} insegnamenti
+        - {importate['insegnamenti_cds']} assegnazioni insegnamento-CdS
+        - {importate['utenti']} docenti
+        - {importate['insegnamento_docente']} assegnazioni docente-insegnamento
         """
-    })
+    if differenze is not None:
+      conteggi = differenze.conteggi()
+      details += "\n        Differenze applicate:\n" + "\n".join(
+        f"        - {tabella}: {c['inserire']} nuove, {c['aggiornare']} modificate, {c['eliminare']} eliminate"
+        for tabella, c in conteggi.items()
+      ) + "\n"
+      details += f"        Sovrapposizioni ricalcolate per {len(differenze.insegnamenti_modificati)} insegnamenti\n"
+    if errore_sovrapposizioni:
+      details += ("\n        Attenzione: aggiornamento delle sovrapposizioni non riuscito "
+                  f"({errore_sovrapposizioni}). Eseguire il ricalcolo globale delle sovrapposizioni.\n")
+    if scartate:
+      details += f"\n        Righe scartate ({len(scartate)}):\n" + "\n".join(
+        f"        - {scarto['tabella']}: {scarto['riga']} ({scarto['motivo']})" for scarto in scartate
+      ) + "\n"
+    if avvisi:
+      details += f"\n        Avvisi ({len(avvisi)}):\n" + "\n".join(f"        - {avviso}" for avviso in avvisi) + "\n"
+
+    return {
+        'status': 'success',
+        'message': 'Importazione completata con successo.' if not scartate
+                   else f'Importazione completata con {len(scartate)} righe scartate.',
+        'details': details,
+        'righe_scartate': scartate,
+        'avvisi': avvisi,
+        'differenze': differenze.conteggi() if differenze is not None else None
+    }
 
 @import_export_bp.route('/download-file-esse3')
 def download_esse3():
+  """Avvia in background la generazione del file ESSE3, scaricabile a job concluso."""
   if not session.get('permessi_admin'):
     return jsonify({'status': 'error', 'message': 'Accesso non autorizzato'}), 401
 
@@ -580,9 +410,16 @@ def download_esse3():
   anticipata = request.args.get('anticipata', 'true').lower() == 'true'
   if not anno:
     return jsonify({'error': 'Anno accademico non specificato'}), 400
-
   try:
     anno = int(anno)
+  except ValueError:
+    return jsonify({'error': 'Anno accademico non valido'}), 400
+
+  job_id = avvia_job('export_esse3', session.get('username'), _genera_file_esse3, anno, anticipata)
+  return jsonify({'status': 'accepted', 'job_id': job_id}), 202
+
+def _genera_file_esse3(job, anno, anticipata):
+  try:
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -626,6 +463,8 @@ def download_esse3():
     cursor.execute(query, params)
     esami = cursor.fetchall()
 
+    job.avanzamento(50, 'Scrittura del file')
+
     # Crea il file Excel in memoria
     workbook = xlwt.Workbook()
     worksheet = workbook.add_sheet('Esami')
@@ -778,15 +617,7 @@ def download_esse3():
     data_oggi = datetime.now().strftime('%Y%m%d')
     filename = f'opla_esse3_{data_oggi}.xls'
 
-    # Prepara la risposta
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    response.headers['Content-type'] = 'application/vnd.ms-excel'
-    
-    return response
-
-  except Exception as e:
-    return jsonify({'status': 'error', 'message': str(e)}), 500
+    return FileJob(output.getvalue(), filename, 'application/vnd.ms-excel')
   finally:
     if 'cursor' in locals() and cursor:
       cursor.close()
@@ -795,6 +626,7 @@ def download_esse3():
 
 @import_export_bp.route('/download-file-easyacademy')
 def download_ea():
+  """Avvia in background la generazione del file EasyAcademy, scaricabile a job concluso."""
   if not session.get('permessi_admin'):
     return jsonify({'status': 'error', 'message': 'Accesso non autorizzato'}), 401
     
@@ -803,9 +635,16 @@ def download_ea():
   
   if not anno:
     return jsonify({'error': 'Anno accademico non specificato'}), 400
-    
   try:
     anno = int(anno)
+  except ValueError:
+    return jsonify({'error': 'Anno accademico non valido'}), 400
+
+  job_id = avvia_job('export_easyacademy', session.get('username'), _genera_file_easyacademy, anno, details)
+  return jsonify({'status': 'accepted', 'job_id': job_id}), 202
+
+def _genera_file_easyacademy(job, anno, details):
+  try:
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -880,6 +719,8 @@ def download_ea():
       if docente_cognome and docente_cognome not in gruppi_esami[chiave]['docenti_cognomi']:
         gruppi_esami[chiave]['docenti_cognomi'].append(docente_cognome)
 
+    job.avanzamento(50, 'Scrittura del file')
+
     # Crea il file Excel in memoria
     workbook = xlwt.Workbook()
     worksheet = workbook.add_sheet('Prenotazioni')
@@ -1037,15 +878,7 @@ def download_ea():
     suffix = "_dettagliato" if details else "_semplificato"
     filename = f'opla_easyacademy{suffix}_{data_oggi}.xls'
 
-    # Prepara la risposta
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-    response.headers['Content-type'] = 'application/vnd.ms-excel'
-    
-    return response
-
-  except Exception as e:
-    return jsonify({"error": str(e)}), 500
+    return FileJob(output.getvalue(), filename, 'application/vnd.ms-excel')
   finally:
     if 'cursor' in locals() and cursor:
       cursor.close()
@@ -1106,48 +939,11 @@ def preview_ugov():
         return jsonify({'status': 'error', 'message': 'Formato file non supportato. Usare file Excel (.xls, .xlsx)'}), 400
 
     try:
-        workbook = xlrd.open_workbook(file_contents=file.read())
-        sheet = workbook.sheet_by_index(0)
-
-        colonna_indices = _get_header_indices(sheet)
-        
-        righe_dati = []
-        righe_saltate = 0
-        righe_saltate_motivi = []
-        for row_idx in range(1, sheet.nrows):
-            try:
-                should_import, motivo = _should_import_row(sheet, row_idx, colonna_indices)
-                if not should_import:
-                    righe_saltate += 1
-                    righe_saltate_motivi.append({
-                        "row": row_idx+1,
-                        "reason": motivo or "Non rispetta la logica di import (_should_import_row)"
-                    })
-                    continue
-                try:
-                    riga = _parse_row(sheet, row_idx, colonna_indices)
-                    righe_dati.append(riga)
-                except Exception as e:
-                    righe_saltate += 1
-                    righe_saltate_motivi.append({
-                        "row": row_idx+1,
-                        "reason": f"Errore parsing: {str(e)}"
-                    })
-                    continue
-            except Exception as e:
-                righe_saltate += 1
-                righe_saltate_motivi.append({
-                    "row": row_idx+1,
-                    "reason": f"Errore generico: {str(e)}"
-                })
-                continue
-
-        # Indici veloci
-        codice_to_modulo_row = {}
-        for r in righe_dati:
-            if r['cod_unita_didattica']:
-                key = (r['cod_unita_didattica'], r['cod_cds'], r['cod_curriculum'], r['anno_accademico'])
-                codice_to_modulo_row[key] = r
+        analisi = analizza_file(file.read())
+        indice = analisi.indice
+        righe_saltate = analisi.righe_saltate
+        righe_saltate_motivi = analisi.righe_saltate_motivi
+        righe_dati = indice.righe
 
         # Contenitori per report
         insegnamenti_dict = {}
@@ -1162,24 +958,6 @@ def preview_ugov():
         mutuati_processati = set()
         moduli_processati = set()
 
-        # Trova master id
-        def trova_id_master(info_master, righe, anno):
-            if not info_master:
-                return None
-            for r in righe:
-                if (r['cod_insegnamento'] == info_master['codice'] and
-                    r['cod_cds'] == info_master['cds'] and
-                    r['cod_curriculum'] == info_master['curriculum'] and
-                    r['anno_accademico'] == anno):
-                    return r['id_insegnamento']
-            for r in righe:
-                if (r['cod_unita_didattica'] == info_master['codice'] and
-                    r['cod_cds'] == info_master['cds'] and
-                    r['cod_curriculum'] == info_master['curriculum'] and
-                    r['anno_accademico'] == anno):
-                    return r['id_insegnamento']
-            return None
-
         # Elabora
         for r in righe_dati:
             try:
@@ -1214,7 +992,7 @@ def preview_ugov():
                         info_master = estrai_info_master(r['des_raggruppamento_unita_didattica'])
                         if not info_master:
                             continue
-                        master_id = trova_id_master(info_master, righe_dati, r['anno_accademico'])
+                        master_id = indice.trova_id_master(info_master, r['anno_accademico'])
                         if not master_id:
                             continue
                         
@@ -1223,12 +1001,11 @@ def preview_ugov():
                             continue
                         moduli_processati.add(modulo_key)
                         
-                        insegnamenti_dict[master_id] = next(
-                            ((rr['cod_insegnamento'], rr['des_insegnamento']) for rr in righe_dati if rr['id_insegnamento'] == master_id),
-                            ('', '')
+                        master_row = indice.riga_insegnamento(master_id)
+                        insegnamenti_dict[master_id] = (
+                            (master_row['cod_insegnamento'], master_row['des_insegnamento']) if master_row else ('', '')
                         )
-                        modulo_key_lookup = (info_master['codice'], info_master['cds'], info_master['curriculum'], r['anno_accademico'])
-                        modulo_row = codice_to_modulo_row.get(modulo_key_lookup)
+                        modulo_row = indice.riga_modulo(info_master, r['anno_accademico'])
                         modulo_semestre = map_semestre_from_periodo((modulo_row.get('des_periodo_unita_didattica') or '') if modulo_row else '')
                         modulo_info = {
                             'tipo': 'modulo mutuato',
@@ -1237,8 +1014,8 @@ def preview_ugov():
                             'modulo_desc': r['des_unita_didattica'],
                             'modulo_numero': 1 if modulo_semestre == 1 else 2 if modulo_semestre == 2 else None,
                             'padre_id': master_id,
-                            'padre_cod': next((rr['cod_insegnamento'] for rr in righe_dati if rr['id_insegnamento'] == master_id), ''),
-                            'padre_desc': next((rr['des_insegnamento'] for rr in righe_dati if rr['id_insegnamento'] == master_id), ''),
+                            'padre_cod': master_row['cod_insegnamento'] if master_row else '',
+                            'padre_desc': master_row['des_insegnamento'] if master_row else '',
                             'salvataggio': f"insegnamenti_cds(insegnamento={master_id}, master={master_id}, inserire_esami=False, semestre={semestre_corrente})"
                         }
                         if not r['username_docente']:
@@ -1262,7 +1039,7 @@ def preview_ugov():
                         info_master = estrai_info_master(r['des_raggruppamento_insegnamento'])
                         if not info_master:
                             continue
-                        master_id = trova_id_master(info_master, righe_dati, r['anno_accademico'])
+                        master_id = indice.trova_id_master(info_master, r['anno_accademico'])
                         if not master_id:
                             continue
                         
@@ -1272,12 +1049,11 @@ def preview_ugov():
                         mutuati_processati.add(mutuato_key)
                         
                         insegnamenti_dict[r['id_insegnamento']] = (r['cod_insegnamento'], r['des_insegnamento'])
-                        master_row = next((rr for rr in righe_dati if rr['id_insegnamento'] == master_id), None)
+                        master_row = indice.riga_insegnamento(master_id)
                         if master_row:
                             insegnamenti_dict[master_id] = (master_row['cod_insegnamento'], master_row['des_insegnamento'])
 
-                        modulo_key = (info_master['codice'], info_master['cds'], info_master['curriculum'], r['anno_accademico'])
-                        modulo_row = codice_to_modulo_row.get(modulo_key)
+                        modulo_row = indice.riga_modulo(info_master, r['anno_accademico'])
                         master_tipo = 'modulo' if modulo_row else 'padre'
                         modulo_semestre = map_semestre_from_periodo((modulo_row.get('des_periodo_unita_didattica') or '') if modulo_row else '')
                         modulo_numero = 1 if modulo_semestre == 1 else 2 if modulo_semestre == 2 else None
@@ -1416,6 +1192,29 @@ def preview_ugov():
                     lines.append("")
                     seen.add(ins['id'])
 
+        # Sezione 5: differenze rispetto al database (quelle applicate dall'import incrementale)
+        lines.append("DIFFERENZE RISPETTO AL DATABASE")
+        lines.append("-" * 80)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            differenze = calcola_differenze(cursor, analisi.dati_import())
+            if differenze.vuote():
+                lines.append("  Nessuna differenza.")
+            else:
+                lines.extend("  " + riga if riga else riga for riga in differenze.report())
+                numero_eliminazioni = len(differenze.eliminazioni())
+                if numero_eliminazioni:
+                    lines.append(f"  Le {numero_eliminazioni} eliminazioni (righe '-') riguardano solo i CdS")
+                    lines.append("  e gli insegnamenti presenti nel file e vanno confermate al momento dell'import.")
+                lines.append(f"  Sovrapposizioni da ricalcolare per {len(differenze.insegnamenti_modificati)} insegnamenti")
+        except Exception as e:
+            lines.append(f"  Confronto non disponibile: {str(e)}")
+        finally:
+            cursor.close()
+            release_connection(conn)
+        lines.append("")
+
         lines.append("=" * 80)
 
         # Ritorna file txt
@@ -1424,6 +1223,8 @@ def preview_ugov():
         resp = make_response(content)
         resp.headers['Content-Disposition'] = f'attachment; filename={filename}'
         resp.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        # Hash del file analizzato: l'import può usarlo senza ricaricare il file
+        resp.headers['X-Ugov-Hash'] = analisi.hash
         return resp
 
     except Exception as e:
@@ -1,167 +1,156 @@
 from flask import Blueprint, jsonify, session, request
 from db import get_db_connection, release_connection
+from psycopg2.extras import execute_values
 from auth import require_auth
+from utils.riepilogo import ricostruisci_riepilogo
+from utils.jobs import avvia_job
 
 strumenti_bp = Blueprint('strumenti', __name__, url_prefix='/api/oh-issa')
 
-def semestri_compatibili(semestre1, semestre2):
-    """Verifica se due semestri sono compatibili per le sovrapposizioni."""
-    # Semestre 3 (annuale) è compatibile con tutti
-    if semestre1 == 3 or semestre2 == 3:
-        return True
-    # Semestri uguali sono compatibili
-    return semestre1 == semestre2
+# Numero massimo di sovrapposizioni ammesso dal vincolo CHECK su insegnamenti_cds
+MAX_SOVRAPPOSIZIONI = 2
 
-def hanno_docenti_comuni(insegnamento1_id, insegnamento2_id, anno_accademico, cursor):
-    """Verifica se due insegnamenti hanno docenti in comune."""
-    cursor.execute("""
-        SELECT COUNT(*) FROM (
-            SELECT docente FROM insegnamento_docente 
-            WHERE insegnamento = %s AND annoaccademico = %s
-            INTERSECT
-            SELECT docente FROM insegnamento_docente 
-            WHERE insegnamento = %s AND annoaccademico = %s
-        ) AS comuni
-    """, (insegnamento1_id, anno_accademico, insegnamento2_id, anno_accademico))
-    
-    count = cursor.fetchone()[0]
-    return count > 0
-
-def conta_sovrapposizioni_per_insegnamento(insegnamento_id, cds, anno_accademico, cursor):
-    """
-    Conta il numero di date in sovrapposizione per un insegnamento.
-    """
-    # Ottieni il semestre dell'insegnamento
-    cursor.execute("""
-        SELECT semestre FROM insegnamenti_cds 
-        WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-        LIMIT 1
-    """, (insegnamento_id, cds, anno_accademico))
-    
-    result = cursor.fetchone()
-    if not result:
-        return 0
-    
-    semestre_ins = result[0]
-    
-    # Trova tutti gli esami ufficiali dell'insegnamento
-    cursor.execute("""
-        SELECT DISTINCT data_appello, periodo
+# Calcolo set-based delle sovrapposizioni, con le stesse regole di exams.py:
+# - un insegnamento ha una sovrapposizione in una data/periodo se nello stesso
+#   cds/anno esiste un esame ufficiale di un altro insegnamento
+# - i semestri devono essere compatibili (il semestre 3, annuale, è compatibile con tutti)
+# - i due insegnamenti non devono avere docenti in comune
+# Gli slot in conflitto vengono salvati in esami_slot_conflitti, usata da exams.py
+# per l'aggiornamento incrementale; il contatore è il numero di slot per insegnamento.
+QUERY_SLOT_IN_CONFLITTO = """
+    INSERT INTO esami_slot_conflitti (insegnamento, cds, anno_accademico, data_appello, periodo)
+    WITH semestri AS (
+        SELECT DISTINCT ON (insegnamento, cds, anno_accademico)
+            insegnamento, cds, anno_accademico, semestre
+        FROM insegnamenti_cds
+        ORDER BY insegnamento, cds, anno_accademico, curriculum_codice
+    ),
+    slot_esami AS (
+        SELECT DISTINCT insegnamento, cds, anno_accademico, data_appello, periodo
         FROM esami
-        WHERE insegnamento = %s 
-            AND cds = %s
-            AND anno_accademico = %s
-            AND mostra_nel_calendario = true
-    """, (insegnamento_id, cds, anno_accademico))
-    
-    date_esami = cursor.fetchall()
-    
-    # Conta quante date hanno sovrapposizioni
-    sovrapposizioni = 0
-    
-    for data_appello, periodo in date_esami:
-        # Trova tutti gli esami ufficiali nella stessa data/periodo/cds
-        cursor.execute("""
-            SELECT DISTINCT e.insegnamento, ic.semestre
-            FROM esami e
-            JOIN insegnamenti_cds ic ON e.insegnamento = ic.insegnamento 
-                AND e.cds = ic.cds 
-                AND e.anno_accademico = ic.anno_accademico
-            WHERE e.cds = %s 
-                AND e.anno_accademico = %s
-                AND e.data_appello = %s
-                AND e.periodo = %s
-                AND e.mostra_nel_calendario = true
-                AND e.insegnamento != %s
-        """, (cds, anno_accademico, data_appello, periodo, insegnamento_id))
-        
-        altri_esami = cursor.fetchall()
-        
-        # Verifica se esiste almeno un esame compatibile senza docenti comuni
-        ha_sovrapposizione = False
-        for altro_ins_id, altro_semestre in altri_esami:
-            # Verifica compatibilità semestre
-            if not semestri_compatibili(semestre_ins, altro_semestre):
-                continue
-            
-            # Verifica nessun docente comune
-            if hanno_docenti_comuni(insegnamento_id, altro_ins_id, anno_accademico, cursor):
-                continue
-            
-            # Trovata una sovrapposizione valida per questa data
-            ha_sovrapposizione = True
-            break
-        
-        if ha_sovrapposizione:
-            sovrapposizioni += 1
-    
-    return sovrapposizioni
+        WHERE mostra_nel_calendario = true
+    ),
+    altri_esami AS (
+        SELECT DISTINCT e.insegnamento, e.cds, e.anno_accademico, e.data_appello, e.periodo, ic.semestre
+        FROM esami e
+        JOIN insegnamenti_cds ic ON e.insegnamento = ic.insegnamento
+            AND e.cds = ic.cds
+            AND e.anno_accademico = ic.anno_accademico
+        WHERE e.mostra_nel_calendario = true
+    ),
+    slot_in_conflitto AS (
+        SELECT s.insegnamento, s.cds, s.anno_accademico, s.data_appello, s.periodo
+        FROM slot_esami s
+        JOIN semestri sem ON sem.insegnamento = s.insegnamento
+            AND sem.cds = s.cds
+            AND sem.anno_accademico = s.anno_accademico
+        WHERE EXISTS (
+            SELECT 1
+            FROM altri_esami a
+            WHERE a.cds = s.cds
+                AND a.anno_accademico = s.anno_accademico
+                AND a.data_appello = s.data_appello
+                AND a.periodo = s.periodo
+                AND a.insegnamento != s.insegnamento
+                AND (sem.semestre = 3 OR a.semestre = 3 OR sem.semestre = a.semestre)
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM insegnamento_docente d1
+                    JOIN insegnamento_docente d2 ON d1.docente = d2.docente
+                        AND d2.annoaccademico = d1.annoaccademico
+                    WHERE d1.insegnamento = s.insegnamento
+                        AND d2.insegnamento = a.insegnamento
+                        AND d1.annoaccademico = s.anno_accademico
+                )
+        )
+    )
+    SELECT insegnamento, cds, anno_accademico, data_appello, periodo
+    FROM slot_in_conflitto
+"""
+
+QUERY_CONTEGGIO_SOVRAPPOSIZIONI = """
+    SELECT c.insegnamento, c.cds, c.anno_accademico, COUNT(*) AS numero_sovrapposizioni,
+           COALESCE(i.titolo, c.insegnamento) AS titolo
+    FROM esami_slot_conflitti c
+    LEFT JOIN insegnamenti i ON i.id = c.insegnamento
+    GROUP BY c.insegnamento, c.cds, c.anno_accademico, i.titolo
+    ORDER BY c.anno_accademico, c.cds, c.insegnamento
+"""
 
-def ricalcola_sovrapposizioni_global():
+def ricalcola_sovrapposizioni_global(job=None):
     """
-    Ricalcola tutte le sovrapposizioni usando la stessa logica di exams.py
+    Ricalcola tutte le sovrapposizioni usando la stessa logica di exams.py,
+    con poche query set-based e un unico UPDATE massivo.
+    'job' è il Job in background di cui aggiornare l'avanzamento, se presente.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Reset tutti i contatori
+        # Reset tutti i contatori e gli slot in conflitto
         cursor.execute("UPDATE insegnamenti_cds SET sovrapposizioni = 0")
+        cursor.execute("DELETE FROM esami_slot_conflitti")
         
-        # Ottieni tutti gli insegnamenti attivi
         cursor.execute("""
-            SELECT DISTINCT insegnamento, cds, anno_accademico
-            FROM insegnamenti_cds
-            ORDER BY anno_accademico, cds, insegnamento
+            SELECT COUNT(*) FROM (
+                SELECT DISTINCT insegnamento, cds, anno_accademico
+                FROM insegnamenti_cds
+            ) AS insegnamenti
         """)
-        
-        insegnamenti = cursor.fetchall()
+        totale_insegnamenti = cursor.fetchone()[0]
         
         report = {
-            'total_insegnamenti_processati': len(insegnamenti),
+            'total_insegnamenti_processati': totale_insegnamenti,
             'insegnamenti_con_sovrapposizioni': 0,
             'dettagli': [],
             'errori': []
         }
         
-        # Calcola sovrapposizioni per ogni insegnamento
-        for insegnamento_id, cds, anno_accademico in insegnamenti:
-            try:
-                num_sovrapposizioni = conta_sovrapposizioni_per_insegnamento(
-                    insegnamento_id, cds, anno_accademico, cursor
-                )
-                
-                if num_sovrapposizioni > 0:
-                    # Aggiorna il contatore
-                    cursor.execute("""
-                        UPDATE insegnamenti_cds
-                        SET sovrapposizioni = %s
-                        WHERE insegnamento = %s AND cds = %s AND anno_accademico = %s
-                    """, (num_sovrapposizioni, insegnamento_id, cds, anno_accademico))
-                    
-                    report['insegnamenti_con_sovrapposizioni'] += 1
-                    
-                    # Ottieni titolo insegnamento per il report
-                    cursor.execute("""
-                        SELECT titolo FROM insegnamenti WHERE id = %s
-                    """, (insegnamento_id,))
-                    titolo = cursor.fetchone()
-                    
-                    report['dettagli'].append({
-                        'insegnamento_id': insegnamento_id,
-                        'titolo': titolo[0] if titolo else insegnamento_id,
-                        'cds': cds,
-                        'anno_accademico': anno_accademico,
-                        'numero_sovrapposizioni': num_sovrapposizioni
-                    })
-                    
-            except Exception as e:
+        if job:
+            job.avanzamento(10, 'Calcolo degli slot in conflitto')
+        cursor.execute(QUERY_SLOT_IN_CONFLITTO)
+        cursor.execute(QUERY_CONTEGGIO_SOVRAPPOSIZIONI)
+        conteggi = cursor.fetchall()
+        
+        valori = []
+        for insegnamento_id, cds, anno_accademico, num_sovrapposizioni, titolo in conteggi:
+            if num_sovrapposizioni > MAX_SOVRAPPOSIZIONI:
+                # Il vincolo CHECK non ammette valori oltre il massimo: si salva il
+                # limite e si segnala l'anomalia nel report
                 report['errori'].append({
                     'insegnamento_id': insegnamento_id,
                     'cds': cds,
                     'anno_accademico': anno_accademico,
-                    'errore': str(e)
+                    'errore': f'{num_sovrapposizioni} sovrapposizioni, oltre il massimo consentito di {MAX_SOVRAPPOSIZIONI}'
                 })
+            
+            valori.append((insegnamento_id, cds, anno_accademico, min(num_sovrapposizioni, MAX_SOVRAPPOSIZIONI)))
+            report['insegnamenti_con_sovrapposizioni'] += 1
+            report['dettagli'].append({
+                'insegnamento_id': insegnamento_id,
+                'titolo': titolo,
+                'cds': cds,
+                'anno_accademico': anno_accademico,
+                'numero_sovrapposizioni': num_sovrapposizioni
+            })
+        
+        # Aggiorna tutti i contatori in un'unica istruzione
+        if job:
+            job.avanzamento(60, 'Aggiornamento dei contatori')
+        if valori:
+            execute_values(cursor, """
+                UPDATE insegnamenti_cds AS ic
+                SET sovrapposizioni = v.sovrapposizioni
+                FROM (VALUES %s) AS v(insegnamento, cds, anno_accademico, sovrapposizioni)
+                WHERE ic.insegnamento = v.insegnamento
+                    AND ic.cds = v.cds
+                    AND ic.anno_accademico = v.anno_accademico
+            """, valori, template="(%s, %s, %s::integer, %s::integer)", page_size=1000)
+        
+        # Ricostruisce anche il riepilogo del numero di esami, mantenuto dalle scritture
+        if job:
+            job.avanzamento(80, 'Ricostruzione del riepilogo degli esami')
+        ricostruisci_riepilogo(cursor)
         
         conn.commit()
         
@@ -184,9 +173,10 @@ def ricalcola_sovrapposizioni_global():
         cursor.close()
         release_connection(conn)
 
-@strumenti_bp.route('/ricalcola-sovrapposizioni', methods=['GET'])
+@strumenti_bp.route('/ricalcola-sovrapposizioni', methods=['GET', 'POST'])
 @require_auth
 def ricalcola_sovrapposizioni():
+    """Avvia il ricalcolo in background; il report è il risultato del job."""
     try:
         username = session.get('username', '')
         is_admin = session.get('permessi_admin', False)
@@ -195,8 +185,8 @@ def ricalcola_sovrapposizioni():
                 'status': 'error',
                 'message': 'Accesso negato: solo gli admin possono ricalcolare le sovrapposizioni'
             }), 403
-        report = ricalcola_sovrapposizioni_global()
-        return jsonify(report), 200 if report.get('status') == 'success' else 500
+        job_id = avvia_job('ricalcolo_sovrapposizioni', username, ricalcola_sovrapposizioni_global)
+        return jsonify({'status': 'accepted', 'job_id': job_id}), 202
     except Exception as e:
         return jsonify({
             'status': 'error',
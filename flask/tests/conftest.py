@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli dell'applicazione si importano dalla cartella flask/, come nel container
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
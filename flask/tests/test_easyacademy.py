@@ -0,0 +1,160 @@
+import json
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("psycopg2")
+
+from utils import easyacademy
+
+SEDE = 'TEST'
+
+def _prossimo_lunedi():
+    oggi = date.today()
+    return oggi + timedelta(days=7 - oggi.weekday())
+
+class StubEasyAcademy:
+    """Server HTTP locale che risponde come rooms_call.php di EasyAcademy."""
+
+    def __init__(self):
+        self.stato_http = 200
+        self.prenotazioni = {}   # 'DD-MM-YYYY' -> [(aula, da, a)]
+        self.richieste = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                stub.richieste.append(params)
+                if stub.stato_http != 200:
+                    self.send_response(stub.stato_http)
+                    self.end_headers()
+                    return
+                giorno = params['date'][0]
+                tabella = {
+                    str(i): [{'NomeAula': aula, 'from': da, 'to': a}]
+                    for i, (aula, da, a) in enumerate(stub.prenotazioni.get(giorno, []))
+                }
+                corpo = json.dumps({'table': tabella}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/rooms_call.php"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def chiudi(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubEasyAcademy()
+    monkeypatch.setattr(easyacademy, 'EASYACADEMY_URL', server.url)
+    monkeypatch.setattr(easyacademy, '_occupazioni', {})
+    monkeypatch.setattr(easyacademy, '_giorni_richiesti', set())
+    monkeypatch.setattr(easyacademy, '_errori', {})
+    monkeypatch.setattr(easyacademy, '_giorni_sessioni', ([], None))
+    # Nessun database: i giorni delle sessioni aperte vengono dal test
+    monkeypatch.setattr(easyacademy, '_giorni_sessioni_aperte', lambda: [])
+    easyacademy._risveglio.clear()
+    yield server
+    server.chiudi()
+
+def test_giorno_aggiornato(stub):
+    giorno = _prossimo_lunedi()
+    stub.prenotazioni[giorno.strftime('%d-%m-%Y')] = [('Aula A', '09:00:00', '11:00:00')]
+
+    assert easyacademy.aggiorna_giorno(giorno, SEDE)
+
+    aule, stato, aggiornato_il = easyacademy.aule_occupate(giorno, 0, SEDE)
+    assert aule == {'Aula A'}
+    assert stato == 'aggiornato'
+    assert aggiornato_il is not None
+    # Il pomeriggio è libero
+    assert easyacademy.aule_occupate(giorno, 1, SEDE)[0] == set()
+    assert stub.richieste[0]['sede'] == [SEDE]
+
+def test_giorno_obsoleto_dopo_ttl(stub, monkeypatch):
+    giorno = _prossimo_lunedi()
+    monkeypatch.setattr(easyacademy, '_giorni_sessioni_aperte', lambda: [giorno])
+    assert easyacademy.aggiorna_giorno(giorno, SEDE)
+    assert giorno not in easyacademy._giorni_da_aggiornare(SEDE)
+
+    # Dopo il TTL il dato resta disponibile ma è segnalato come obsoleto e va riscaricato
+    prenotazioni, _ = easyacademy._occupazioni[(SEDE, giorno)]
+    easyacademy._occupazioni[(SEDE, giorno)] = (
+        prenotazioni, datetime.now() - timedelta(seconds=easyacademy.TTL_OCCUPAZIONI + 1)
+    )
+    assert easyacademy.aule_occupate(giorno, 0, SEDE)[1] == 'obsoleto'
+    assert giorno in easyacademy._giorni_da_aggiornare(SEDE)
+
+    assert easyacademy._aggiorna_giorni(SEDE) == 'completato'
+    assert easyacademy.aule_occupate(giorno, 0, SEDE)[1] == 'aggiornato'
+
+def test_giorno_non_disponibile_messo_in_coda(stub):
+    giorno = _prossimo_lunedi()
+
+    aule, stato, aggiornato_il = easyacademy.aule_occupate(giorno, 0, SEDE)
+    assert (aule, stato, aggiornato_il) == (set(), 'non_disponibile', None)
+    assert giorno in easyacademy._giorni_richiesti
+    assert easyacademy._risveglio.is_set()
+
+    # Come il thread in background, che azzera il risveglio all'inizio di ogni giro
+    easyacademy._risveglio.clear()
+    assert easyacademy._aggiorna_giorni(SEDE) == 'completato'
+    assert easyacademy.aule_occupate(giorno, 0, SEDE)[1] == 'aggiornato'
+    assert not easyacademy._giorni_richiesti
+
+def test_giorni_non_accodati(stub, monkeypatch):
+    ieri = date.today() - timedelta(days=1)
+    sabato = _prossimo_lunedi() + timedelta(days=5)
+    assert easyacademy.aule_occupate(ieri, 0, SEDE)[1] == 'non_disponibile'
+    assert easyacademy.aule_occupate(sabato, 0, SEDE)[1] == 'non_disponibile'
+    assert not easyacademy._giorni_richiesti
+
+    # La coda dei giorni richiesti ha una dimensione massima
+    monkeypatch.setattr(easyacademy, 'MAX_GIORNI_RICHIESTI', 2)
+    lunedi = _prossimo_lunedi()
+    for settimane in range(4):
+        easyacademy.aule_occupate(lunedi + timedelta(weeks=settimane), 0, SEDE)
+    assert len(easyacademy._giorni_richiesti) == 2
+
+def test_errore_con_attesa_crescente(stub):
+    giorno = _prossimo_lunedi()
+    stub.stato_http = 503
+
+    easyacademy.aule_occupate(giorno, 0, SEDE)
+    assert easyacademy._aggiorna_giorni(SEDE) == 'errore'
+
+    # Il giorno esce dalla coda e non viene riaccodato durante l'attesa
+    assert not easyacademy._giorni_richiesti
+    tentativi, riprova_il = easyacademy._errori[(SEDE, giorno)]
+    assert tentativi == 1
+    assert riprova_il > datetime.now()
+    easyacademy._risveglio.clear()
+    assert easyacademy.aule_occupate(giorno, 0, SEDE)[1] == 'non_disponibile'
+    assert not easyacademy._giorni_richiesti
+    assert not easyacademy._risveglio.is_set()
+
+    # Un secondo errore raddoppia l'attesa
+    assert not easyacademy.aggiorna_giorno(giorno, SEDE)
+    tentativi, riprova_il2 = easyacademy._errori[(SEDE, giorno)]
+    assert tentativi == 2
+    assert riprova_il2 - datetime.now() > timedelta(seconds=easyacademy.ATTESA_MINIMA_ERRORE)
+
+    # Quando EasyAcademy torna disponibile l'errore viene dimenticato
+    stub.stato_http = 200
+    assert easyacademy.aggiorna_giorno(giorno, SEDE)
+    assert (SEDE, giorno) not in easyacademy._errori
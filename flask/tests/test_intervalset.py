@@ -0,0 +1,191 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from utils.sessions import IntervalSet, escludi_vacanze_da_sessioni, unifica_sessioni_divise
+
+INIZIO_ANNO = date(2025, 1, 1)
+GIORNI_ANNO = 120
+ITERAZIONI = 500
+
+def _giorno(rnd):
+    return INIZIO_ANNO + timedelta(days=rnd.randrange(GIORNI_ANNO))
+
+def _intervalli_casuali(rnd, massimo=6, lunghezza=20):
+    """Intervalli casuali, anche sovrapposti, adiacenti o di un solo giorno."""
+    intervalli = []
+    for _ in range(rnd.randrange(massimo + 1)):
+        inizio = _giorno(rnd)
+        intervalli.append((inizio, inizio + timedelta(days=rnd.randrange(lunghezza))))
+    return intervalli
+
+def _giorni(intervalli):
+    """Modello ingenuo: l'insieme di tutti i giorni degli intervalli."""
+    return {inizio + timedelta(days=i) for inizio, fine in intervalli
+            for i in range((fine - inizio).days + 1)}
+
+def _sessioni_casuali(rnd):
+    tipi = ['anticipata', 'estiva', 'autunnale', 'invernale']
+    return [{
+        'tipo': rnd.choice(tipi),
+        'inizio': inizio,
+        'fine': fine,
+        'nome': f"Sessione {n}"
+    } for n, (inizio, fine) in enumerate(_intervalli_casuali(rnd, massimo=4, lunghezza=40))]
+
+def _vacanze_casuali(rnd):
+    return [{'inizio': inizio, 'fine': fine, 'descrizione': 'Vacanza'}
+            for inizio, fine in _intervalli_casuali(rnd, massimo=4, lunghezza=10)]
+
+# ---------- Implementazioni precedenti a IntervalSet, come riferimento ----------
+
+def _escludi_vacanze_originale(sessions, vacanze):
+    if not vacanze:
+        return sessions
+
+    result = []
+    for session in sessions:
+        periodi_validi = [{'inizio': session['inizio'], 'fine': session['fine']}]
+        for vacanza in vacanze:
+            nuovi_periodi = []
+            for periodo in periodi_validi:
+                if vacanza['fine'] < periodo['inizio'] or vacanza['inizio'] > periodo['fine']:
+                    nuovi_periodi.append(periodo)
+                else:
+                    if periodo['inizio'] < vacanza['inizio']:
+                        nuovi_periodi.append({
+                            'inizio': periodo['inizio'],
+                            'fine': vacanza['inizio'] - timedelta(days=1)
+                        })
+                    if periodo['fine'] > vacanza['fine']:
+                        nuovi_periodi.append({
+                            'inizio': vacanza['fine'] + timedelta(days=1),
+                            'fine': periodo['fine']
+                        })
+            periodi_validi = nuovi_periodi
+
+        for i, periodo in enumerate(periodi_validi):
+            if periodo['inizio'] <= periodo['fine']:
+                nome_sessione = session['nome']
+                if len(periodi_validi) > 1:
+                    nome_sessione += f" (Parte {i + 1})"
+                result.append({
+                    'tipo': session['tipo'],
+                    'inizio': periodo['inizio'],
+                    'fine': periodo['fine'],
+                    'nome': nome_sessione,
+                    'nome_base': session['nome'],
+                    'sessione_id': f"{session['tipo']}_{session['inizio'].isoformat()}",
+                    'parte_numero': i + 1 if len(periodi_validi) > 1 else None,
+                    'totale_parti': len(periodi_validi) if len(periodi_validi) > 1 else None
+                })
+
+    return sorted(result, key=lambda x: x['inizio'])
+
+def _unifica_sessioni_originale(sessions):
+    if not sessions:
+        return []
+
+    sessioni_raggruppate = {}
+    for session in sessions:
+        sessione_id = session.get('sessione_id')
+        if not sessione_id:
+            sessioni_raggruppate[f"single_{session['tipo']}_{session['inizio'].isoformat()}"] = [session]
+        else:
+            sessioni_raggruppate.setdefault(sessione_id, []).append(session)
+
+    result = []
+    for parti in sessioni_raggruppate.values():
+        if len(parti) == 1:
+            sessione = parti[0].copy()
+            if sessione.get('totale_parti') == 1:
+                sessione['nome'] = sessione.get('nome_base', sessione['nome'])
+            result.append(sessione)
+        else:
+            parti_ordinate = sorted(parti, key=lambda x: x['inizio'])
+            prima_parte = parti_ordinate[0]
+            ultima_parte = parti_ordinate[-1]
+            result.append({
+                'tipo': prima_parte['tipo'],
+                'inizio': prima_parte['inizio'],
+                'fine': ultima_parte['fine'],
+                'nome': prima_parte.get('nome_base', prima_parte['nome'].split(' (Parte')[0]),
+                'nome_base': prima_parte.get('nome_base', prima_parte['nome'].split(' (Parte')[0]),
+                'sessione_id': prima_parte['sessione_id'],
+                'parti': parti_ordinate,
+                'numero_parti': len(parti_ordinate)
+            })
+
+    return sorted(result, key=lambda x: x['inizio'])
+
+# ---------- IntervalSet rispetto al modello a insiemi di giorni ----------
+
+def test_normalizzazione():
+    rnd = random.Random(1)
+    for _ in range(ITERAZIONI):
+        intervalli = _intervalli_casuali(rnd)
+        insieme = IntervalSet(intervalli)
+        assert _giorni(insieme) == _giorni(intervalli)
+        # Intervalli ordinati, disgiunti e non adiacenti
+        for (_, fine), (inizio, _) in zip(insieme.intervalli, insieme.intervalli[1:]):
+            assert inizio > fine + timedelta(days=1)
+
+@pytest.mark.parametrize('operazione, modello', [
+    (IntervalSet.unione, set.union),
+    (IntervalSet.intersezione, set.intersection),
+    (IntervalSet.differenza, set.difference),
+])
+def test_operazioni(operazione, modello):
+    rnd = random.Random(2)
+    for _ in range(ITERAZIONI):
+        a, b = _intervalli_casuali(rnd), _intervalli_casuali(rnd)
+        risultato = operazione(IntervalSet(a), IntervalSet(b))
+        assert _giorni(risultato) == modello(_giorni(a), _giorni(b))
+        # Il risultato è già normalizzato
+        assert risultato == IntervalSet(risultato.intervalli)
+
+def test_contiene():
+    rnd = random.Random(3)
+    for _ in range(ITERAZIONI):
+        intervalli = _intervalli_casuali(rnd)
+        insieme, giorni = IntervalSet(intervalli), _giorni(intervalli)
+        for offset in range(-5, GIORNI_ANNO + 25):
+            giorno = INIZIO_ANNO + timedelta(days=offset)
+            assert insieme.contiene(giorno) == (giorno in giorni)
+
+def test_insieme_vuoto():
+    vuoto = IntervalSet()
+    assert not vuoto
+    assert vuoto.inizio is None and vuoto.fine is None
+    assert not vuoto.contiene(INIZIO_ANNO)
+    assert IntervalSet([(date(2025, 1, 5), date(2025, 1, 1))]) == vuoto
+
+# ---------- Funzioni delle sessioni rispetto alle implementazioni precedenti ----------
+
+def test_escludi_vacanze_come_implementazione_originale():
+    rnd = random.Random(4)
+    for _ in range(ITERAZIONI):
+        sessioni, vacanze = _sessioni_casuali(rnd), _vacanze_casuali(rnd)
+        assert escludi_vacanze_da_sessioni(sessioni, vacanze) == _escludi_vacanze_originale(sessioni, vacanze)
+
+def test_unifica_sessioni_come_implementazione_originale():
+    rnd = random.Random(5)
+    for _ in range(ITERAZIONI):
+        divise = _escludi_vacanze_originale(_sessioni_casuali(rnd), _vacanze_casuali(rnd))
+        assert unifica_sessioni_divise(divise) == _unifica_sessioni_originale(divise)
+
+def test_unifica_sessioni_con_parti_sovrapposte():
+    # Parti con lo stesso sessione_id che non vengono da escludi_vacanze_da_sessioni
+    rnd = random.Random(6)
+    for _ in range(ITERAZIONI):
+        parti = [{
+            'tipo': 'estiva',
+            'inizio': inizio,
+            'fine': fine,
+            'nome': 'Sessione Estiva (Parte 1)',
+            'sessione_id': rnd.choice(['estiva_a', 'estiva_b'])
+        } for inizio, fine in _intervalli_casuali(rnd)]
+        assert unifica_sessioni_divise(parti) == _unifica_sessioni_originale(parti)
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from utils import jobs
+
+def test_avanzamento_non_interrompe_il_job(monkeypatch):
+    def aggiorna_fallito(job_id, **campi):
+        raise RuntimeError("pool esaurito")
+
+    monkeypatch.setattr(jobs, '_aggiorna', aggiorna_fallito)
+    jobs.Job('abc').avanzamento(50, 'Importazione in corso')
+
+def test_errore_nel_job_salvato_come_stato(monkeypatch):
+    aggiornamenti = []
+    monkeypatch.setattr(jobs, '_aggiorna', lambda job_id, **campi: aggiornamenti.append(campi))
+
+    def funzione(job):
+        raise ValueError("file non valido")
+
+    jobs._esegui('abc', funzione, (), {})
+    assert aggiornamenti[-1] == {'stato': 'errore', 'messaggio': 'file non valido'}
@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from utils import sovrapposizioni
+from utils.docenti import IndiceDocenti
+from utils.sovrapposizioni import GrafoSovrapposizioni, aggiorna_conflitti_slot
+
+DATA = date(2025, 6, 10)
+PERIODO = 0
+
+class CursorFinto:
+    """Cursore che restituisce i flag di conflitto salvati per lo slot."""
+
+    def __init__(self, flag_salvati):
+        self.flag_salvati = flag_salvati
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return list(self.flag_salvati)
+
+    def close(self):
+        pass
+
+class ConnessioneFinta:
+    def __init__(self, flag_salvati):
+        self.flag_salvati = flag_salvati
+
+    def cursor(self):
+        return CursorFinto(self.flag_salvati)
+
+@pytest.fixture
+def grafo_in_conflitto():
+    """Due esami di insegnamenti diversi dello stesso semestre nello stesso slot."""
+    grafo = GrafoSovrapposizioni('L31', 2025)
+    grafo.semestre = {1: 1, 2: 1}
+    grafo.semestri = {1: {1}, 2: {1}}
+    grafo.indice_docenti = IndiceDocenti(2025, {1: {'docente1'}, 2: {'docente2'}})
+    grafo.aggiungi_esame(10, 1, DATA, PERIODO)
+    grafo.aggiungi_esame(11, 2, DATA, PERIODO)
+    return grafo
+
+@pytest.fixture
+def scritture(monkeypatch):
+    chiamate = []
+    monkeypatch.setattr(sovrapposizioni, 'execute_values',
+                        lambda cursor, query, valori, **kwargs: chiamate.append((query, valori)))
+    return chiamate
+
+def test_slot_in_conflitto(grafo_in_conflitto):
+    assert grafo_in_conflitto.slot_in_conflitto(DATA, PERIODO) == {1, 2}
+
+@pytest.mark.parametrize('exam_id', [10, '10'])
+def test_eliminazione_decrementa_entrambi_i_contatori(grafo_in_conflitto, scritture, exam_id):
+    conn = ConnessioneFinta([(1, DATA, PERIODO), (2, DATA, PERIODO)])
+
+    variazioni = aggiorna_conflitti_slot(conn, 'L31', 2025, [(DATA, PERIODO)],
+                                         exam_id_rimosso=exam_id, grafo=grafo_in_conflitto)
+
+    assert variazioni == {1: -1, 2: -1}
+    assert 10 not in grafo_in_conflitto.esami
+    eliminati = [valori for query, valori in scritture if 'DELETE FROM esami_slot_conflitti' in query]
+    assert sorted(eliminati[0]) == [(1, 'L31', 2025, DATA, PERIODO), (2, 'L31', 2025, DATA, PERIODO)]
+
+def test_eliminazione_id_non_numerico(grafo_in_conflitto):
+    with pytest.raises(ValueError):
+        grafo_in_conflitto.rimuovi_esame('abc')
@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+from utils.easyacademy import aule_occupate as aule_occupate_easyacademy
+
+def _data(valore):
+    if isinstance(valore, datetime):
+        return valore.date()
+    if isinstance(valore, date):
+        return valore
+    return date.fromisoformat(str(valore)[:10])
+
+def giorni_intervallo(inizio, fine):
+    """Giorni dall'inizio alla fine compresi."""
+    inizio, fine = _data(inizio), _data(fine)
+    return [inizio + timedelta(days=i) for i in range((fine - inizio).days + 1)]
+
+class IndiceOccupazioneAule:
+    """
+    Occupazione delle aule per (aula, data, periodo), costruita con una query per
+    gli esami locali e, se richiesto, con le prenotazioni di EasyAcademy in cache.
+    Le verifiche sono ricerche in dizionari e insiemi.
+    """
+
+    def __init__(self):
+        self.esami = {}              # (aula, data, periodo) -> {id esame: docente}
+        self.esterne = {}            # (data, periodo) -> aule occupate su EasyAcademy
+        self.stato_esterne = {}      # data -> (stato, aggiornato_il) dei dati EasyAcademy
+        self.date_caricate = set()
+
+    def carica_esami(self, conn, giorni):
+        """Carica gli esami locali con aula nei giorni non ancora caricati."""
+        nuovi = {_data(g) for g in giorni} - self.date_caricate
+        if not nuovi:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT id, aula, data_appello, periodo, docente
+                FROM esami
+                WHERE data_appello = ANY(%s) AND aula IS NOT NULL
+            """, (sorted(nuovi),))
+            for exam_id, aula, data_appello, periodo, docente in cursor.fetchall():
+                self.aggiungi_esame(exam_id, aula, data_appello, periodo, docente)
+        finally:
+            cursor.close()
+        self.date_caricate |= nuovi
+
+    def carica_easyacademy(self, giorni, periodi=(0, 1)):
+        """Aggiunge le prenotazioni di EasyAcademy presenti in cache per i giorni e periodi."""
+        for giorno in {_data(g) for g in giorni}:
+            for periodo in periodi:
+                aule, stato, aggiornato_il = aule_occupate_easyacademy(giorno, periodo)
+                self.esterne[(giorno, int(periodo))] = aule
+                self.stato_esterne[giorno] = (stato, aggiornato_il)
+
+    @classmethod
+    def carica(cls, conn, giorni, easyacademy=False, periodi=(0, 1)):
+        indice = cls()
+        indice.carica_esami(conn, giorni)
+        if easyacademy:
+            indice.carica_easyacademy(giorni, periodi)
+        return indice
+
+    # ---------- Modifiche in memoria ----------
+
+    def aggiungi_esame(self, exam_id, aula, data_appello, periodo, docente=None):
+        self.esami.setdefault((aula, _data(data_appello), int(periodo)), {})[exam_id] = docente
+
+    def rimuovi_esame(self, exam_id, aula, data_appello, periodo):
+        self.esami.get((aula, _data(data_appello), int(periodo)), {}).pop(exam_id, None)
+
+    # ---------- Interrogazioni ----------
+
+    def occupanti(self, aula, data_appello, periodo):
+        """Esami locali nell'aula e nello slot, come dizionario id -> docente."""
+        return self.esami.get((aula, _data(data_appello), int(periodo)), {})
+
+    def occupata_esternamente(self, aula, data_appello, periodo):
+        return aula in self.esterne.get((_data(data_appello), int(periodo)), ())
+
+    def aule_libere(self, aule, data_appello, periodo, docente_escluso=None):
+        """
+        Aule (lista di (nome, posti)) libere nello slot. Gli esami del docente escluso
+        non occupano l'aula, come nella scelta dell'aula del form.
+        """
+        data_appello, periodo = _data(data_appello), int(periodo)
+        esterne = self.esterne.get((data_appello, periodo), ())
+        libere = []
+        for nome, posti in aule:
+            if nome in esterne:
+                continue
+            occupanti = self.esami.get((nome, data_appello, periodo), {})
+            if any(docente != docente_escluso for docente in occupanti.values()):
+                continue
+            libere.append((nome, posti))
+        return libere
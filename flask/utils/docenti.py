@@ -0,0 +1,76 @@
+import threading
+from db import get_db_connection, release_connection
+
+# Cache in memoria dei docenti di ogni insegnamento, per anno accademico.
+# Va invalidata quando cambia insegnamento_docente (import U-GOV, gestione utenti).
+# La cache è locale al processo: con più worker gunicorn ognuno ha la propria copia.
+_indici = {}
+_lock = threading.Lock()
+
+class IndiceDocenti:
+    """Mappa insegnamento -> docenti per un anno accademico, con verifica delle coppie memorizzata."""
+
+    def __init__(self, anno_accademico, docenti_per_insegnamento):
+        self.anno_accademico = anno_accademico
+        self.docenti = {ins: frozenset(docenti) for ins, docenti in docenti_per_insegnamento.items()}
+        self._coppie = {}
+
+    def docenti_di(self, insegnamento_id):
+        """Docenti dell'insegnamento (insieme vuoto se non ne ha)."""
+        return self.docenti.get(insegnamento_id, frozenset())
+
+    def hanno_docenti_comuni(self, insegnamento1_id, insegnamento2_id):
+        """Verifica se due insegnamenti hanno docenti in comune."""
+        chiave = (insegnamento1_id, insegnamento2_id) if insegnamento1_id <= insegnamento2_id \
+            else (insegnamento2_id, insegnamento1_id)
+        risultato = self._coppie.get(chiave)
+        if risultato is None:
+            risultato = not self.docenti_di(insegnamento1_id).isdisjoint(self.docenti_di(insegnamento2_id))
+            self._coppie[chiave] = risultato
+        return risultato
+
+def _carica_indice(anno_accademico, conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT insegnamento, docente
+            FROM insegnamento_docente
+            WHERE annoaccademico = %s
+        """, (anno_accademico,))
+        docenti = {}
+        for insegnamento, docente in cursor.fetchall():
+            docenti.setdefault(insegnamento, set()).add(docente)
+        return IndiceDocenti(anno_accademico, docenti)
+    finally:
+        cursor.close()
+
+def ottieni_indice_docenti(anno_accademico, conn=None):
+    """
+    Restituisce l'indice dei docenti per l'anno accademico, caricandolo alla prima richiesta.
+    Se 'conn' non è indicata viene usata una connessione del pool.
+    """
+    anno_accademico = int(anno_accademico)
+    with _lock:
+        indice = _indici.get(anno_accademico)
+    if indice is not None:
+        return indice
+
+    if conn is not None:
+        indice = _carica_indice(anno_accademico, conn)
+    else:
+        conn = get_db_connection()
+        try:
+            indice = _carica_indice(anno_accademico, conn)
+        finally:
+            release_connection(conn)
+
+    with _lock:
+        return _indici.setdefault(anno_accademico, indice)
+
+def invalida_indice_docenti(anno_accademico=None):
+    """Scarta l'indice di un anno accademico, o di tutti gli anni se non indicato."""
+    with _lock:
+        if anno_accademico is None:
+            _indici.clear()
+        else:
+            _indici.pop(int(anno_accademico), None)
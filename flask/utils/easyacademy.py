@@ -0,0 +1,206 @@
+import os
+import time
+import threading
+from datetime import date, datetime, timedelta
+import requests
+from db import get_db_connection, release_connection
+
+# Cache locale delle occupazioni delle aule lette da EasyAcademy, per (sede, giorno).
+# Un thread in background scarica in anticipo i giorni delle sessioni d'esame aperte
+# e riaggiorna quelli scaduti; /api/get-aule risponde solo da questa cache, senza
+# bloccare la richiesta sulla chiamata HTTP.
+# La cache è locale al processo: con più worker gunicorn ognuno ha la propria copia.
+EASYACADEMY_URL = os.environ.get('EASYACADEMY_URL', 'https://easyacademy.unipg.it/agendaweb/rooms_call.php')
+EASYACADEMY_SEDE = os.environ.get('EASYACADEMY_SEDE', 'P02E04')
+TTL_OCCUPAZIONI = int(os.environ.get('EASYACADEMY_TTL', 30 * 60))            # secondi
+INTERVALLO_AGGIORNAMENTO = int(os.environ.get('EASYACADEMY_INTERVALLO', 60))  # secondi
+MAX_GIORNI_PREFETCH = 120
+MAX_GIORNI_RICHIESTI = 120   # giorni in coda chiesti dagli utenti
+TIMEOUT_RICHIESTA = 5
+ATTESA_MINIMA_ERRORE = 60           # secondi prima di riprovare un giorno non scaricato, poi raddoppia
+ATTESA_MASSIMA_ERRORE = 60 * 60
+PAUSA_RIAVVIO = 1                   # secondi tra un giro interrotto da una richiesta e il successivo
+
+# Fasce orarie dei periodi (0 mattina, 1 pomeriggio)
+FASCE_ORARIE = {
+    0: ('08:30:00', '13:30:00'),
+    1: ('14:00:00', '19:00:00')
+}
+
+_occupazioni = {}        # (sede, giorno) -> (prenotazioni [(aula, da, a)], momento dell'aggiornamento)
+_giorni_richiesti = set()  # giorni chiesti dagli utenti e non ancora in cache
+_errori = {}             # (sede, giorno) -> (tentativi falliti, momento da cui riprovare)
+_giorni_sessioni = ([], None)  # giorni delle sessioni aperte e momento della lettura
+_lock = threading.Lock()
+_risveglio = threading.Event()
+_thread = None
+
+def _scarica_giorno(sede, giorno):
+    """Legge da EasyAcademy le prenotazioni delle aule della sede in un giorno."""
+    # EasyAcademy vuole la data nel formato DD-MM-YYYY
+    response = requests.get(
+        EASYACADEMY_URL,
+        params={'sede': sede, 'date': giorno.strftime('%d-%m-%Y')},
+        timeout=TIMEOUT_RICHIESTA
+    )
+    response.raise_for_status()
+    dati = response.json()
+
+    prenotazioni = []
+    for aula_data in dati.get('table', {}).values():
+        for slot in aula_data:
+            if isinstance(slot, dict) and 'from' in slot and 'to' in slot and 'NomeAula' in slot:
+                prenotazioni.append((slot['NomeAula'], slot['from'], slot['to']))
+    return prenotazioni
+
+def _in_attesa_dopo_errore(sede, giorno, adesso):
+    errore = _errori.get((sede, giorno))
+    return errore is not None and errore[1] > adesso
+
+def aggiorna_giorno(giorno, sede=EASYACADEMY_SEDE):
+    """
+    Scarica e salva in cache le occupazioni di un giorno. Ritorna False in caso di errore:
+    il giorno esce dalla coda e non viene riprovato prima di un'attesa che raddoppia
+    a ogni errore consecutivo.
+    """
+    try:
+        prenotazioni = _scarica_giorno(sede, giorno)
+    except Exception as e:
+        print(f"Errore nella richiesta a EasyAcademy per il {giorno}: {str(e)}")
+        with _lock:
+            tentativi = _errori.get((sede, giorno), (0, None))[0] + 1
+            attesa = min(ATTESA_MASSIMA_ERRORE, ATTESA_MINIMA_ERRORE * 2 ** (tentativi - 1))
+            _errori[(sede, giorno)] = (tentativi, datetime.now() + timedelta(seconds=attesa))
+            _giorni_richiesti.discard(giorno)
+        return False
+    with _lock:
+        _occupazioni[(sede, giorno)] = (prenotazioni, datetime.now())
+        _errori.pop((sede, giorno), None)
+        _giorni_richiesti.discard(giorno)
+    return True
+
+def aule_occupate(giorno, periodo, sede=EASYACADEMY_SEDE):
+    """
+    Aule occupate su EasyAcademy nel giorno e periodo, lette solo dalla cache.
+    Ritorna (aule, stato, aggiornato_il) con stato 'aggiornato', 'obsoleto' (oltre il TTL)
+    o 'non_disponibile' (giorno non ancora scaricato). Un giorno non disponibile viene
+    messo in coda solo se è feriale, non passato, non in attesa dopo un errore e se la
+    coda non è piena.
+    """
+    inizio_fascia, fine_fascia = FASCE_ORARIE[0] if str(periodo) == '0' else FASCE_ORARIE[1]
+    accodato = False
+    with _lock:
+        voce = _occupazioni.get((sede, giorno))
+        if voce is None and giorno not in _giorni_richiesti and giorno >= date.today() \
+                and giorno.weekday() < 5 and len(_giorni_richiesti) < MAX_GIORNI_RICHIESTI \
+                and not _in_attesa_dopo_errore(sede, giorno, datetime.now()):
+            _giorni_richiesti.add(giorno)
+            accodato = True
+    if voce is None:
+        # Il thread viene svegliato solo per i giorni nuovi in coda
+        if accodato:
+            _risveglio.set()
+        return set(), 'non_disponibile', None
+
+    prenotazioni, aggiornato_il = voce
+    aule = {
+        nome_aula for nome_aula, ora_inizio, ora_fine in prenotazioni
+        # Sovrapposizione con la fascia oraria richiesta
+        if ora_inizio <= fine_fascia and ora_fine >= inizio_fascia
+    }
+    scaduto = datetime.now() - aggiornato_il > timedelta(seconds=TTL_OCCUPAZIONI)
+    return aule, 'obsoleto' if scaduto else 'aggiornato', aggiornato_il
+
+def _giorni_sessioni_aperte():
+    """Giorni feriali, da oggi in avanti, compresi in una sessione d'esame."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT DISTINCT giorno::date
+            FROM sessioni s,
+                 generate_series(GREATEST(s.inizio, CURRENT_DATE), s.fine, interval '1 day') AS giorno
+            WHERE s.fine >= CURRENT_DATE AND EXTRACT(ISODOW FROM giorno) < 6
+            ORDER BY 1
+            LIMIT %s
+        """, (MAX_GIORNI_PREFETCH,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        release_connection(conn)
+
+def _giorni_sessioni_in_cache():
+    """Giorni delle sessioni aperte, riletti dal database al più una volta per intervallo."""
+    global _giorni_sessioni
+    giorni, letti_il = _giorni_sessioni
+    if letti_il is not None and time.monotonic() - letti_il < INTERVALLO_AGGIORNAMENTO:
+        return giorni
+    try:
+        giorni = _giorni_sessioni_aperte()
+    except Exception as e:
+        print(f"Errore nel recupero dei giorni delle sessioni: {str(e)}")
+    _giorni_sessioni = (giorni, time.monotonic())
+    return giorni
+
+def _giorni_da_aggiornare(sede):
+    """Giorni richiesti dagli utenti, poi giorni delle sessioni non in cache o scaduti."""
+    giorni_sessioni = _giorni_sessioni_in_cache()
+
+    oggi = date.today()
+    adesso = datetime.now()
+    limite = adesso - timedelta(seconds=TTL_OCCUPAZIONI)
+    with _lock:
+        # I giorni passati non servono più
+        for chiave in [k for k in _occupazioni if k[1] < oggi]:
+            del _occupazioni[chiave]
+        for chiave in [k for k in _errori if k[1] < oggi]:
+            del _errori[chiave]
+        _giorni_richiesti.difference_update([g for g in _giorni_richiesti if g < oggi])
+
+        richiesti = sorted(_giorni_richiesti)
+        scaduti = [
+            giorno for giorno in giorni_sessioni
+            if giorno >= oggi and not _in_attesa_dopo_errore(sede, giorno, adesso)
+            and ((sede, giorno) not in _occupazioni or _occupazioni[(sede, giorno)][1] < limite)
+        ]
+    return list(dict.fromkeys(richiesti + scaduti))
+
+def _aggiorna_giorni(sede):
+    """
+    Un giro di aggiornamento. Ritorna 'interrotto' se un utente ha chiesto un nuovo giorno,
+    'errore' se EasyAcademy non ha risposto (inutile insistere con gli altri giorni),
+    altrimenti 'completato'.
+    """
+    for giorno in _giorni_da_aggiornare(sede):
+        if not aggiorna_giorno(giorno, sede):
+            return 'errore'
+        # Un nuovo giorno chiesto da un utente ha la precedenza sul prefetch
+        if _risveglio.is_set():
+            return 'interrotto'
+    return 'completato'
+
+def _ciclo_aggiornamento(sede):
+    while True:
+        _risveglio.clear()
+        try:
+            esito = _aggiorna_giorni(sede)
+        except Exception as e:
+            print(f"Errore nell'aggiornamento della cache EasyAcademy: {str(e)}")
+            esito = 'errore'
+
+        if esito == 'interrotto':
+            time.sleep(PAUSA_RIAVVIO)
+        elif esito == 'errore':
+            # Con EasyAcademy non raggiungibile le nuove richieste non anticipano il giro successivo
+            time.sleep(INTERVALLO_AGGIORNAMENTO)
+        else:
+            _risveglio.wait(INTERVALLO_AGGIORNAMENTO)
+
+def avvia_aggiornamento(sede=EASYACADEMY_SEDE):
+    """Avvia (una sola volta per processo) il thread che aggiorna la cache in background."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_ciclo_aggiornamento, args=(sede,), name='easyacademy', daemon=True)
+        _thread.start()
@@ -0,0 +1,159 @@
+import os
+import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from db import get_db_connection, release_connection
+
+# Operazioni lunghe (import U-GOV, import esami da file, export ESSE3/EasyAcademy,
+# ricalcolo delle sovrapposizioni) eseguite in background da un pool di thread limitato:
+# la richiesta che le avvia risponde subito con l'id del job e la pagina ne interroga
+# lo stato (/api/jobs/<id>) fino alla fine, poi legge il risultato o scarica il file.
+# Il pool è locale al processo, mentre stato e risultati stanno nella tabella 'jobs':
+# il polling funziona qualunque worker gunicorn riceva la richiesta.
+MAX_JOB_CONCORRENTI = int(os.environ.get('JOBS_MAX_CONCORRENTI', 2))
+DURATA_CONSERVAZIONE = 24 * 60 * 60   # secondi dopo cui i job conclusi vengono eliminati
+DURATA_MASSIMA = 2 * 60 * 60          # secondi oltre cui un job non concluso è considerato interrotto
+
+STATI_CONCLUSI = ('completato', 'errore')
+
+_executor = None
+_lock = threading.Lock()
+
+class FileJob:
+    """Risultato di un job che produce un file da scaricare."""
+
+    def __init__(self, contenuto, nome_file, mimetype):
+        self.contenuto = contenuto
+        self.nome_file = nome_file
+        self.mimetype = mimetype
+
+class Job:
+    """Riferimento passato all'operazione in esecuzione, per aggiornarne l'avanzamento."""
+
+    def __init__(self, job_id):
+        self.id = job_id
+
+    def avanzamento(self, percentuale, messaggio=None):
+        """Aggiorna l'avanzamento; un errore nel salvataggio non interrompe il job."""
+        campi = {'avanzamento': max(0, min(100, int(percentuale)))}
+        if messaggio is not None:
+            campi['messaggio'] = messaggio
+        try:
+            _aggiorna(self.id, **campi)
+        except Exception as e:
+            print(f"Errore nel salvataggio dell'avanzamento del job {self.id}: {str(e)}")
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_JOB_CONCORRENTI, thread_name_prefix='job')
+        return _executor
+
+def _aggiorna(job_id, **campi):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        assegnazioni = ", ".join(f"{campo} = %s" for campo in campi)
+        cursor.execute(
+            f"UPDATE jobs SET {assegnazioni}, aggiornato_il = CURRENT_TIMESTAMP WHERE id = %s",
+            list(campi.values()) + [job_id]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        release_connection(conn)
+
+def _esegui(job_id, funzione, args, kwargs):
+    try:
+        _aggiorna(job_id, stato='in_corso')
+        risultato = funzione(Job(job_id), *args, **kwargs)
+        if isinstance(risultato, FileJob):
+            _aggiorna(job_id, stato='completato', avanzamento=100, messaggio=None,
+                      file=risultato.contenuto, nome_file=risultato.nome_file, mimetype=risultato.mimetype)
+        else:
+            _aggiorna(job_id, stato='completato', avanzamento=100, messaggio=None,
+                      risultato=json.dumps(risultato, default=str))
+    except Exception as e:
+        print(f"Errore nel job {job_id}: {str(e)}")
+        try:
+            _aggiorna(job_id, stato='errore', messaggio=str(e))
+        except Exception as e2:
+            print(f"Errore nel salvataggio dello stato del job {job_id}: {str(e2)}")
+
+def _pulisci_jobs(cursor):
+    """Elimina i job conclusi da tempo e segna come interrotti quelli rimasti in sospeso."""
+    cursor.execute("""
+        DELETE FROM jobs
+        WHERE stato IN %s AND aggiornato_il < CURRENT_TIMESTAMP - %s * interval '1 second'
+    """, (STATI_CONCLUSI, DURATA_CONSERVAZIONE))
+    cursor.execute("""
+        UPDATE jobs SET stato = 'errore', messaggio = 'Job interrotto', aggiornato_il = CURRENT_TIMESTAMP
+        WHERE stato NOT IN %s AND creato_il < CURRENT_TIMESTAMP - %s * interval '1 second'
+    """, (STATI_CONCLUSI, DURATA_MASSIMA))
+
+def avvia_job(tipo, utente, funzione, *args, **kwargs):
+    """
+    Registra un job e lo mette in coda nel pool. 'funzione' riceve come primo argomento
+    il Job e restituisce un dizionario (risposta JSON) oppure un FileJob.
+    Gli argomenti non devono dipendere dalla richiesta Flask, che nel thread non esiste.
+    """
+    job_id = uuid.uuid4().hex
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        _pulisci_jobs(cursor)
+        cursor.execute("INSERT INTO jobs (id, tipo, utente) VALUES (%s, %s, %s)", (job_id, tipo, utente))
+        conn.commit()
+    finally:
+        cursor.close()
+        release_connection(conn)
+
+    _pool().submit(_esegui, job_id, funzione, args, kwargs)
+    return job_id
+
+def stato_job(job_id):
+    """Stato del job come dizionario, None se non esiste."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, tipo, utente, stato, avanzamento, messaggio, risultato,
+                   nome_file IS NOT NULL, creato_il, aggiornato_il
+            FROM jobs WHERE id = %s
+        """, (job_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        release_connection(conn)
+
+    if not row:
+        return None
+    return {
+        'id': row[0],
+        'tipo': row[1],
+        'utente': row[2],
+        'stato': row[3],
+        'avanzamento': row[4],
+        'messaggio': row[5],
+        'risultato': row[6],
+        'file_disponibile': row[7],
+        'creato_il': row[8].isoformat(),
+        'aggiornato_il': row[9].isoformat()
+    }
+
+def file_job(job_id):
+    """(utente, FileJob) del job, None se il job non esiste o non ha prodotto un file."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT utente, file, nome_file, mimetype FROM jobs WHERE id = %s AND file IS NOT NULL", (job_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        release_connection(conn)
+
+    if not row:
+        return None
+    return row[0], FileJob(bytes(row[1]), row[2], row[3])
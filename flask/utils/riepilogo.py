@@ -0,0 +1,62 @@
+# Tabella riepilogo_esami: numero di esami ufficiali (mostra_nel_calendario) per
+# (insegnamento, cds, curriculum, anno accademico, tipo di sessione), più la riga 'totale'.
+# Un esame conta nelle sessioni del proprio CdS (curriculum GEN) che contengono la sua data.
+# Le scritture sugli esami applicano variazioni +1/-1 nella propria transazione, così
+# scritture concorrenti sullo stesso insegnamento non si sovrascrivono; quando cambiano
+# le date delle sessioni il riepilogo del CdS viene ricostruito.
+
+TIPO_TOTALE = 'totale'
+
+_CONTEGGI_ESAMI = """
+    SELECT e.insegnamento, e.cds, e.curriculum_codice, e.anno_accademico, t.tipo_sessione, {segno} * COUNT(*)
+    FROM esami e
+    CROSS JOIN LATERAL (
+        SELECT '""" + TIPO_TOTALE + """'
+        UNION ALL
+        SELECT s.tipo_sessione
+        FROM sessioni s
+        WHERE s.cds = e.cds AND s.anno_accademico = e.anno_accademico
+              AND s.curriculum_codice = 'GEN'
+              AND e.data_appello BETWEEN s.inizio AND s.fine
+    ) AS t(tipo_sessione)
+    WHERE e.mostra_nel_calendario = true AND {filtro}
+    GROUP BY e.insegnamento, e.cds, e.curriculum_codice, e.anno_accademico, t.tipo_sessione
+"""
+
+def _applica_esami(cursor, exam_ids, segno):
+    exam_ids = list(exam_ids)
+    if not exam_ids:
+        return
+    cursor.execute("""
+        INSERT INTO riepilogo_esami (insegnamento, cds, curriculum_codice, anno_accademico, tipo_sessione, numero_esami)
+    """ + _CONTEGGI_ESAMI.format(segno=int(segno), filtro="e.id = ANY(%s)") + """
+        ON CONFLICT (insegnamento, cds, curriculum_codice, anno_accademico, tipo_sessione)
+        DO UPDATE SET numero_esami = riepilogo_esami.numero_esami + EXCLUDED.numero_esami
+    """, (exam_ids,))
+
+def aggiungi_esami_riepilogo(cursor, exam_ids):
+    """Conta nel riepilogo gli esami indicati, da chiamare dopo averli inseriti o modificati."""
+    _applica_esami(cursor, exam_ids, 1)
+
+def rimuovi_esami_riepilogo(cursor, exam_ids):
+    """Toglie dal riepilogo gli esami indicati, da chiamare prima di modificarli o eliminarli."""
+    _applica_esami(cursor, exam_ids, -1)
+
+def ricostruisci_riepilogo(cursor, anno_accademico=None, cds=None):
+    """
+    Ricalcola da zero il riepilogo, di tutti gli anni o solo dell'anno e dei CdS indicati.
+    Va chiamata quando cambiano le date delle sessioni.
+    """
+    condizioni, params = [], []
+    if anno_accademico is not None:
+        condizioni.append("anno_accademico = %s")
+        params.append(anno_accademico)
+    if cds is not None:
+        condizioni.append("cds = ANY(%s)")
+        params.append(list(cds))
+    where = " AND ".join(condizioni) or "true"
+
+    cursor.execute("DELETE FROM riepilogo_esami WHERE " + where, params)
+    cursor.execute("""
+        INSERT INTO riepilogo_esami (insegnamento, cds, curriculum_codice, anno_accademico, tipo_sessione, numero_esami)
+    """ + _CONTEGGI_ESAMI.format(segno=1, filtro=" AND ".join("e." + c for c in condizioni) or "true"), params)
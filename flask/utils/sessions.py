@@ -1,6 +1,133 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from db import get_db_connection, release_connection
 
+# Cache delle finestre valide (sessioni con le vacanze escluse) per docente o insieme
+# di CdS in un anno accademico. Ogni voce è legata alla versione corrente, che viene
+# incrementata da invalida_finestre_valide() quando cambiano sessioni, vacanze o
+# assegnazioni dei docenti; oltre MAX_FINESTRE_IN_CACHE voci si scartano le meno usate.
+# La cache è locale al processo: con più worker gunicorn ognuno ha la propria copia.
+MAX_FINESTRE_IN_CACHE = 512
+_finestre = OrderedDict()
+_versione_finestre = 0
+_lock_finestre = threading.Lock()
+
+class IntervalSet:
+    """
+    Insieme di giorni rappresentato come lista ordinata di intervalli chiusi
+    (inizio, fine), disgiunti e non adiacenti. Unione, intersezione e differenza
+    scorrono le due liste una sola volta; la ricerca di una data è una bisezione.
+    """
+
+    __slots__ = ('intervalli', '_inizi')
+
+    def __init__(self, intervalli=()):
+        normalizzati = []
+        for inizio, fine in sorted((i, f) for i, f in intervalli if i <= f):
+            if normalizzati and inizio <= normalizzati[-1][1] + timedelta(days=1):
+                if fine > normalizzati[-1][1]:
+                    normalizzati[-1] = (normalizzati[-1][0], fine)
+            else:
+                normalizzati.append((inizio, fine))
+        self._imposta(normalizzati)
+
+    @classmethod
+    def _da_normalizzati(cls, intervalli):
+        insieme = cls.__new__(cls)
+        insieme._imposta(intervalli)
+        return insieme
+
+    def _imposta(self, intervalli):
+        self.intervalli = intervalli
+        self._inizi = [inizio for inizio, _ in intervalli]
+
+    def __iter__(self):
+        return iter(self.intervalli)
+
+    def __len__(self):
+        return len(self.intervalli)
+
+    def __bool__(self):
+        return bool(self.intervalli)
+
+    def __eq__(self, altro):
+        return isinstance(altro, IntervalSet) and self.intervalli == altro.intervalli
+
+    def __repr__(self):
+        return f"IntervalSet({self.intervalli!r})"
+
+    @property
+    def inizio(self):
+        return self.intervalli[0][0] if self.intervalli else None
+
+    @property
+    def fine(self):
+        return self.intervalli[-1][1] if self.intervalli else None
+
+    def contiene(self, data):
+        """Verifica se la data appartiene all'insieme."""
+        posizione = bisect_right(self._inizi, data)
+        return posizione > 0 and self.intervalli[posizione - 1][1] >= data
+
+    def unione(self, altro):
+        risultato = []
+        a, b = self.intervalli, altro.intervalli
+        i = j = 0
+        while i < len(a) or j < len(b):
+            if j >= len(b) or (i < len(a) and a[i][0] <= b[j][0]):
+                inizio, fine = a[i]
+                i += 1
+            else:
+                inizio, fine = b[j]
+                j += 1
+            if risultato and inizio <= risultato[-1][1] + timedelta(days=1):
+                if fine > risultato[-1][1]:
+                    risultato[-1] = (risultato[-1][0], fine)
+            else:
+                risultato.append((inizio, fine))
+        return IntervalSet._da_normalizzati(risultato)
+
+    def intersezione(self, altro):
+        risultato = []
+        a, b = self.intervalli, altro.intervalli
+        i = j = 0
+        while i < len(a) and j < len(b):
+            inizio = max(a[i][0], b[j][0])
+            fine = min(a[i][1], b[j][1])
+            if inizio <= fine:
+                risultato.append((inizio, fine))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet._da_normalizzati(risultato)
+
+    def differenza(self, altro):
+        risultato = []
+        b = altro.intervalli
+        j = 0
+        for inizio, fine in self.intervalli:
+            # Salta gli intervalli da togliere che finiscono prima di questo
+            while j < len(b) and b[j][1] < inizio:
+                j += 1
+            k = j
+            while k < len(b) and b[k][0] <= fine:
+                if b[k][0] > inizio:
+                    risultato.append((inizio, b[k][0] - timedelta(days=1)))
+                inizio = b[k][1] + timedelta(days=1)
+                if inizio > fine:
+                    break
+                k += 1
+            if inizio <= fine:
+                risultato.append((inizio, fine))
+        return IntervalSet._da_normalizzati(risultato)
+
+    __or__ = unione
+    __and__ = intersezione
+    __sub__ = differenza
+
 def ottieni_sessioni_da_cds(cds_code, year):
     """Ritorna i periodi di esame per un CdS nell'anno accademico specificato"""
     try:
@@ -36,41 +163,55 @@ def ottieni_sessioni_da_cds(cds_code, year):
 
 def ottieni_intersezione_sessioni_docente(docente, year, cds_list=None):
     """Ritorna l'intersezione dei periodi di esame tra i CdS del docente"""
+    if cds_list is not None and not cds_list:
+        return []
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # CdS richiesti: quelli indicati o quelli degli insegnamenti del docente
         if cds_list is None:
-            cursor.execute("""
+            cds_richiesti = """
                 SELECT DISTINCT ic.cds
                 FROM insegnamento_docente id
                 JOIN insegnamenti_cds ic ON id.insegnamento = ic.insegnamento
                 WHERE id.docente = %s AND id.annoaccademico = %s
-            """, (docente, year))
-            cds_list = [row[0] for row in cursor.fetchall()]
-        
-        if not cds_list:
-            return []
+            """
+            params = [docente, year]
+        else:
+            cds_richiesti = "SELECT DISTINCT unnest(%s::text[]) AS cds"
+            params = [list(cds_list)]
         
-        # Ottieni tutte le sessioni per ciascun CdS
-        all_sessions = {}
-        for cds_code in cds_list:
-            cursor.execute("""
-                SELECT tipo_sessione, inizio, fine 
-                FROM sessioni
-                WHERE cds = %s AND anno_accademico = %s 
-                  AND curriculum_codice IN (
-                    SELECT DISTINCT curriculum_codice FROM insegnamenti_cds ic
-                    JOIN insegnamento_docente id ON ic.insegnamento = id.insegnamento
-                    WHERE id.docente = %s AND ic.cds = %s AND ic.anno_accademico = %s
-                  )
-                ORDER BY inizio
-            """, (cds_code, year, docente, cds_code, year))
-            
-            all_sessions[cds_code] = {
-                row[0]: {'inizio': row[1], 'fine': row[2]} 
-                for row in cursor.fetchall()
-            }
+        # Tutte le sessioni dei CdS in una sola query; 'pertinente' indica quelle dei
+        # curriculum in cui insegna il docente, usate per l'intersezione. Tutte le
+        # sessioni servono per l'unione di riserva.
+        cursor.execute(f"""
+            WITH cds_richiesti AS ({cds_richiesti}),
+            curricula_docente AS (
+                SELECT DISTINCT ic.cds, ic.curriculum_codice
+                FROM insegnamenti_cds ic
+                JOIN insegnamento_docente id ON ic.insegnamento = id.insegnamento
+                WHERE id.docente = %s AND ic.anno_accademico = %s
+            )
+            SELECT c.cds, s.tipo_sessione, s.inizio, s.fine, cd.cds IS NOT NULL AS pertinente
+            FROM cds_richiesti c
+            LEFT JOIN sessioni s ON s.cds = c.cds AND s.anno_accademico = %s
+            LEFT JOIN curricula_docente cd ON cd.cds = s.cds
+                AND cd.curriculum_codice = s.curriculum_codice
+            ORDER BY c.cds, s.inizio
+        """, params + [docente, year, year])
+        righe = cursor.fetchall()
+        
+        # Sessioni pertinenti per ciascun CdS (anche i CdS senza sessioni sono presenti)
+        if cds_list is None:
+            all_sessions = {}
+        else:
+            all_sessions = {cds_code: {} for cds_code in cds_list}
+        for cds_code, tipo_sessione, inizio, fine, pertinente in righe:
+            sessioni_cds = all_sessions.setdefault(cds_code, {})
+            if tipo_sessione is not None and pertinente:
+                sessioni_cds[tipo_sessione] = {'inizio': inizio, 'fine': fine}
         
         # Calcola l'intersezione per tipo di sessione
         if not all_sessions:
@@ -80,36 +221,34 @@ def ottieni_intersezione_sessioni_docente(docente, year, cds_list=None):
         result = []
         
         for tipo_sessione, dates in all_sessions[first_cds].items():
-            intersection_start = dates['inizio']
-            intersection_end = dates['fine']
-            valid_intersection = True
+            finestra = IntervalSet([(dates['inizio'], dates['fine'])])
             
-            # Verifica intersezione con tutti gli altri CdS
+            # Intersezione con tutti gli altri CdS
             for cds_code in list(all_sessions.keys())[1:]:
                 if tipo_sessione not in all_sessions[cds_code]:
-                    valid_intersection = False
+                    finestra = IntervalSet()
                     break
                 
                 other_dates = all_sessions[cds_code][tipo_sessione]
-                intersection_start = max(intersection_start, other_dates['inizio'])
-                intersection_end = min(intersection_end, other_dates['fine'])
+                finestra &= IntervalSet([(other_dates['inizio'], other_dates['fine'])])
                 
-                if intersection_start > intersection_end:
-                    valid_intersection = False
+                if not finestra:
                     break
             
-            if valid_intersection:
+            if finestra:
                 result.append({
                     'tipo': tipo_sessione.lower(),
-                    'inizio': intersection_start,
-                    'fine': intersection_end,
+                    'inizio': finestra.inizio,
+                    'fine': finestra.fine,
                     'nome': format_session_name(tipo_sessione.lower())
                 })
         
         # Se non c'è intersezione, restituisci l'unione delle sessioni
         if not result:
             print(f"Nessuna intersezione trovata per {list(all_sessions.keys())}, utilizzo unione delle sessioni")
-            return ottieni_unione_sessioni_cds(list(all_sessions.keys()), year)
+            return unione_sessioni_per_tipo(
+                (tipo_sessione, inizio, fine) for _, tipo_sessione, inizio, fine, _ in righe
+            )
         
         return sorted(result, key=lambda x: x['inizio'])
         
@@ -140,19 +279,6 @@ def ottieni_sessioni_da_insegnamenti(insegnamenti_list, year):
         """, insegnamenti_list + [year])
         
         cds_list = [row[0] for row in cursor.fetchall()]
-        
-        if not cds_list:
-            return []
-        elif len(cds_list) == 1:
-            return ottieni_sessioni_da_cds(cds_list[0], year)
-        else:
-            # Prima prova l'intersezione, se non funziona usa l'unione
-            intersect_result = ottieni_intersezione_sessioni_docente(None, year, cds_list)
-            if intersect_result:
-                return intersect_result
-            else:
-                # Se non c'è intersezione, restituisci l'unione
-                return ottieni_unione_sessioni_cds(cds_list, year)
     
     except Exception as e:
         print(f"Errore nel recupero delle sessioni per insegnamenti: {e}")
@@ -163,6 +289,23 @@ def ottieni_sessioni_da_insegnamenti(insegnamenti_list, year):
         if 'conn' in locals() and conn:
             release_connection(conn)
 
+    return ottieni_sessioni_da_cds_list(cds_list, year)
+
+def ottieni_sessioni_da_cds_list(cds_list, year):
+    """Sessioni comuni a un insieme di CdS: intersezione se possibile, altrimenti unione"""
+    if not cds_list:
+        return []
+    elif len(cds_list) == 1:
+        return ottieni_sessioni_da_cds(cds_list[0], year)
+    else:
+        # Prima prova l'intersezione, se non funziona usa l'unione
+        intersect_result = ottieni_intersezione_sessioni_docente(None, year, cds_list)
+        if intersect_result:
+            return intersect_result
+        else:
+            # Se non c'è intersezione, restituisci l'unione
+            return ottieni_unione_sessioni_cds(cds_list, year)
+
 def ottieni_tutte_sessioni(anno_accademico):
     """Ottiene tutte le sessioni d'esame per tutti i CdS"""
     try:
@@ -267,58 +410,53 @@ def escludi_vacanze_da_sessioni(sessions, vacanze):
     if not vacanze:
         return sessions
     
+    giorni_vacanza = IntervalSet((vacanza['inizio'], vacanza['fine']) for vacanza in vacanze)
     result = []
     
     for session in sessions:
-        periodi_validi = [{'inizio': session['inizio'], 'fine': session['fine']}]
-        
-        # Per ogni vacanza, dividi i periodi che si sovrappongono
-        for vacanza in vacanze:
-            nuovi_periodi = []
-            
-            for periodo in periodi_validi:
-                # Se la vacanza non si sovrappone con il periodo, mantienilo così com'è
-                if vacanza['fine'] < periodo['inizio'] or vacanza['inizio'] > periodo['fine']:
-                    nuovi_periodi.append(periodo)
-                else:
-                    # La vacanza si sovrappone, dividi il periodo
-                    # Periodo prima della vacanza
-                    if periodo['inizio'] < vacanza['inizio']:
-                        nuovi_periodi.append({
-                            'inizio': periodo['inizio'],
-                            'fine': vacanza['inizio'] - timedelta(days=1)
-                        })
-                    
-                    # Periodo dopo la vacanza
-                    if periodo['fine'] > vacanza['fine']:
-                        nuovi_periodi.append({
-                            'inizio': vacanza['fine'] + timedelta(days=1),
-                            'fine': periodo['fine']
-                        })
-            
-            periodi_validi = nuovi_periodi
+        # Parti della sessione che restano togliendo le vacanze, in ordine
+        periodi_validi = list(IntervalSet([(session['inizio'], session['fine'])]) - giorni_vacanza)
         
         # Aggiungi i periodi validi risultanti alla lista finale
-        for i, periodo in enumerate(periodi_validi):
-            if periodo['inizio'] <= periodo['fine']:  # Solo periodi validi
-                nome_sessione = session['nome']
-                nome_base = session['nome']  # Nome originale senza parti
-                if len(periodi_validi) > 1:
-                    nome_sessione += f" (Parte {i + 1})"
-                
-                result.append({
-                    'tipo': session['tipo'],
-                    'inizio': periodo['inizio'],
-                    'fine': periodo['fine'],
-                    'nome': nome_sessione,
-                    'nome_base': nome_base,  # Aggiungiamo il nome base per l'unificazione
-                    'sessione_id': f"{session['tipo']}_{session['inizio'].isoformat()}",  # ID univoco della sessione originale
-                    'parte_numero': i + 1 if len(periodi_validi) > 1 else None,
-                    'totale_parti': len(periodi_validi) if len(periodi_validi) > 1 else None
-                })
+        for i, (inizio, fine) in enumerate(periodi_validi):
+            nome_sessione = session['nome']
+            nome_base = session['nome']  # Nome originale senza parti
+            if len(periodi_validi) > 1:
+                nome_sessione += f" (Parte {i + 1})"
+            
+            result.append({
+                'tipo': session['tipo'],
+                'inizio': inizio,
+                'fine': fine,
+                'nome': nome_sessione,
+                'nome_base': nome_base,  # Aggiungiamo il nome base per l'unificazione
+                'sessione_id': f"{session['tipo']}_{session['inizio'].isoformat()}",  # ID univoco della sessione originale
+                'parte_numero': i + 1 if len(periodi_validi) > 1 else None,
+                'totale_parti': len(periodi_validi) if len(periodi_validi) > 1 else None
+            })
     
     return sorted(result, key=lambda x: x['inizio'])
 
+def unione_sessioni_per_tipo(righe):
+    """Unione per tipo di sessione (inizio minimo, fine massima) di righe (tipo, inizio, fine)"""
+    estremi = {}
+    for tipo_sessione, inizio, fine in righe:
+        if tipo_sessione is None:
+            continue
+        if tipo_sessione in estremi:
+            minimo, massimo = estremi[tipo_sessione]
+            estremi[tipo_sessione] = (min(minimo, inizio), max(massimo, fine))
+        else:
+            estremi[tipo_sessione] = (inizio, fine)
+    
+    sessions = [{
+        'tipo': tipo_sessione.lower(),
+        'inizio': inizio,
+        'fine': fine,
+        'nome': format_session_name(tipo_sessione.lower())
+    } for tipo_sessione, (inizio, fine) in estremi.items()]
+    return sorted(sessions, key=lambda x: x['inizio'])
+
 def ottieni_unione_sessioni_cds(cds_list, year):
     """Ottiene l'unione delle sessioni per i CdS specificati"""
     try:
@@ -386,7 +524,7 @@ def unifica_sessioni_divise(sessions):
                 sessione['nome'] = sessione.get('nome_base', sessione['nome'])
             result.append(sessione)
         else:
-            # Sessione divisa, unifica
+            # Sessione divisa, unifica coprendo dall'inizio della prima parte alla fine dell'ultima
             parti_ordinate = sorted(parti, key=lambda x: x['inizio'])
             prima_parte = parti_ordinate[0]
             ultima_parte = parti_ordinate[-1]
@@ -403,4 +541,64 @@ def unifica_sessioni_divise(sessions):
             }
             result.append(sessione_unificata)
     
-    return sorted(result, key=lambda x: x['inizio'])
\ No newline at end of file
+    return sorted(result, key=lambda x: x['inizio'])
+
+class FinestreValide:
+    """Sessioni valide (vacanze escluse) ordinate per inizio, interrogabili per bisezione."""
+
+    def __init__(self, sessioni):
+        self.sessioni = sorted(sessioni, key=lambda x: x['inizio'])
+        self.giorni = IntervalSet((sessione['inizio'], sessione['fine']) for sessione in self.sessioni)
+
+    def contiene(self, data):
+        """Verifica se la data cade in almeno una finestra valida."""
+        if isinstance(data, datetime):
+            data = data.date()
+        return self.giorni.contiene(data)
+
+def _calcola_finestre_valide(year, docente, cds_list):
+    if cds_list is not None:
+        sessioni = ottieni_sessioni_da_cds_list(list(cds_list), year)
+    else:
+        sessioni = ottieni_intersezione_sessioni_docente(docente, year)
+    if sessioni:
+        sessioni = escludi_vacanze_da_sessioni(sessioni, ottieni_vacanze(year))
+    return FinestreValide(sessioni or [])
+
+def ottieni_finestre_valide(year, docente=None, cds_list=None):
+    """
+    Finestre valide per l'inserimento di esami del docente (o dell'insieme di CdS
+    indicato) nell'anno accademico, lette dalla cache se disponibili.
+    """
+    year = int(year)
+    if cds_list is not None:
+        chiave = ('cds', frozenset(cds_list), year)
+    else:
+        chiave = ('docente', docente, year)
+
+    with _lock_finestre:
+        versione = _versione_finestre
+        finestre = _finestre.get(chiave)
+        if finestre is not None:
+            _finestre.move_to_end(chiave)
+            return finestre
+
+    finestre = _calcola_finestre_valide(year, docente, cds_list)
+
+    # Le finestre vuote non vengono memorizzate: possono derivare da un errore di lettura.
+    # Se nel frattempo la versione è cambiata il risultato potrebbe essere già superato.
+    if finestre.sessioni:
+        with _lock_finestre:
+            if versione == _versione_finestre:
+                _finestre[chiave] = finestre
+                _finestre.move_to_end(chiave)
+                while len(_finestre) > MAX_FINESTRE_IN_CACHE:
+                    _finestre.popitem(last=False)
+    return finestre
+
+def invalida_finestre_valide():
+    """Incrementa la versione delle finestre valide, scartando quelle in cache."""
+    global _versione_finestre
+    with _lock_finestre:
+        _versione_finestre += 1
+        _finestre.clear()
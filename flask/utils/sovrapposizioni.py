@@ -0,0 +1,254 @@
+from datetime import date
+from psycopg2.extras import execute_values
+from utils.docenti import ottieni_indice_docenti
+
+# Regole delle sovrapposizioni (le stesse del ricalcolo globale in oh_issa/strumenti.py):
+# - due esami ufficiali dello stesso cds/anno nella stessa data e periodo si sovrappongono
+#   se appartengono a insegnamenti diversi con semestri compatibili e senza docenti in comune
+# - il contatore di un insegnamento è il numero di date/periodi distinti in sovrapposizione
+
+def semestri_compatibili(semestre1, semestre2):
+    """Verifica se due semestri sono compatibili per le sovrapposizioni."""
+    # Semestre 3 (annuale) è compatibile con tutti
+    if semestre1 == 3 or semestre2 == 3:
+        return True
+    # Semestri uguali sono compatibili
+    return semestre1 == semestre2
+
+def normalizza_slot(data_appello, periodo):
+    """Converte data e periodo nel formato usato come chiave degli slot."""
+    if isinstance(data_appello, str):
+        data_appello = date.fromisoformat(data_appello[:10])
+    return data_appello, int(periodo) if periodo is not None else None
+
+class GrafoSovrapposizioni:
+    """
+    Grafo dei conflitti tra gli esami ufficiali di un cds in un anno accademico.
+    Carica esami, semestri e docenti una sola volta e risponde in memoria
+    alle domande sulle sovrapposizioni.
+    """
+
+    def __init__(self, cds, anno_accademico):
+        self.cds = cds
+        self.anno_accademico = anno_accademico
+        self.esami = {}        # id esame -> (insegnamento, slot)
+        self.slot = {}         # (data, periodo) -> {id esame: insegnamento}
+        self.per_insegnamento = {}  # insegnamento -> {id esame: (data, periodo)}
+        self.semestre = {}     # insegnamento -> semestre di riferimento
+        self.semestri = {}     # insegnamento -> tutti i semestri dei suoi curriculum
+        self.titoli = {}       # insegnamento -> titolo
+        self.contatori = {}    # insegnamento -> valori salvati di sovrapposizioni
+        self.indice_docenti = None  # indice condiviso dei docenti dell'anno
+
+    @classmethod
+    def carica(cls, conn, cds, anno_accademico, slot=None, insegnamenti=()):
+        """
+        Costruisce il grafo leggendo i dati del cds con due query; i docenti
+        vengono dall'indice condiviso di utils/docenti.py.
+        Se 'slot' è indicato vengono caricati solo gli esami di quegli slot e gli
+        insegnamenti coinvolti (più quelli in 'insegnamenti').
+        """
+        grafo = cls(cds, anno_accademico)
+        cursor = conn.cursor()
+        try:
+            query_esami = """
+                SELECT id, insegnamento, data_appello, periodo
+                FROM esami
+                WHERE cds = %s AND anno_accademico = %s AND mostra_nel_calendario = true
+            """
+            params = [cds, anno_accademico]
+            if slot is not None:
+                slot = {normalizza_slot(data_appello, periodo) for data_appello, periodo in slot}
+                if not slot:
+                    slot = {(None, None)}
+                query_esami += " AND (data_appello, periodo) IN %s"
+                params.append(tuple(slot))
+            cursor.execute(query_esami, params)
+            for exam_id, insegnamento, data_appello, periodo in cursor.fetchall():
+                grafo.aggiungi_esame(exam_id, insegnamento, data_appello, periodo)
+
+            # Insegnamenti di cui servono semestre, titolo e contatore
+            coinvolti = None
+            if slot is not None:
+                coinvolti = set(grafo.per_insegnamento) | set(insegnamenti)
+            grafo._carica_insegnamenti(cursor, coinvolti)
+        finally:
+            cursor.close()
+
+        grafo.indice_docenti = ottieni_indice_docenti(anno_accademico, conn)
+        return grafo
+
+    def _carica_insegnamenti(self, cursor, insegnamenti=None):
+        filtro_insegnamenti = ""
+        params = [self.cds, self.anno_accademico]
+        if insegnamenti is not None:
+            filtro_insegnamenti = " AND ic.insegnamento = ANY(%s)"
+            params.append(list(insegnamenti))
+
+        cursor.execute("""
+            SELECT ic.insegnamento, ic.semestre, ic.sovrapposizioni, i.titolo
+            FROM insegnamenti_cds ic
+            JOIN insegnamenti i ON ic.insegnamento = i.id
+            WHERE ic.cds = %s AND ic.anno_accademico = %s
+        """ + filtro_insegnamenti + " ORDER BY ic.curriculum_codice", params)
+        for insegnamento, semestre, sovrapposizioni, titolo in cursor.fetchall():
+            self.semestre.setdefault(insegnamento, semestre)
+            self.semestri.setdefault(insegnamento, set()).add(semestre)
+            self.contatori.setdefault(insegnamento, set()).add(sovrapposizioni)
+            self.titoli[insegnamento] = titolo
+
+    def carica_insegnamenti(self, conn, insegnamenti):
+        """
+        Carica semestre, titolo e contatore degli insegnamenti indicati non ancora nel grafo,
+        per controllare in un grafo già caricato esami di altri insegnamenti.
+        """
+        mancanti = [ins for ins in dict.fromkeys(insegnamenti) if ins not in self.semestre]
+        if not mancanti:
+            return
+        cursor = conn.cursor()
+        try:
+            self._carica_insegnamenti(cursor, mancanti)
+        finally:
+            cursor.close()
+
+    # ---------- Modifiche in memoria ----------
+
+    def aggiungi_esame(self, exam_id, insegnamento, data_appello, periodo):
+        """Aggiunge un esame ufficiale al grafo."""
+        chiave = normalizza_slot(data_appello, periodo)
+        self.esami[exam_id] = (insegnamento, chiave)
+        self.slot.setdefault(chiave, {})[exam_id] = insegnamento
+        self.per_insegnamento.setdefault(insegnamento, {})[exam_id] = chiave
+
+    def rimuovi_esame(self, exam_id):
+        """Rimuove un esame dal grafo, restituendo lo slot che occupava."""
+        # Gli esami sono indicizzati per id intero, come letti dal database
+        exam_id = int(exam_id)
+        if exam_id not in self.esami:
+            return None
+        insegnamento, chiave = self.esami.pop(exam_id)
+        self.per_insegnamento.get(insegnamento, {}).pop(exam_id, None)
+        esami_slot = self.slot.get(chiave, {})
+        esami_slot.pop(exam_id, None)
+        if not esami_slot:
+            self.slot.pop(chiave, None)
+        return chiave
+
+    # ---------- Interrogazioni ----------
+
+    def hanno_docenti_comuni(self, insegnamento1_id, insegnamento2_id):
+        """Verifica se due insegnamenti hanno docenti in comune."""
+        return self.indice_docenti.hanno_docenti_comuni(insegnamento1_id, insegnamento2_id)
+
+    def insegnamenti_nello_slot(self, data_appello, periodo, exclude_exam_id=None):
+        """Insegnamenti con almeno un esame ufficiale nello slot."""
+        esami_slot = self.slot.get(normalizza_slot(data_appello, periodo), {})
+        return {ins for exam_id, ins in esami_slot.items() if exam_id != exclude_exam_id}
+
+    def esami_nello_slot(self, insegnamento_id, data_appello, periodo, exclude_exam_id=None):
+        """Id degli esami dell'insegnamento nello slot."""
+        esami_slot = self.slot.get(normalizza_slot(data_appello, periodo), {})
+        return [exam_id for exam_id, ins in esami_slot.items()
+                if ins == insegnamento_id and exam_id != exclude_exam_id]
+
+    def e_sovrapposizione(self, insegnamento_id, data_appello, periodo, exclude_exam_id=None):
+        """
+        Ritorna True se nello slot esiste almeno un esame di un altro insegnamento
+        compatibile (semestre compatibile e nessun docente in comune).
+        """
+        semestre_ins = self.semestre.get(insegnamento_id)
+        if semestre_ins is None:
+            return False
+
+        for altro_ins_id in self.insegnamenti_nello_slot(data_appello, periodo, exclude_exam_id):
+            if altro_ins_id == insegnamento_id:
+                continue
+            # Gli insegnamenti senza riga in insegnamenti_cds non partecipano
+            for altro_semestre in self.semestri.get(altro_ins_id, ()):
+                if not semestri_compatibili(semestre_ins, altro_semestre):
+                    continue
+                if self.hanno_docenti_comuni(insegnamento_id, altro_ins_id):
+                    continue
+                return True
+        return False
+
+    def slot_in_conflitto(self, data_appello, periodo):
+        """Insegnamenti per cui lo slot è una sovrapposizione."""
+        return {
+            ins for ins in self.insegnamenti_nello_slot(data_appello, periodo)
+            if self.e_sovrapposizione(ins, data_appello, periodo)
+        }
+
+def aggiorna_conflitti_slot(conn, cds, anno_accademico, slot, exam_id_rimosso=None, grafo=None):
+    """
+    Aggiornamento incrementale delle sovrapposizioni dopo una modifica agli slot indicati.
+    Ricalcola in memoria i flag di conflitto dei soli esami di quegli slot, li confronta
+    con quelli salvati in esami_slot_conflitti e applica ai contatori solo le differenze.
+    Ritorna il dizionario insegnamento -> variazione del contatore.
+    """
+    slot = {normalizza_slot(data_appello, periodo) for data_appello, periodo in slot}
+    if not slot:
+        return {}
+
+    if grafo is None:
+        grafo = GrafoSovrapposizioni.carica(conn, cds, anno_accademico, slot=slot)
+    if exam_id_rimosso is not None:
+        grafo.rimuovi_esame(exam_id_rimosso)
+
+    nuovi_flag = set()
+    for data_appello, periodo in slot:
+        for insegnamento_id in grafo.slot_in_conflitto(data_appello, periodo):
+            nuovi_flag.add((insegnamento_id, data_appello, periodo))
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT insegnamento, data_appello, periodo
+            FROM esami_slot_conflitti
+            WHERE cds = %s AND anno_accademico = %s AND (data_appello, periodo) IN %s
+        """, (cds, anno_accademico, tuple(slot)))
+        vecchi_flag = {tuple(row) for row in cursor.fetchall()}
+
+        aggiunti = nuovi_flag - vecchi_flag
+        rimossi = vecchi_flag - nuovi_flag
+
+        variazioni = {}
+        for insegnamento_id, _, _ in aggiunti:
+            variazioni[insegnamento_id] = variazioni.get(insegnamento_id, 0) + 1
+        for insegnamento_id, _, _ in rimossi:
+            variazioni[insegnamento_id] = variazioni.get(insegnamento_id, 0) - 1
+        variazioni = {ins: delta for ins, delta in variazioni.items() if delta}
+
+        if aggiunti:
+            execute_values(cursor, """
+                INSERT INTO esami_slot_conflitti (insegnamento, cds, anno_accademico, data_appello, periodo)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, [(ins, cds, anno_accademico, d, p) for ins, d, p in aggiunti])
+
+        if rimossi:
+            execute_values(cursor, """
+                DELETE FROM esami_slot_conflitti AS sc
+                USING (VALUES %s) AS v(insegnamento, cds, anno_accademico, data_appello, periodo)
+                WHERE sc.insegnamento = v.insegnamento
+                    AND sc.cds = v.cds
+                    AND sc.anno_accademico = v.anno_accademico
+                    AND sc.data_appello = v.data_appello
+                    AND sc.periodo = v.periodo
+            """, [(ins, cds, anno_accademico, d, p) for ins, d, p in rimossi],
+                template="(%s, %s, %s::integer, %s::date, %s::integer)")
+
+        if variazioni:
+            execute_values(cursor, """
+                UPDATE insegnamenti_cds AS ic
+                SET sovrapposizioni = ic.sovrapposizioni + v.delta
+                FROM (VALUES %s) AS v(insegnamento, cds, anno_accademico, delta)
+                WHERE ic.insegnamento = v.insegnamento
+                    AND ic.cds = v.cds
+                    AND ic.anno_accademico = v.anno_accademico
+            """, [(ins, cds, anno_accademico, delta) for ins, delta in variazioni.items()],
+                template="(%s, %s, %s::integer, %s::integer)")
+    finally:
+        cursor.close()
+
+    return variazioni
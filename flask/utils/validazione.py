@@ -0,0 +1,281 @@
+from datetime import datetime, date
+from utils.sessions import FinestreValide, ottieni_finestre_valide
+from utils.sovrapposizioni import GrafoSovrapposizioni, normalizza_slot
+from utils.aule import IndiceOccupazioneAule
+
+def _data(valore):
+    """Converte una data in formato stringa ISO in oggetto date."""
+    if isinstance(valore, datetime):
+        return valore.date()
+    if isinstance(valore, date):
+        return valore
+    return datetime.fromisoformat(valore).date()
+
+class ValidationContext:
+    """
+    Dati necessari a controlla_vincoli per un anno accademico, letti con poche
+    query all'inizio e poi consultati in memoria da tutte le regole.
+    Il contesto può essere esteso con nuovi esami da controllare tramite carica().
+    """
+
+    def __init__(self, conn, anno_accademico):
+        self.conn = conn
+        self.anno_accademico = anno_accademico
+        self.aule_valide = None
+        self.admin = {}               # username -> permessi_admin
+        self.titoli = {}              # insegnamento -> titolo
+        self.righe_cds = {}           # insegnamento -> righe di insegnamenti_cds dell'anno
+        self.sessioni_anticipate = {} # cds -> [(inizio, fine)]
+        self.esami_ufficiali = {}     # insegnamento -> [(id, data_appello)]
+        self.aule = IndiceOccupazioneAule()  # occupazione delle aule da parte degli esami locali
+        self.grafi = {}               # (cds, data, periodo) -> GrafoSovrapposizioni
+        self.sessioni_valide = {}     # docente -> FinestreValide
+        # Esami accettati durante un controllo multiplo, non ancora nel database
+        self.delta_sovrapposizioni = {}      # (cds, insegnamento) -> variazione del contatore
+        self._ultimo_id_fittizio = 0
+
+    # ---------- Caricamento ----------
+
+    def carica(self, insegnamenti, docenti, sezioni):
+        """Carica i dati mancanti per gli insegnamenti, i docenti e le sezioni indicate."""
+        cursor = self.conn.cursor()
+        try:
+            if self.aule_valide is None:
+                cursor.execute("SELECT nome FROM aule")
+                self.aule_valide = {row[0] for row in cursor.fetchall()}
+
+            nuovi_docenti = [d for d in set(docenti) if d is not None and d not in self.admin]
+            if nuovi_docenti:
+                for d in nuovi_docenti:
+                    self.admin[d] = False
+                cursor.execute("""
+                    SELECT username, permessi_admin FROM utenti WHERE username = ANY(%s)
+                """, (nuovi_docenti,))
+                for username, permessi_admin in cursor.fetchall():
+                    self.admin[username] = bool(permessi_admin)
+
+            nuovi_insegnamenti = [i for i in dict.fromkeys(insegnamenti) if i not in self.righe_cds]
+            if nuovi_insegnamenti:
+                self._carica_insegnamenti(cursor, nuovi_insegnamenti)
+
+        finally:
+            cursor.close()
+
+        self.aule.carica_esami(self.conn, [s['data_appello'] for s in sezioni])
+        self._carica_grafi(insegnamenti, sezioni)
+
+    def _carica_insegnamenti(self, cursor, insegnamenti):
+        for ins in insegnamenti:
+            self.righe_cds[ins] = []
+            self.esami_ufficiali[ins] = []
+
+        cursor.execute("SELECT id, titolo FROM insegnamenti WHERE id = ANY(%s)", (insegnamenti,))
+        self.titoli.update(dict(cursor.fetchall()))
+
+        cursor.execute("""
+            SELECT ic.insegnamento, ic.cds, ic.curriculum_codice, ic.semestre, ic.sovrapposizioni,
+                   c.nome_corso, u.username,
+                   EXISTS (
+                       SELECT 1 FROM cds cb
+                       WHERE cb.codice = ic.cds AND cb.anno_accademico = ic.anno_accademico AND cb.bloccato = TRUE
+                   ) AS cds_bloccato
+            FROM insegnamenti_cds ic
+            LEFT JOIN cds c ON ic.cds = c.codice AND ic.anno_accademico = c.anno_accademico
+                AND ic.curriculum_codice = c.curriculum_codice
+            LEFT JOIN utenti u ON ic.titolare = u.matricola
+            WHERE ic.insegnamento = ANY(%s) AND ic.anno_accademico = %s
+            ORDER BY ic.cds, ic.curriculum_codice
+        """, (insegnamenti, self.anno_accademico))
+        cds_coinvolti = set()
+        for ins, cds, curriculum, semestre, sovrapposizioni, nome_corso, titolare, bloccato in cursor.fetchall():
+            self.righe_cds[ins].append({
+                'cds': cds,
+                'curriculum_codice': curriculum,
+                'semestre': semestre,
+                'sovrapposizioni': sovrapposizioni,
+                'nome_corso': nome_corso,
+                'titolare': titolare,
+                'cds_bloccato': bloccato
+            })
+            cds_coinvolti.add(cds)
+
+        nuovi_cds = [c for c in cds_coinvolti if c not in self.sessioni_anticipate]
+        if nuovi_cds:
+            for c in nuovi_cds:
+                self.sessioni_anticipate[c] = []
+            cursor.execute("""
+                SELECT cds, inizio, fine FROM sessioni
+                WHERE cds = ANY(%s) AND anno_accademico = %s AND tipo_sessione = 'anticipata'
+            """, (nuovi_cds, self.anno_accademico))
+            for cds, inizio, fine in cursor.fetchall():
+                self.sessioni_anticipate[cds].append((inizio, fine))
+
+        cursor.execute("""
+            SELECT id, insegnamento, data_appello FROM esami
+            WHERE insegnamento = ANY(%s) AND anno_accademico = %s AND mostra_nel_calendario = true
+            ORDER BY data_appello
+        """, (insegnamenti, self.anno_accademico))
+        for exam_id, ins, data_appello in cursor.fetchall():
+            self.esami_ufficiali[ins].append((exam_id, data_appello))
+
+    def _carica_grafi(self, insegnamenti, sezioni):
+        # Un grafo per cds che copre tutti gli slot ufficiali non ancora caricati
+        slot_per_cds = {}
+        grafi_esistenti = {}
+        for sezione in sezioni:
+            if not sezione.get('mostra_nel_calendario'):
+                continue
+            chiave_slot = normalizza_slot(sezione['data_appello'], sezione['periodo'])
+            for ins in insegnamenti:
+                info = self.info_cds(ins)
+                if not info:
+                    continue
+                grafo = self.grafi.get((info['cds'], *chiave_slot))
+                if grafo is None:
+                    slot_per_cds.setdefault(info['cds'], set()).add(chiave_slot)
+                else:
+                    grafi_esistenti[id(grafo)] = grafo
+
+        # I grafi caricati da controlli precedenti devono conoscere anche gli insegnamenti
+        # nuovi, altrimenti i loro esami non risulterebbero in sovrapposizione
+        for grafo in grafi_esistenti.values():
+            grafo.carica_insegnamenti(self.conn, insegnamenti)
+
+        for cds, slot in slot_per_cds.items():
+            grafo = GrafoSovrapposizioni.carica(
+                self.conn, cds, self.anno_accademico, slot=slot, insegnamenti=insegnamenti
+            )
+            for chiave_slot in slot:
+                self.grafi[(cds, *chiave_slot)] = grafo
+
+    # ---------- Interrogazioni ----------
+
+    def is_admin(self, username):
+        return self.admin.get(username, False)
+
+    def info_cds(self, insegnamento_id):
+        """Prima riga di insegnamenti_cds dell'insegnamento per l'anno (None se assente)."""
+        righe = self.righe_cds.get(insegnamento_id)
+        return righe[0] if righe else None
+
+    def cds_bloccati(self, insegnamento_id):
+        """CdS bloccati a cui appartiene l'insegnamento, come lista di (codice, nome)."""
+        bloccati = {}
+        for riga in self.righe_cds.get(insegnamento_id, []):
+            if riga['nome_corso'] is not None and riga['cds_bloccato']:
+                bloccati.setdefault(riga['cds'], riga['nome_corso'])
+        return list(bloccati.items())
+
+    def titolare(self, insegnamento_id, docente_fallback):
+        """Username del docente titolare dell'insegnamento, o il fallback se non c'è."""
+        for riga in self.righe_cds.get(insegnamento_id, []):
+            if riga['titolare']:
+                return riga['titolare']
+        return docente_fallback
+
+    def data_in_sessione(self, data_appello, docente):
+        """Verifica se la data è in una sessione valida (vacanze escluse) per il docente."""
+        if docente not in self.sessioni_valide:
+            try:
+                self.sessioni_valide[docente] = ottieni_finestre_valide(self.anno_accademico, docente)
+            except Exception:
+                self.sessioni_valide[docente] = FinestreValide([])
+        return self.sessioni_valide[docente].contiene(_data(data_appello))
+
+    def in_sessione_anticipata(self, insegnamento_id, data_appello):
+        """Verifica se la data cade in una sessione anticipata di un CdS dell'insegnamento."""
+        data_appello = _data(data_appello)
+        cds_insegnamento = {riga['cds'] for riga in self.righe_cds.get(insegnamento_id, [])}
+        return any(
+            inizio and fine and inizio <= data_appello <= fine
+            for cds in cds_insegnamento
+            for inizio, fine in self.sessioni_anticipate.get(cds, [])
+        )
+
+    def esami_stesso_giorno(self, insegnamento_id, data_appello, exclude_exam_id=None):
+        data_appello = _data(data_appello)
+        return [d for exam_id, d in self.esami_ufficiali.get(insegnamento_id, [])
+                if d == data_appello and exam_id != exclude_exam_id]
+
+    def esami_entro_14_giorni(self, insegnamento_id, data_appello, exclude_exam_id=None):
+        """Date degli esami ufficiali a meno di 14 giorni (esclusa la data stessa)."""
+        data_appello = _data(data_appello)
+        return [d for exam_id, d in self.esami_ufficiali.get(insegnamento_id, [])
+                if d != data_appello and abs((d - data_appello).days) <= 13 and exam_id != exclude_exam_id]
+
+    def aula_occupata(self, aula, data_appello, periodo, exclude_exam_id=None, docente=None):
+        """
+        Verifica se l'aula è occupata nello slot. Le prenotazioni fatte nello stesso
+        controllo multiplo dallo stesso docente non contano come conflitto.
+        """
+        occupanti = self.aule.occupanti(aula, data_appello, periodo)
+        return any(
+            exam_id != exclude_exam_id and not (exam_id < 0 and docente_esame == docente)
+            for exam_id, docente_esame in occupanti.items()
+        )
+
+    def sovrapposizioni(self, cds, insegnamento_id, valore_salvato):
+        """Contatore di sovrapposizioni comprensivo degli esami accettati nel controllo in corso."""
+        return valore_salvato + self.delta_sovrapposizioni.get((cds, insegnamento_id), 0)
+
+    # ---------- Esami accettati durante un controllo multiplo ----------
+
+    def _nuovo_id_fittizio(self):
+        self._ultimo_id_fittizio -= 1
+        return self._ultimo_id_fittizio
+
+    def registra_sezione(self, insegnamenti, sezione, docente):
+        """
+        Aggiunge al contesto una sezione già validata, così che le sezioni e gli esami
+        controllati dopo vengano verificati anche rispetto ad essa.
+        Ritorna la lista delle operazioni per annullare la registrazione.
+        """
+        annulla = []
+        data_appello = _data(sezione['data_appello'])
+        chiave_slot = normalizza_slot(data_appello, sezione['periodo'])
+
+        aula = sezione.get('aula')
+        if aula:
+            prenotazione = self._nuovo_id_fittizio()
+            self.aule.aggiungi_esame(prenotazione, aula, *chiave_slot, docente)
+            annulla.append(lambda: self.aule.rimuovi_esame(prenotazione, aula, *chiave_slot))
+
+        if not sezione.get('mostra_nel_calendario'):
+            return annulla
+
+        for insegnamento_id in insegnamenti:
+            esame_fittizio = self._nuovo_id_fittizio()
+            esami_ins = self.esami_ufficiali.setdefault(insegnamento_id, [])
+            esami_ins.append((esame_fittizio, data_appello))
+            annulla.append(lambda lista=esami_ins, voce=(esame_fittizio, data_appello): lista.remove(voce))
+
+            info = self.info_cds(insegnamento_id)
+            grafo = self.grafi.get((info['cds'], *chiave_slot)) if info else None
+            if grafo is None:
+                continue
+
+            # I corsi per cui lo slot diventa una nuova sovrapposizione incrementano il contatore
+            prima = grafo.slot_in_conflitto(*chiave_slot)
+            grafo.aggiungi_esame(esame_fittizio, insegnamento_id, *chiave_slot)
+            nuovi = grafo.slot_in_conflitto(*chiave_slot) - prima
+            for ins in nuovi:
+                chiave = (info['cds'], ins)
+                self.delta_sovrapposizioni[chiave] = self.delta_sovrapposizioni.get(chiave, 0) + 1
+
+            def annulla_grafo(grafo=grafo, esame=esame_fittizio, cds=info['cds'], nuovi=nuovi):
+                grafo.rimuovi_esame(esame)
+                for ins in nuovi:
+                    self.delta_sovrapposizioni[(cds, ins)] -= 1
+            annulla.append(annulla_grafo)
+
+        return annulla
+
+    def annulla_registrazioni(self, registrazioni):
+        """Annulla le registrazioni di sezioni, dalla più recente."""
+        for annulla in reversed(registrazioni):
+            for operazione in reversed(annulla):
+                operazione()
+
+    def grafo(self, cds, data_appello, periodo):
+        """Grafo dei conflitti che contiene lo slot indicato."""
+        return self.grafi[(cds, *normalizza_slot(data_appello, periodo))]
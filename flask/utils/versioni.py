@@ -0,0 +1,60 @@
+import hashlib
+
+# Versione dei dati degli esami per anno accademico, usata da /api/get-esami per
+# le richieste condizionali (ETag) e per la sincronizzazione incrementale.
+# Ogni scrittura sugli esami incrementa la versione dell'anno nella propria
+# transazione: il lock sulla riga di versioni_esami fa sì che le versioni
+# diventino visibili nello stesso ordine in cui vengono assegnate.
+
+def incrementa_versione_esami(cursor, anno_accademico):
+    """Incrementa la versione degli esami dell'anno e restituisce il nuovo valore."""
+    cursor.execute("""
+        INSERT INTO versioni_esami (anno_accademico, versione)
+        VALUES (%s, 1)
+        ON CONFLICT (anno_accademico) DO UPDATE SET versione = versioni_esami.versione + 1
+        RETURNING versione
+    """, (anno_accademico,))
+    return cursor.fetchone()[0]
+
+def ottieni_versioni_esami(cursor):
+    """Versione corrente degli esami di ogni anno accademico (anni mai modificati assenti)."""
+    cursor.execute("SELECT anno_accademico, versione FROM versioni_esami")
+    return {anno: versione for anno, versione in cursor.fetchall()}
+
+def codifica_versioni(versioni):
+    """
+    Token delle versioni inviato al client, ad esempio '2024:15,2025:3'.
+    Il calendario mostra anche esami di anni diversi da quello selezionato,
+    quindi il token comprende le versioni di tutti gli anni.
+    """
+    return ','.join(f"{anno}:{versione}" for anno, versione in sorted(versioni.items()))
+
+def decodifica_versioni(token):
+    """Converte un token di codifica_versioni in dizionario anno -> versione (ValueError se non valido)."""
+    versioni = {}
+    for parte in filter(None, token.split(',')):
+        anno, versione = parte.split(':')
+        versioni[int(anno)] = int(versione)
+    return versioni
+
+def registra_esami_eliminati(cursor, exam_ids, anno_accademico, versione):
+    """Salva gli id degli esami eliminati con la versione dell'eliminazione."""
+    exam_ids = list(exam_ids)
+    if not exam_ids:
+        return
+    cursor.execute("""
+        INSERT INTO esami_eliminati (id, anno_accademico, versione)
+        SELECT unnest(%s::integer[]), %s, %s
+        ON CONFLICT (id) DO UPDATE SET versione = EXCLUDED.versione
+    """, (exam_ids, anno_accademico, versione))
+
+def segna_esami_modificati(cursor, anno_accademico, versione):
+    """
+    Assegna la nuova versione a tutti gli esami dell'anno, per quando cambiano dati
+    collegati mostrati nel calendario (titoli, CdS, docenti) e non gli esami stessi.
+    """
+    cursor.execute("UPDATE esami SET versione = %s WHERE anno_accademico = %s", (versione, anno_accademico))
+
+def calcola_etag(token_versioni, *parametri):
+    """ETag di una risposta: impronta delle versioni dei dati, dell'utente e dei parametri."""
+    return hashlib.sha1(repr((token_versioni,) + parametri).encode('utf-8')).hexdigest()
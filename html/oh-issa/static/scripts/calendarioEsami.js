@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     // Elementi DOM
     const btnGeneraCalendario = document.getElementById('btnGeneraCalendario');
     const btnEsportaXLSX = document.getElementById('btnEsportaXLSX');
+    const btnEsportaTuttiCds = document.getElementById('btnEsportaTuttiCds');
     
     // Prima inizializza l'anno accademico
     await window.AnnoAccademicoManager.initSelectedAcademicYear();
@@ -13,6 +14,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     // Event listeners
     btnGeneraCalendario.addEventListener('click', generaCalendario);
     btnEsportaXLSX.addEventListener('click', esportaXLSX);
+    btnEsportaTuttiCds.addEventListener('click', esportaTuttiCds);
 });
 
 // Carica gli anni accademici per il selettore
@@ -443,6 +445,43 @@ function esportaXLSX() {
         });
 }
 
+// Esporta in un unico zip i calendari di tutti i corsi di studio dell'anno selezionato.
+// La generazione avviene in background: si mostra l'avanzamento e poi si scarica il file
+async function esportaTuttiCds() {
+    const annoAccademicoValue = document.getElementById('selectAnnoAccademico').value;
+    
+    if (!annoAccademicoValue) {
+        mostraErrore('Seleziona l\'Anno Accademico prima di esportare');
+        return;
+    }
+    
+    const btnEsportaTuttiCds = document.getElementById('btnEsportaTuttiCds');
+    const calendarioContainer = document.getElementById('calendarioContainer');
+    const originalContent = calendarioContainer.innerHTML;
+    const loading = document.createElement('div');
+    loading.className = 'loading';
+    loading.textContent = 'Generazione dei calendari in corso...';
+    calendarioContainer.innerHTML = '';
+    calendarioContainer.appendChild(loading);
+    btnEsportaTuttiCds.disabled = true;
+    
+    try {
+        await window.scaricaFileJob(
+            `/api/oh-issa/esporta-calendari-esami?anno=${annoAccademicoValue}`,
+            (percentuale, messaggio) => {
+                loading.textContent = `${messaggio || 'Generazione dei calendari in corso...'} (${percentuale}%)`;
+            }
+        );
+        calendarioContainer.innerHTML = originalContent;
+    } catch (error) {
+        console.error('Errore nell\'esportazione dei calendari:', error);
+        calendarioContainer.innerHTML = originalContent;
+        mostraErrore('Errore nell\'esportazione dei calendari: ' + error.message);
+    } finally {
+        btnEsportaTuttiCds.disabled = false;
+    }
+}
+
 // Mostra un messaggio di errore
 function mostraErrore(message) {
     const calendarioContainer = document.getElementById('calendarioContainer');
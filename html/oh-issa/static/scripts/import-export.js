@@ -1,5 +1,7 @@
 let selectedAnno = null;
 let hasProgData = false;
+// File U-GOV dell'ultima anteprima e hash con cui il server lo conserva già analizzato
+let anteprimaUgov = null;
 
 document.addEventListener('DOMContentLoaded', function() {
   initializeAnnoSelector();
@@ -11,7 +13,10 @@ document.addEventListener('DOMContentLoaded', function() {
       return;
     }
     const anticipata = document.getElementById('anticipataExportToggle').checked;
-    window.location.href = `/api/oh-issa/download-file-esse3?anno=${selectedAnno}&anticipata=${anticipata}`;
+    showMessage('info', 'Generazione del file ESSE3 in corso...');
+    scaricaFileJob(`/api/oh-issa/download-file-esse3?anno=${selectedAnno}&anticipata=${anticipata}`, mostraAvanzamento)
+      .then(() => showMessage('success', 'File ESSE3 generato.'))
+      .catch(error => showMessage('error', `Errore durante l'export: ${error.message}`));
   });
 
   const downloadEasyAcademyButton = document.getElementById('downloadEasyAcademyButton');
@@ -21,7 +26,10 @@ document.addEventListener('DOMContentLoaded', function() {
       return;
     }
     const includeDetails = document.getElementById('eaExportToggle').checked;
-    window.location.href = `/api/oh-issa/download-file-easyacademy?anno=${selectedAnno}&details=${includeDetails}`;
+    showMessage('info', 'Generazione del file EasyAcademy in corso...');
+    scaricaFileJob(`/api/oh-issa/download-file-easyacademy?anno=${selectedAnno}&details=${includeDetails}`, mostraAvanzamento)
+      .then(() => showMessage('success', 'File EasyAcademy generato.'))
+      .catch(error => showMessage('error', `Errore durante l'export: ${error.message}`));
   });
 
   // Gestione caricamento file UGOV
@@ -39,16 +47,20 @@ document.addEventListener('DOMContentLoaded', function() {
       // Mostra messaggio di caricamento
       showMessage('info', 'Caricamento in corso...');
       
-      // Crea un FormData e carica il file
-      const formData = new FormData();
-      formData.append('file', fileInput.files[0]);
-      
       // Invia richiesta al server
-      fetch('/api/oh-issa/upload-file-ugov', {
-        method: 'POST',
-        body: formData
-      })
-        .then(response => response.json())
+      caricaFileUgov(fileInput.files[0])
+        .then(data => {
+          // Le righe da eliminare vanno confermate esplicitamente prima di applicare l'import
+          if (data.status === 'conferma_richiesta') {
+            if (!confirm(messaggioConfermaEliminazioni(data))) {
+              return { status: 'error', message: 'Import annullato: nessuna modifica applicata.' };
+            }
+            anteprimaUgov = { file: impronta(fileInput.files[0]), hash: data.hash };
+            showMessage('info', 'Caricamento in corso...');
+            return caricaFileUgov(fileInput.files[0], true);
+          }
+          return data;
+        })
         .then(data => {
           if (data.status === 'success') {
             showMessage('success', data.message, data.details);
@@ -90,6 +102,8 @@ document.addEventListener('DOMContentLoaded', function() {
           const msg = data && data.message ? data.message : `Errore HTTP ${response.status}`;
           throw new Error(msg);
         }
+        const hash = response.headers.get('X-Ugov-Hash');
+        anteprimaUgov = hash ? { file: impronta(input.files[0]), hash } : null;
         return response.blob();
       })
       .then(blob => {
@@ -112,6 +126,50 @@ document.addEventListener('DOMContentLoaded', function() {
   });
 });
 
+// Identifica un file locale senza leggerne il contenuto
+function impronta(file) {
+  return `${file.name}|${file.size}|${file.lastModified}`;
+}
+
+// Testo della richiesta di conferma con le righe che l'import incrementale eliminerebbe
+function messaggioConfermaEliminazioni(data) {
+  const MAX_RIGHE = 20;
+  const righe = data.eliminazioni.slice(0, MAX_RIGHE).map(riga => `- ${riga}`);
+  if (data.eliminazioni.length > MAX_RIGHE) {
+    righe.push(`... e altre ${data.eliminazioni.length - MAX_RIGHE} (elenco completo nell'anteprima)`);
+  }
+  return `${data.message}\n\n${righe.join('\n')}\n\nProcedere con l'import?`;
+}
+
+// Carica il file U-GOV: se è lo stesso dell'ultima anteprima invia solo l'hash,
+// e il server usa l'analisi già fatta; se questa è scaduta reinvia il file
+async function caricaFileUgov(file, confermaEliminazioni = false) {
+  const incrementale = document.getElementById('ugovIncrementaleToggle').checked ? 'true' : 'false';
+  const conferma = confermaEliminazioni ? 'true' : 'false';
+  if (anteprimaUgov && anteprimaUgov.file === impronta(file)) {
+    const formData = new FormData();
+    formData.append('hash', anteprimaUgov.hash);
+    formData.append('incrementale', incrementale);
+    formData.append('conferma_eliminazioni', conferma);
+    const data = await eseguiJob('/api/oh-issa/upload-file-ugov', { method: 'POST', body: formData }, mostraAvanzamento);
+    if (data.codice !== 'hash_scaduto') {
+      return data;
+    }
+    anteprimaUgov = null;
+  }
+  
+  const formData = new FormData();
+  formData.append('file', file);
+  formData.append('incrementale', incrementale);
+  formData.append('conferma_eliminazioni', conferma);
+  return eseguiJob('/api/oh-issa/upload-file-ugov', { method: 'POST', body: formData }, mostraAvanzamento);
+}
+
+// Mostra la fase in corso di un job in background
+function mostraAvanzamento(percentuale, messaggio) {
+  showMessage('info', `${messaggio || 'Operazione in corso'}... (${percentuale}%)`);
+}
+
 function initializeAnnoSelector() {
   fetch('/api/get-anni-accademici')
     .then(response => response.json())
@@ -8,15 +8,18 @@ document.addEventListener('DOMContentLoaded', function() {
       btn.textContent = "Ricalcolo in corso...";
       resultDiv.textContent = "";
       try {
-        const response = await fetch('/api/oh-issa/ricalcola-sovrapposizioni', { method: 'GET' });
-        const data = await response.json();
-        if (response.ok && data.status === 'success') {
+        // Il ricalcolo gira in background: si attende la fine del job mostrando la fase
+        const data = await eseguiJob('/api/oh-issa/ricalcola-sovrapposizioni', { method: 'POST' }, (percentuale, messaggio) => {
+          btn.textContent = `Ricalcolo in corso... ${percentuale}%`;
+          if (messaggio) resultDiv.textContent = messaggio;
+        });
+        if (data && data.status === 'success') {
           resultDiv.innerHTML = `<span style="color:green;">${data.message}</span>`;
         } else {
           resultDiv.innerHTML = `<span style="color:red;">${data.message || 'Errore durante il ricalcolo.'}</span>`;
         }
       } catch (e) {
-        resultDiv.innerHTML = `<span style="color:red;">Errore di rete o server.</span>`;
+        resultDiv.innerHTML = `<span style="color:red;">${e.message || 'Errore di rete o server.'}</span>`;
       }
       btn.disabled = false;
       btn.textContent = "Ricalcola Sovrapposizioni Esami";
@@ -25,6 +25,10 @@ document.addEventListener("DOMContentLoaded", async function () {
   let dateValide = [];
   let eventsCache = [];
   let lastFetchTime = 0;
+  // Sincronizzazione incrementale: versione dei dati e parametri dell'ultima risposta completa
+  let versioneEsami = null;
+  let parametriEsami = null;
+  let esamiPerId = new Map();
   const dropdowns = { insegnamenti: null, sessioni: null };
   let calendar = null;
 
@@ -213,9 +217,40 @@ document.addEventListener("DOMContentLoaded", async function () {
               params.append("anno", selectedYear);
             }
 
+            // Con gli stessi parametri chiede solo gli esami cambiati dall'ultima versione
+            const chiaveParametri = params.toString();
+            const incrementale = versioneEsami !== null && parametriEsami === chiaveParametri;
+            if (incrementale) {
+              params.append("since", versioneEsami);
+            }
+
             fetch(`/api/get-esami?${params.toString()}`)
-              .then(response => response.ok ? response.json() : Promise.reject(`HTTP ${response.status}`))
-              .then(events => {
+              .then(response => {
+                if (!response.ok) return Promise.reject(`HTTP ${response.status}`);
+                return response.json().then(data => ({ data, versione: response.headers.get("X-Versione-Esami") }));
+              })
+              .then(({ data, versione }) => {
+                if (incrementale) {
+                  // Applica le differenze: rimuove gli eliminati e sostituisce i modificati
+                  (data.eliminati || []).forEach(id => esamiPerId.delete(id));
+                  const modificati = new Map();
+                  (data.esami || []).forEach(event => {
+                    if (!modificati.has(event.id)) modificati.set(event.id, []);
+                    modificati.get(event.id).push(event);
+                  });
+                  modificati.forEach((righe, id) => esamiPerId.set(id, righe));
+                  versioneEsami = data.versione;
+                } else {
+                  esamiPerId = new Map();
+                  (data || []).forEach(event => {
+                    if (!esamiPerId.has(event.id)) esamiPerId.set(event.id, []);
+                    esamiPerId.get(event.id).push(event);
+                  });
+                  versioneEsami = versione;
+                  parametriEsami = chiaveParametri;
+                }
+                const events = Array.from(esamiPerId.values()).flat();
+
                 const validEvents = (events || []).filter(ev => ev?.start).map(event => {
                   const esameDelDocente = event.extendedProps?.esameDelDocente;
                   
@@ -4,8 +4,7 @@ const ExamFileImporter = {
   // Configurazione
   config: {
     allowedExtensions: ['xlsx'],
-    maxFileSize: 1024 * 1024, // 1MB, un file excel non dovrebbe essere così grande
-    progressUpdateInterval: 100
+    maxFileSize: 1024 * 1024 // 1MB, un file excel non dovrebbe essere così grande
   },
 
   // Inizializzazione del modulo
@@ -373,19 +372,19 @@ const ExamFileImporter = {
     this.initializeUpload();
     
     const formData = this.prepareFormData(file);
-    const progressInterval = this.startProgressSimulation();
+    const progressBar = document.getElementById('uploadProgressBar');
 
     try {
-      const response = await fetch('/api/import-exams-from-file', {
+      // L'import gira in background sul server: la barra segue l'avanzamento del job
+      const data = await eseguiJob('/api/import-exams-from-file', {
         method: 'POST',
         body: formData
+      }, percentuale => {
+        progressBar.style.width = `${percentuale}%`;
       });
 
-      clearInterval(progressInterval);
-      const data = await response.json();
       this.handleUploadResponse(data);
     } catch (error) {
-      clearInterval(progressInterval);
       this.handleUploadError(error);
     }
   },
@@ -420,19 +419,6 @@ const ExamFileImporter = {
     return formData;
   },
 
-  // Simula progresso upload
-  startProgressSimulation() {
-    const progressBar = document.getElementById('uploadProgressBar');
-    let progress = 0;
-    
-    return setInterval(() => {
-      progress += 5;
-      if (progress <= 90) {
-        progressBar.style.width = `${progress}%`;
-      }
-    }, this.config.progressUpdateInterval);
-  },
-
   // Gestisce risposta upload
   handleUploadResponse(data) {
     const progressBar = document.getElementById('uploadProgressBar');
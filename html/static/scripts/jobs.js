@@ -0,0 +1,50 @@
+// Operazioni lunghe eseguite dal server in background (import, export, ricalcoli):
+// la richiesta di avvio risponde con l'id del job, di cui qui si interroga lo stato
+// fino alla fine invece di tenere aperta la richiesta.
+const INTERVALLO_POLLING_JOB = 1000; // ms
+
+// Attende la fine di un job e ne restituisce lo stato finale.
+// onAvanzamento(percentuale, messaggio) è opzionale; lancia un errore se il job fallisce.
+async function attendiJob(jobId, onAvanzamento) {
+  while (true) {
+    const response = await fetch(`/api/jobs/${jobId}`);
+    const data = await response.json();
+    if (!response.ok || data.status !== 'success') {
+      throw new Error(data.message || `Errore HTTP ${response.status}`);
+    }
+
+    const job = data.job;
+    if (job.stato === 'completato') return job;
+    if (job.stato === 'errore') throw new Error(job.messaggio || 'Operazione non riuscita');
+
+    if (onAvanzamento) onAvanzamento(job.avanzamento, job.messaggio);
+    await new Promise(resolve => setTimeout(resolve, INTERVALLO_POLLING_JOB));
+  }
+}
+
+// Avvia un job e restituisce il suo risultato JSON a job concluso. Se il server
+// non avvia il job (ad esempio per dati non validi) restituisce la risposta ricevuta.
+async function eseguiJob(url, opzioni, onAvanzamento) {
+  const response = await fetch(url, opzioni);
+  const data = await response.json();
+  if (!data.job_id) return data;
+
+  const job = await attendiJob(data.job_id, onAvanzamento);
+  return job.risultato;
+}
+
+// Avvia un job che produce un file e lo scarica a job concluso
+async function scaricaFileJob(url, onAvanzamento) {
+  const response = await fetch(url);
+  const data = await response.json();
+  if (!data.job_id) {
+    throw new Error(data.message || data.error || `Errore HTTP ${response.status}`);
+  }
+
+  await attendiJob(data.job_id, onAvanzamento);
+  window.location.href = `/api/jobs/${data.job_id}/file`;
+}
+
+window.attendiJob = attendiJob;
+window.eseguiJob = eseguiJob;
+window.scaricaFileJob = scaricaFileJob;